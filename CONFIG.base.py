@@ -15,3 +15,25 @@ PORT=random.randint(5000,8000)
 DEBUG = False # Because it's unsafe to run outside localhost
 GOOGLE_LICENSE_KEY = ".goog_app_key.json"
 
+### Where session contents are kept: "memory" (lost on restart),
+### "sqlite" (in the SESSION_DB file), or "cookie" (flask's signed cookie)
+SESSION_STORE = "memory"
+SESSION_DB = "sessions.db"
+
+### Keep calendar events between requests, refreshing them with
+### incremental syncs at most every EVENT_CACHE_TTL seconds
+EVENT_CACHE = True
+EVENT_CACHE_TTL = 300
+
+### Keep the busy and free times of each day, so that changing the
+### date range only fetches and computes the new days
+DAY_CACHE = True
+
+### Most days of free times remembered, for all users together
+COMPLEMENT_MEMO_ENTRIES = 10000
+
+### Timings of each stage of handling requests, shown at /metrics to
+### requests from this machine; with METRICS_LOG each request's timings
+### are also logged as JSON
+METRICS = False
+METRICS_LOG = False
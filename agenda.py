@@ -2,16 +2,70 @@
 An Agenda is a list-like container of Appt (appointment).
 """
 
+import array
+import bisect
+import calendar
+import collections
 import datetime
+import heapq
+import itertools
+import logging
+import re
+import struct
+import sys
+import threading
 import arrow
 import datetime
+from dateutil import tz
+
+import timecodec
+
+try:
+    import numpy   # Optional; only needed for vectorized agendas
+except ImportError:
+    numpy = None
+
+log = logging.getLogger(__name__)
+
+# A line of an agenda file that could not be read: its line number
+# (counting from 1), the line, and what was wrong with it
+AgendaError = collections.namedtuple("AgendaError", "line_number line message")
+
+# "MM/DD/YYYY h:mm A-MM/DD/YYYY h:mm A|desc", as Appt.from_string
+# reads it, for reading agenda files without going through arrow.
+# Lines that don't match are left to Appt.from_string.
+_APPT_LINE = re.compile(
+    r"(\d{2})/(\d{2})/(\d{4}) (\d{1,2}):(\d{2}) (am|pm)\s*-"
+    r"\s*(\d{2})/(\d{2})/(\d{4}) (\d{1,2}):(\d{2}) (am|pm)\s*\|([^|]*)$",
+    re.IGNORECASE)
+_UTC = tz.tzutc()
+
+# The binary form of an agenda (Agenda.to_bytes): a header of
+#    magic, number of appointments n, descriptions d, time zones z
+# then, all little-endian,
+#    int64 begins[n], int64 ends[n]                epoch seconds
+#    int32 descs[n], begin_tzs[n], end_tzs[n]      indexes into the tables
+#    int64 offsets[z]                               time zones, as UTC offsets
+#    int32 desc_ends[d]                             ends of each description in
+#    utf-8 text                                     the text that follows
+_BYTES_MAGIC = b"AGD1"
+_BYTES_HEADER = struct.Struct("<4sIII")
+_NO_TZ = -2 ** 63     # Offset standing for a time zone of None
+_FIXED_TZ = (tz.tzutc, tz.tzoffset, datetime.timezone)   # Same offset at all times
 
 class Appt:
 
     """
     A single appointment, starting on a particular
     date and time, and ending at a later time the same day.
+
+    Begin and end are kept as integer epoch seconds (plus the time 
+    zone each was given in), so that comparing appointments is 
+    integer-only; the begin and end attributes rebuild arrow objects
+    when they are asked for.
     """
+
+    __slots__ = ("_begin", "_end", "_begin_tz", "_end_tz", "desc")
     
     def __init__(self, begin, end, desc):
         """Create an appointment.
@@ -24,13 +78,49 @@ class Appt:
         Raises: 
         	ValueError if appointment ends before it begins
         """
-        self.begin = begin
-        self.end = end
-        if begin >= end :
+        self._begin = begin.timestamp
+        self._end = end.timestamp
+        self._begin_tz = begin.tzinfo
+        self._end_tz = end.tzinfo
+        if self._begin >= self._end :
             raise ValueError("Appointment end must be after begin")
         self.desc = desc
         return
 
+    @classmethod
+    def from_epoch(cls, begin, end, desc, begin_tz, end_tz=None):
+        """Create an appointment directly from epoch seconds, without
+        going through arrow.
+
+        Arguments:
+            begin, end: Integer epoch seconds, begin < end.
+            desc: A string describing the appointment
+            begin_tz: Time zone (tzinfo) the begin time is shown in
+            end_tz: Time zone the end time is shown in; defaults to begin_tz
+
+        Raises: 
+        	ValueError if appointment ends before it begins
+        """
+        if begin >= end :
+            raise ValueError("Appointment end must be after begin")
+        appt = cls.__new__(cls)
+        appt._begin = begin
+        appt._end = end
+        appt._begin_tz = begin_tz
+        appt._end_tz = begin_tz if end_tz is None else end_tz
+        appt.desc = desc
+        return appt
+
+    @property
+    def begin(self):
+        """An arrow date and time object. When the appointment starts."""
+        return arrow.Arrow.fromtimestamp(self._begin, self._begin_tz)
+
+    @property
+    def end(self):
+        """An arrow date and time object. When the appointment ends."""
+        return arrow.Arrow.fromtimestamp(self._end, self._end_tz)
+
 
     @classmethod
     def from_dict(cls, event_dict): #from an apt in the form of an item in busy_list or free_list; both lists are same form
@@ -39,9 +129,9 @@ class Appt:
         for it. The dictionary representation has a "desc", "begin" and "end" term.  
         """
         desc = event_dict["desc"]
-        begin = arrow.get(event_dict["begin"])
-        end = arrow.get(event_dict["end"])
-        return Appt(begin, end, desc)
+        begin, begin_tz = timecodec.parse_epoch(event_dict["begin"])
+        end, end_tz = timecodec.parse_epoch(event_dict["end"])
+        return Appt.from_epoch(begin, end, desc, begin_tz, end_tz)
 
    
    
@@ -54,8 +144,8 @@ class Appt:
         """
         dict_rep = {}
         dict_rep["desc"] = self.desc
-        dict_rep["begin"] = self.begin.isoformat()
-        dict_rep["end"] = self.end.isoformat()
+        dict_rep["begin"] = timecodec.isoformat(self._begin, self._begin_tz)
+        dict_rep["end"] = timecodec.isoformat(self._end, self._end_tz)
         return dict_rep
         
 
@@ -91,7 +181,7 @@ class Appt:
         Returns: 
         	True iff this Appt is done by the time other begins.
         """
-        return self.end <= other.begin
+        return self._end <= other._begin
         
     def __gt__(self, other):
         """Does other appointment finish before this begins?
@@ -112,7 +202,7 @@ class Appt:
             True iff there exists some duration (greater than zero)
             between this Appt and other. 
         """
-        return  not (self < other or other < self)
+        return  not (self._end <= other._begin or other._end <= self._begin)
             
     def intersect(self, other, desc=""):
         """Return an appointment representing the period in
@@ -135,9 +225,10 @@ class Appt:
         # We know the day must be the same. 
         # Find overlap of times: 
         #   Later of two begin times, earlier of two end times
-        new_begin = max(self.begin, other.begin)
-        new_end = min(self.end, other.end) 
-        return Appt(new_begin, new_end, desc)
+        first = self if self._begin >= other._begin else other
+        last = self if self._end <= other._end else other
+        return Appt.from_epoch(first._begin, last._end, desc, 
+                               first._begin_tz, last._end_tz)
 
     def union(self, other, desc=""):
         """Return an appointment representing the combined period in
@@ -160,9 +251,10 @@ class Appt:
         # We know the day must be the same. 
         # Find overlap of times: 
         #   Earlier of two begin times, later of two end times
-        begin = min(self.begin, other.begin)
-        end = max(self.end, other.end)
-        return Appt(begin, end, desc)
+        first = self if self._begin <= other._begin else other
+        last = self if self._end >= other._end else other
+        return Appt.from_epoch(first._begin, last._end, desc, 
+                               first._begin_tz, last._end_tz)
 
 
     def __str__(self):
@@ -180,19 +272,29 @@ class Agenda:
     with some agenda-specific methods.
     """
 
-    def __init__(self):
-        """An empty agenda."""
+    def __init__(self, vectorized=False):
+        """An empty agenda.
+
+        Arguments:
+            vectorized: If True, and numpy is installed, normalize,
+                complement and intersect are computed with numpy
+                arrays of the begin and end times.  Otherwise (and
+                always when numpy is missing) they are pure Python.
+                Agendas computed from this one inherit the choice.
+        """
         self.appts = [ ]
+        self.vectorized = vectorized and numpy is not None
+        self._index = None   # IntervalIndex, built by the first query
     
        
     
     @classmethod
-    def from_list(cls, apt_list): #list of lists
+    def from_list(cls, apt_list, vectorized=False): #list of lists
         """
         Converts a list of dictionaries representing an agenda of appts into an agenda object
         holding Appt objects. 
         """
-        total_agenda = Agenda()
+        total_agenda = Agenda(vectorized)
         for apt in apt_list:
             apt_obj = Appt.from_dict(apt)
             total_agenda.append(apt_obj)
@@ -209,34 +311,174 @@ class Agenda:
             apt_list.append(dict_rep)
         return apt_list
        
+    def to_bytes(self):
+        """
+        A compact binary form of this agenda, for caching and sending
+        to other processes: the begin and end times as packed arrays of
+        epoch seconds, with each distinct description and time zone
+        stored once.  Time zones are kept as their UTC offset at the
+        time, so an appointment in local time comes back with a fixed
+        offset (the same instant, shown the same way).
+        """
+        descs = { }
+        offsets = { }
+        fixed = { }    # id of a fixed-offset tzinfo -> its index in offsets
+        def tz_index(epoch, tzinfo):
+            index = fixed.get(id(tzinfo))
+            if index is not None:
+                return index
+            if tzinfo is None:
+                offset = _NO_TZ
+            else:
+                offset = int(datetime.datetime.fromtimestamp(epoch, tzinfo).utcoffset().total_seconds())
+            index = offsets.setdefault(offset, len(offsets))
+            if tzinfo is None or isinstance(tzinfo, _FIXED_TZ):
+                fixed[id(tzinfo)] = index
+            return index
+        begins = array.array("q", [ appt._begin for appt in self.appts ])
+        ends = array.array("q", [ appt._end for appt in self.appts ])
+        desc_ids = array.array("i", [ descs.setdefault(appt.desc, len(descs))
+                                      for appt in self.appts ])
+        begin_tzs = array.array("i", [ tz_index(appt._begin, appt._begin_tz)
+                                       for appt in self.appts ])
+        end_tzs = array.array("i", [ tz_index(appt._end, appt._end_tz)
+                                     for appt in self.appts ])
+        texts = [ desc.encode("utf-8") for desc in descs ]
+        desc_ends = array.array("i", itertools.accumulate(len(text) for text in texts))
+        parts = [ begins, ends, desc_ids, begin_tzs, end_tzs,
+                  array.array("q", offsets), desc_ends ]
+        if sys.byteorder == "big":
+            for part in parts:
+                part.byteswap()
+        header = _BYTES_HEADER.pack(_BYTES_MAGIC, len(self.appts), len(descs), len(offsets))
+        return b"".join([ header ] + [ part.tobytes() for part in parts ] + texts)
+
+    @classmethod
+    def from_bytes(cls, data, vectorized=False):
+        """
+        Factory: the agenda from its to_bytes form.  data can be bytes or
+        any buffer, such as an mmap of a file written with to_bytes, in
+        which case the times are read straight from the mapped file.
+        No dates or times are parsed.
+
+        Raises:
+            ValueError if data is not an agenda's binary form
+        """
+        data = memoryview(data).cast("B")
+        if len(data) < _BYTES_HEADER.size:
+            raise ValueError("Not an agenda: too short")
+        magic, count, desc_count, tz_count = _BYTES_HEADER.unpack_from(data)
+        if magic != _BYTES_MAGIC:
+            raise ValueError("Not an agenda: bad magic number")
+        pos = _BYTES_HEADER.size
+        def take(typecode, n):
+            nonlocal pos
+            size = n * array.array(typecode).itemsize
+            if pos + size > len(data):
+                raise ValueError("Not an agenda: truncated")
+            chunk = data[pos:pos + size]
+            pos += size
+            if sys.byteorder == "big":
+                swapped = array.array(typecode, chunk.tobytes())
+                swapped.byteswap()
+                return swapped
+            return chunk.cast(typecode)
+        begins = take("q", count)
+        ends = take("q", count)
+        desc_ids = take("i", count)
+        begin_tzs = take("i", count)
+        end_tzs = take("i", count)
+        tzinfos = [ None if offset == _NO_TZ else timecodec.tzoffset(offset)
+                    for offset in take("q", tz_count) ]
+        desc_ends = take("i", desc_count)
+        text = data[pos:].tobytes()
+        descs = [ ]
+        previous = 0
+        for end in desc_ends:
+            descs.append(text[previous:end].decode("utf-8"))
+            previous = end
+        agenda = cls(vectorized)
+        new = Appt.__new__
+        appts = agenda.appts
+        for i in range(count):
+            appt = new(Appt)
+            appt._begin = begins[i]
+            appt._end = ends[i]
+            appt._begin_tz = tzinfos[begin_tzs[i]]
+            appt._end_tz = tzinfos[end_tzs[i]]
+            appt.desc = descs[desc_ids[i]]
+            appts.append(appt)
+        return agenda
+
     @classmethod
-    def from_file(cls, f):
+    def from_file(cls, f, vectorized=False, errors=None):
         """Factory: Read an agenda from a file
         
         Arguments: 
             f:  A file object (as returned by io.open) or
                an object that emulates a file (like stringio). 
+            vectorized: As for the Agenda constructor
+            errors: (optional) A list, to which an AgendaError is 
+               appended for each line that can't be read.  Without
+               it, such lines are logged as warnings.  Either way
+               they are skipped.
         returns: 
             An Agenda object
         """
-        agenda = cls()
-        for line in f:
-            line = line.strip()
-            if line == "" or line.startswith("#"):
-                # Skip blank lines and comments
-                pass
-            else: 
-                try: 
-                    agenda.append(Appt.from_string(line))
-                except ValueError as err: 
-                    print("Failed on line: ", line)
-                    print(err)
+        agenda = cls(vectorized)
+        agenda.appts = list(read_appts(f, errors))
         return agenda
 
+    @classmethod
+    def read_chunks(cls, f, chunk_size, vectorized=False, errors=None):
+        """Read a (large) agenda file as a series of agendas of at most
+        chunk_size appointments each, in file order, so that only one
+        chunk need be in memory at a time.  Arguments as for from_file.
+        """
+        appts = read_appts(f, errors)
+        while True:
+            chunk = cls(vectorized)
+            chunk.appts = list(itertools.islice(appts, chunk_size))
+            if not chunk.appts:
+                return
+            yield chunk
+
 
     def append(self,appt):
         """Add an Appt to the agenda."""
         self.appts.append(appt)
+        if self._index is not None and self._index.source is self.appts:
+            self._index.add(appt)
+
+    def index(self):
+        """
+        The IntervalIndex of this agenda's appointments, built the first
+        time it is needed and then kept up to date by append().  It is
+        rebuilt if appts is replaced by another list (as normalize does)
+        or changes length.  Changes that keep the same list and length,
+        like agenda.appts[i] = appt, aren't noticed: assign a new list
+        to appts after making them.
+        """
+        index = self._index
+        if index is None or index.source is not self.appts or len(index) != len(self.appts):
+            index = self._index = IntervalIndex(self.appts)
+        return index
+
+    def at(self, when):
+        """
+        The appointments going on at an instant (an arrow object or
+        epoch seconds), in order of begin time.  Empty if none.
+        """
+        if not isinstance(when, int):
+            when = when.timestamp
+        return self.index().overlapping(when, when + 1)
+
+    def overlapping(self, appt):
+        """
+        The appointments that overlap appt, in order of begin time.
+        Uses the interval index instead of checking every appointment.
+        """
+        return self.index().overlapping(appt._begin, appt._end)
 
     def intersect(self,other,desc=""): 
         """Return a new agenda containing appointments
@@ -252,17 +494,124 @@ class Agenda:
            desc:  If provided, this string becomes the title of
                 all the appointments in the result.
         """
-        default_desc = (desc == "")
-        result = Agenda()
-        for thisappt in self.appts:
-            if default_desc: 
-                desc = thisappt.desc
-            for otherappt in other.appts:
-                if thisappt.overlaps(otherappt):
-                    result.append(thisappt.intersect(otherappt,desc))
-        
+        result = Agenda(self.vectorized)
+        if self.vectorized:
+            pairs = _np_overlapping_pairs(self.appts, other.appts)
+        else:
+            pairs = overlapping_pairs(self.appts, other.appts)
+        for i, j in pairs:
+            result.append(self.appts[i].intersect(other.appts[j], desc))
         return result
 
+    @classmethod
+    def intersect_all(cls, agendas, desc=""):
+        """Intersect any number of agendas in a single sweep.
+
+        Each agenda is normalized first, so the result is the same
+        as normalizing all of them and chaining intersect() from left
+        to right, but the boundaries of all agendas are merged with a
+        heap instead of building the intermediate agendas.
+
+        Arguments:
+           agendas: A list of Agenda objects
+           desc:  If provided, this string becomes the title of
+                all the appointments in the result.  Otherwise titles
+                are taken from the first agenda.
+        Returns:
+           A new normalized agenda of the times covered by an
+           appointment in every one of the agendas.
+        """
+        result = cls()
+        agendas = [agenda.normalized() for agenda in agendas]
+        if len(agendas) == 0:
+            return result
+        # Ends sort before begins at the same instant, so touching
+        # appointments are never merged (just as normalize() keeps them).
+        streams = [ _boundaries(agenda.appts, which) 
+                    for which, agenda in enumerate(agendas) ]
+        covering = [ None ] * len(agendas)
+        count = 0
+        seg_begin = None
+        for time, is_begin, which, appt in heapq.merge(*streams):
+            if is_begin:
+                covering[which] = appt
+                count += 1
+                if count == len(agendas):
+                    seg_begin = appt
+            else:
+                if count == len(agendas):
+                    first = covering[0]
+                    result.append(Appt.from_epoch(seg_begin._begin, appt._end, 
+                                                  desc or first.desc,
+                                                  seg_begin._begin_tz, appt._end_tz))
+                covering[which] = None
+                count -= 1
+        return result
+
+    @classmethod
+    def availability(cls, agendas, minimum=1):
+        """Who is free when, over the free agendas of a group.
+
+        The boundaries of all the agendas are merged with a heap, as
+        in intersect_all, so the cost grows with the total number of
+        appointments (times log of the number of agendas), not with
+        the product of their sizes.
+
+        Arguments:
+           agendas: A list of Agenda objects, one per participant,
+                each the times that participant is free
+           minimum: Only times when at least this many participants
+                are free are reported
+        Returns:
+           A generator of (appt, free) pairs in time order, where free
+           is the sorted list of indexes (into agendas) of the
+           participants free throughout appt.  Each appt is as long
+           as possible: the free participants change at its end.  Its
+           title tells how many are free, like "3/5 available".
+        """
+        agendas = [agenda.normalized() for agenda in agendas]
+        total = len(agendas)
+        streams = [ _boundaries(agenda.appts, which)
+                    for which, agenda in enumerate(agendas) ]
+        free = set()
+        seg_free = frozenset()
+        seg_begin = seg_tz = None
+        for time, events in itertools.groupby(heapq.merge(*streams), key=lambda e: e[0]):
+            for _, is_begin, which, appt in events:
+                if is_begin:
+                    free.add(which)
+                    tz = appt._begin_tz
+                else:
+                    free.discard(which)
+                    tz = appt._end_tz
+            if free == seg_free:
+                continue     # Someone's free time continues in another appointment
+            if len(seg_free) >= minimum and seg_begin is not None:
+                yield (Appt.from_epoch(seg_begin, time,
+                                       "{}/{} available".format(len(seg_free), total),
+                                       seg_tz, tz),
+                       sorted(seg_free))
+            seg_free = frozenset(free)
+            seg_begin, seg_tz = time, tz
+
+    @classmethod
+    def best_slots(cls, agendas, n, minutes=0, minimum=1):
+        """The n best times to meet, from the availability of a group.
+
+        Arguments:
+           agendas, minimum: As for availability
+           n: Most slots to return
+           minutes: Only slots at least this many minutes long count
+        Returns:
+           A list of (appt, free) pairs as from availability, ranked
+           by the number of participants free, then longest first,
+           then earliest first.
+        """
+        slots = ( slot for slot in cls.availability(agendas, minimum)
+                  if slot[0]._end - slot[0]._begin >= minutes * 60 )
+        return heapq.nsmallest(n, slots, key=lambda slot:
+                               (-len(slot[1]), slot[0]._begin - slot[0]._end, slot[0]._begin))
+
     def normalize(self):
         """Merge overlapping events in an agenda. For example, if 
         the first appointment is from 1pm to 3pm, and the second is
@@ -273,8 +622,11 @@ class Agenda:
         """
         if len(self.appts) == 0:
             return
+        if self.vectorized:
+            self.appts = _np_normalize(self.appts)
+            return
 
-        ordering = lambda ap: ap.begin #sort by begin date 
+        ordering = lambda ap: ap._begin #sort by begin date 
         self.appts.sort(key=ordering)
 
         normalized = [ ]
@@ -302,8 +654,8 @@ class Agenda:
         (like "sorted(l)" vs "l.sort()").
         Returns a normalized copy of this agenda.
         """
-        copy = Agenda()
-        copy.appts = self.appts
+        copy = Agenda(self.vectorized)
+        copy.appts = list(self.appts)
         copy.normalize()
         return copy
         
@@ -326,54 +678,81 @@ class Agenda:
            from freeblock.desc.
         """
         copy = self.normalized()
-        comp = Agenda()
-        desc = freeblock.desc
-        cur_time = freeblock.begin #arrow date and time 
-        for appt in copy.appts:
-            if appt < freeblock:
-                continue
-            if appt > freeblock:
-                if cur_time < freeblock.end:
-                    comp.append(Appt(cur_time,freeblock.end, desc))
-                    cur_time = freeblock.end
-                break
-            if cur_time < appt.begin:
-                # print("Creating free time from", cur_time, "to", appt.begin)
-                comp.append(Appt(cur_time, appt.begin, desc))
-            cur_time = max(appt.end,cur_time)
-        
-        if cur_time < freeblock.end:
-            # print("Creating final free time from", cur_time, "to", freeblock.end)
-            comp.append(Appt(cur_time, freeblock.end, desc))
+        comp = Agenda(self.vectorized)
+        if self.vectorized:
+            comp.appts = _np_complement(copy.appts, [ freeblock ])[0]
+        else:
+            _complement_sorted(copy.appts, 0, freeblock, comp)
         return comp
 
     
     
-    def complementTimeSpan(self, begin_date, end_date, begin_time, end_time):
-        """
-        Calculate the complement of an agenda within a date and time span. This method
-        calls the complement method per day in the date span. 
-        """
-        total_free = Agenda()
-        date = begin_date.date()
-        end_date = end_date.date()
-        while(date <= end_date):
-            fb_year = date.year
-            fb_month = date.month
-            fb_day = date.day
-            fb_begin = begin_time.replace(year=fb_year, month=fb_month, day=fb_day)
-            fb_end = end_time.replace(year=fb_year, month=fb_month, day=fb_day)
-            freeblock = Appt(fb_begin, fb_end, "Available")
-            free_agenda = self.complement(freeblock)
+    def complementTimeSpan(self, begin_date, end_date, begin_time, end_time, memo=None):
+        """
+        Calculate the complement of an agenda within a date and time span. 
+        The agenda is normalized once and then walked together with the
+        daily time blocks, so the cost is linear in days + appointments.
+        With a ComplementMemo as memo, days already worked out are not
+        complemented again (see complement_days).
+        """
+        total_free = Agenda(self.vectorized)
+        for date, free_agenda in self.complement_days(begin_date, end_date, 
+                                                      begin_time, end_time, memo):
             for apt in free_agenda:
                 total_free.append(apt)
-        
-            begin_date = begin_date.replace(days=+1)
-            date = begin_date.date()
-        
         return total_free
-    
-      
+
+    def complement_days(self, begin_date, end_date, begin_time, end_time, memo=None):
+        """
+        Generator form of complementTimeSpan: yields (date, free agenda)
+        for each day in the date span, in order, as soon as that day is
+        done.  The free agenda of each day is exactly what complement()
+        gives for that day's time block.
+
+        If memo is a ComplementMemo, each day's free times are looked up
+        there by the day's time block and the busy times overlapping it,
+        and only worked out if they aren't found.  (Vectorized agendas
+        don't use the memo.)
+        """
+        busy = self.normalized().appts
+        blocks = day_blocks(begin_date, end_date, begin_time, end_time)
+        if self.vectorized:
+            blocks = list(blocks)
+            for freeblock, free in zip(blocks, _np_complement(busy, blocks)):
+                free_agenda = Agenda(True)
+                free_agenda.appts = free
+                yield freeblock.begin.date(), free_agenda
+            return
+        start = 0
+        for freeblock in blocks:
+            free_agenda = Agenda()
+            if memo is None:
+                start = _complement_sorted(busy, start, freeblock, free_agenda)
+            else:
+                start = memo.complement(busy, start, freeblock, free_agenda)
+            yield freeblock.begin.date(), free_agenda
+
+    def slots(self, minutes, step=15, desc="", limit=None):
+        """
+        The meeting slots of a given length that fit in this (free) agenda.
+
+        Arguments:
+           minutes: Length of each slot
+           step: Slots begin on multiples of this many minutes of local
+               time (of the free time they are in), and one slot after
+               another this far apart
+           desc: If provided, the title of every slot; otherwise each slot
+               has the title of the free time it is in
+           limit: If provided, stop after this many slots
+        Returns:
+           A generator of Appt, in time order.  Slots are only made as
+           they are asked for, so taking the first few is cheap however
+           long the agenda.
+        """
+        slots = free_slots(self.normalized().appts, minutes, step, desc)
+        if limit is not None:
+            slots = itertools.islice(slots, limit)
+        return slots
 
     def __len__(self):
         """Number of appointments, callable as built-in len() function"""
@@ -397,9 +776,432 @@ class Agenda:
         for i in range(len(self.appts)):
             mine = self.appts[i]
             theirs = other.appts[i]
-            if not (mine.begin == theirs.begin and
-                    mine.end == theirs.end):
+            if not (mine._begin == theirs._begin and
+                    mine._end == theirs._end):
                 return False
         return True
     
-    
\ No newline at end of file
+    
+
+
+class ComplementMemo:
+    """
+    Free times of time blocks already worked out, for reuse by
+    Agenda.complement_days (and complementTimeSpan).  Entries are keyed
+    by the begin and end of the block and of the busy times that
+    overlap it, so a day whose busy times are unchanged is found again
+    by any agenda, for any user; the least recently used entries go
+    beyond max_entries.  Safe to share between threads.
+    """
+
+    def __init__(self, max_entries=10000):
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def complement(self, appts, start, freeblock, comp):
+        """
+        Like _complement_sorted (which it calls when freeblock isn't 
+        in the memo): appends the free times within freeblock to comp,
+        and returns where the next freeblock's search can start.
+        """
+        while start < len(appts) and appts[start] < freeblock:
+            start += 1
+        stop = start
+        while stop < len(appts) and not appts[stop] > freeblock:
+            stop += 1
+        busy = appts[start:stop]
+        key = (freeblock._begin, freeblock._end,
+               tuple([ t for appt in busy for t in (appt._begin, appt._end) ]))
+        with self._lock:
+            free = self._entries.get(key)
+            if free is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+        if free is None:
+            free_agenda = Agenda()
+            _complement_sorted(busy, 0, freeblock, free_agenda)
+            # Time zones aren't part of the key (tzinfo objects can't be 
+            # hashed), so keep where each one came from: the index of the 
+            # busy appointment, or None for the block itself.
+            ends = { appt._end: i for i, appt in enumerate(busy) }
+            begins = { appt._begin: i for i, appt in enumerate(busy) }
+            free = [ (appt._begin, appt._end, ends.get(appt._begin), begins.get(appt._end))
+                     for appt in free_agenda ]
+            with self._lock:
+                self.misses += 1
+                self._entries[key] = free
+                while len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+        for begin, end, after, before in free:
+            comp.append(Appt.from_epoch(begin, end, freeblock.desc,
+                freeblock._begin_tz if after is None else busy[after]._end_tz,
+                freeblock._end_tz if before is None else busy[before]._begin_tz))
+        return start
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class IntervalIndex:
+    """
+    Appointments sorted by begin time, for point and range queries by
+    bisection.  The appointments overlapping [begin, end) are among
+    those beginning before end.  When their ends are in order too, as
+    in a normalized agenda, those ending after begin are found by
+    bisecting the ends as well, so a query costs O(log n + k) for k
+    answers.  Otherwise the latest end in each range of positions is
+    kept in a tree (an augmented interval tree, laid out in a list),
+    and a query only goes down into ranges ending after begin: at most
+    O((k + 1) log n), however long a few of the appointments are.
+    """
+
+    def __init__(self, appts=()):
+        """
+        Arguments:
+           appts: The list of Appt to index.  The index does not
+               change it, and remembers it as its source.
+        """
+        self.source = appts
+        self._appts = sorted(appts, key=lambda appt: appt._begin)
+        self._begins = [ appt._begin for appt in self._appts ]
+        self._ends = [ appt._end for appt in self._appts ]
+        self._ends_sorted = all(a <= b for a, b in zip(self._ends, self._ends[1:]))
+        self._tree = None   # Latest ends, built by the first query that needs it
+
+    def add(self, appt):
+        """
+        Index one more appointment: O(log n) to find its place.  If that
+        puts the ends out of order, the tree is rebuilt by the next query.
+        """
+        i = bisect.bisect_right(self._begins, appt._begin)
+        self._begins.insert(i, appt._begin)
+        self._ends.insert(i, appt._end)
+        self._appts.insert(i, appt)
+        if self._ends_sorted and not ((i == 0 or self._ends[i - 1] <= appt._end) and
+                                      (i + 1 == len(self._ends) or appt._end <= self._ends[i + 1])):
+            self._ends_sorted = False
+        self._tree = None
+
+    def overlapping(self, begin, end):
+        """Appointments overlapping epoch seconds [begin, end), by begin time."""
+        hi = bisect.bisect_left(self._begins, end)
+        if self._ends_sorted:
+            return self._appts[bisect.bisect_right(self._ends, begin):hi]
+        tree = self._tree or self._build_tree()
+        size = len(tree) // 2
+        found = [ ]
+        # (node, first position it covers, number of positions it covers)
+        stack = [ (1, 0, size) ]
+        while stack:
+            node, first, count = stack.pop()
+            if first >= hi or tree[node] <= begin:
+                continue
+            if node >= size:
+                found.append(self._appts[first])
+            else:
+                count //= 2
+                stack.append((2 * node + 1, first + count, count))
+                stack.append((2 * node, first, count))
+        return found
+
+    def _build_tree(self):
+        """
+        tree[size + i] is the end of the i'th appointment, and tree[node]
+        the latest end of its children 2 * node and 2 * node + 1.
+        """
+        size = 1
+        while size < len(self._ends):
+            size *= 2
+        tree = [ float("-inf") ] * (2 * size)
+        tree[size:size + len(self._ends)] = self._ends
+        for node in range(size - 1, 0, -1):
+            tree[node] = max(tree[2 * node], tree[2 * node + 1])
+        self._tree = tree
+        return tree
+
+    def __len__(self):
+        return len(self._appts)
+
+
+def read_appts(f, errors=None):
+    """
+    Generate the appointments of an agenda file (see Agenda.from_file) 
+    one line at a time.  Lines in the usual "MM/DD/YYYY h:mm A" form 
+    are parsed directly; anything else goes through Appt.from_string.
+
+    Arguments:
+        f: A file object, or any iterable of lines
+        errors: (optional) A list to append an AgendaError to for each
+            line that can't be read; otherwise they are logged.
+    """
+    midnights = { }   # (year, month, day) -> epoch seconds
+    for line_number, line in enumerate(f, 1):
+        line = line.strip()
+        if line == "" or line.startswith("#"):
+            continue   # Skip blank lines and comments
+        try:
+            match = _APPT_LINE.match(line)
+            if match is None:
+                yield Appt.from_string(line)
+                continue
+            fields = match.groups()
+            begin = _line_epoch(fields[0:6], midnights)
+            end = _line_epoch(fields[6:12], midnights)
+            yield Appt.from_epoch(begin, end, fields[12].strip(), _UTC)
+        except (ValueError, arrow.parser.ParserError) as err:
+            if errors is None:
+                log.warning("Failed on line {}: {} ({})".format(line_number, line, err))
+            else:
+                errors.append(AgendaError(line_number, line, str(err)))
+
+
+def _line_epoch(fields, midnights):
+    """
+    Epoch seconds (UTC, as arrow reads the agenda format) of the
+    month, day, year, hour, minute and am/pm matched in a line.
+    """
+    month, day, year, hour, minute, am_pm = fields
+    key = (int(year), int(month), int(day))
+    midnight = midnights.get(key)
+    if midnight is None:
+        datetime.date(*key)    # Raises ValueError for dates that don't exist
+        midnight = midnights[key] = calendar.timegm(key + (0, 0, 0))
+    hour = int(hour)
+    minute = int(minute)
+    # Same as arrow's reading of h and A
+    if am_pm.lower() == "pm" and hour < 12:
+        hour += 12
+    elif am_pm.lower() == "am" and hour == 12:
+        hour = 0
+    if hour > 23:
+        raise ValueError("hour must be in 0..23")
+    if minute > 59:
+        raise ValueError("minute must be in 0..59")
+    return midnight + hour * 3600 + minute * 60
+
+
+def overlapping_pairs(mine, theirs):
+    """Find every pair of overlapping appointments between two
+    lists of appointments with a sweep over their begin times,
+    instead of comparing every appointment with every other one.
+
+    Arguments:
+        mine, theirs: lists of Appt, in any order
+    Returns:
+        A sorted list of (i, j) index pairs such that
+        mine[i].overlaps(theirs[j]), i.e. the pairs in the same
+        order as a nested loop over mine and then theirs.
+    """
+    sides = (mine, theirs)
+    starts = [ (appt._begin, 0, i) for i, appt in enumerate(mine) ]
+    starts += [ (appt._begin, 1, j) for j, appt in enumerate(theirs) ]
+    starts.sort()
+    # Appointments already started on each side, as (end, index)
+    active = ([ ], [ ])
+    pairs = [ ]
+    for begin, side, k in starts:
+        # Anything that ended by now can't overlap this or any later start
+        live = [ entry for entry in active[1 - side] if entry[0] > begin ]
+        active[1 - side][:] = live
+        for _, x in live:
+            pairs.append((k, x) if side == 0 else (x, k))
+        active[side].append((sides[side][k]._end, k))
+    pairs.sort()
+    return pairs
+
+
+def _boundaries(appts, which):
+    """Begin and end events of a normalized list of appointments,
+    in time order, as (time, is_begin, which, appt) tuples for
+    merging with heapq.merge.
+    """
+    for appt in appts:
+        yield (appt._begin, True, which, appt)
+        yield (appt._end, False, which, appt)
+
+
+def day_blocks(begin_date, end_date, begin_time, end_time, desc="Available"):
+    """
+    Yield an Appt from begin_time to end_time on each day from
+    begin_date to end_date (inclusive).  All four arguments are arrow
+    objects; only the dates of the first two and the times of the last
+    two are used.
+    """
+    date = begin_date.date()
+    end_date = end_date.date()
+    while date <= end_date:
+        fb_begin = begin_time.replace(year=date.year, month=date.month, day=date.day)
+        fb_end = end_time.replace(year=date.year, month=date.month, day=date.day)
+        yield Appt(fb_begin, fb_end, desc)
+        date += datetime.timedelta(days=1)
+
+
+def free_slots(appts, minutes, step=15, desc=""):
+    """
+    Generator of the slots of Agenda.slots, from any iterable of
+    appointments in time order that don't overlap (such as the free
+    agendas of Agenda.complement_days, chained), consuming it lazily.
+    """
+    length = minutes * 60
+    step = step * 60
+    if length <= 0 or step <= 0:
+        raise ValueError("Slot length and step must be positive")
+    for appt in appts:
+        if appt._end - appt._begin < length:
+            continue
+        # Round up to a step boundary of local time
+        offset = int(appt.begin.utcoffset().total_seconds())
+        begin = -((-(appt._begin + offset)) // step) * step - offset
+        while begin + length <= appt._end:
+            yield Appt.from_epoch(begin, begin + length, desc or appt.desc,
+                                  appt._begin_tz, appt._begin_tz)
+            begin += step
+
+
+def _complement_sorted(appts, start, freeblock, comp):
+    """
+    Append to agenda comp the free times within freeblock, given
+    a normalized (sorted, non-overlapping) list of appointments.  
+    Appointments before appts[start] are known to end before freeblock.
+
+    Returns the index of the first appointment that does not end before
+    freeblock, which is where the search for any later freeblock can start.
+    """
+    while start < len(appts) and appts[start] < freeblock:
+        start += 1
+    desc = freeblock.desc
+    cur_time, cur_tz = freeblock._begin, freeblock._begin_tz
+    for i in range(start, len(appts)):
+        appt = appts[i]
+        if appt > freeblock:
+            break
+        if cur_time < appt._begin:
+            comp.append(Appt.from_epoch(cur_time, appt._begin, desc, 
+                                        cur_tz, appt._begin_tz))
+        if appt._end >= cur_time:
+            cur_time, cur_tz = appt._end, appt._end_tz
+    if cur_time < freeblock._end:
+        comp.append(Appt.from_epoch(cur_time, freeblock._end, desc, 
+                                    cur_tz, freeblock._end_tz))
+    return start
+
+
+#
+# Vectorized versions of the agenda operations, used by agendas 
+# created with vectorized=True.  Each works on numpy arrays of the 
+# epoch begin and end times; only building the resulting Appt
+# objects is done per appointment.
+#
+
+def _np_times(appts):
+    """Arrays of the begin and end epoch seconds of a list of Appt."""
+    begins = numpy.fromiter((appt._begin for appt in appts), 
+                            dtype=numpy.int64, count=len(appts))
+    ends = numpy.fromiter((appt._end for appt in appts), 
+                          dtype=numpy.int64, count=len(appts))
+    return begins, ends
+
+
+def _np_normalize(appts):
+    """Vectorized Agenda.normalize: returns the merged list of Appt."""
+    begins, ends = _np_times(appts)
+    order = numpy.argsort(begins, kind="stable")
+    begins = begins[order]
+    ends = ends[order]
+    # An appointment starts a new block iff it begins no earlier 
+    # than every appointment before it ends
+    reach = numpy.maximum.accumulate(ends)
+    new_block = numpy.empty(len(begins), dtype=bool)
+    new_block[0] = True
+    new_block[1:] = begins[1:] >= reach[:-1]
+    firsts = numpy.flatnonzero(new_block)
+    lasts = numpy.append(firsts[1:], len(begins))
+    normalized = [ ]
+    for first, last in zip(firsts.tolist(), lasts.tolist()):
+        if last - first == 1:
+            normalized.append(appts[order[first]])
+            continue
+        members = [ appts[k] for k in order[first:last].tolist() ]
+        # Like a chain of union(): the end (and its time zone) comes
+        # from the first appointment that reaches the latest end.
+        closer = members[int(numpy.argmax(ends[first:last]))]
+        desc = " ".join(appt.desc for appt in members)
+        normalized.append(Appt.from_epoch(members[0]._begin, closer._end, desc,
+                                          members[0]._begin_tz, closer._end_tz))
+    return normalized
+
+
+def _np_complement(busy, freeblocks):
+    """Vectorized complement of a normalized list of appointments
+    within each of a list of time blocks.
+
+    Returns:
+        A list with one list of free Appt for each freeblock, the
+        same appointments _complement_sorted would produce.
+    """
+    busy_begins, busy_ends = _np_times(busy)
+    block_begins, block_ends = _np_times(freeblocks)
+    # Busy appointments first..last-1 overlap each block
+    first = numpy.searchsorted(busy_ends, block_begins, side="right")
+    last = numpy.searchsorted(busy_begins, block_ends, side="left")
+    overlapping = numpy.maximum(last - first, 0)
+    # Each block has one candidate gap more than overlapping appointments
+    gaps = overlapping + 1
+    block = numpy.repeat(numpy.arange(len(freeblocks)), gaps)
+    position = numpy.arange(gaps.sum()) - numpy.repeat(numpy.cumsum(gaps) - gaps, gaps)
+    prev_busy = first[block] + position - 1
+    next_busy = first[block] + position
+    at_start = position == 0
+    at_end = position == overlapping[block]
+    gap_begins = numpy.where(at_start, block_begins[block], 
+                             busy_ends[numpy.clip(prev_busy, 0, None)] 
+                             if len(busy) else 0)
+    gap_ends = numpy.where(at_end, block_ends[block],
+                           busy_begins[numpy.clip(next_busy, 0, len(busy) - 1)]
+                           if len(busy) else 0)
+    result = [ [ ] for freeblock in freeblocks ]
+    for k in numpy.flatnonzero(gap_begins < gap_ends).tolist():
+        freeblock = freeblocks[block[k]]
+        if at_start[k]:
+            begin_tz = freeblock._begin_tz
+        else:
+            begin_tz = busy[prev_busy[k]]._end_tz
+        if at_end[k]:
+            end_tz = freeblock._end_tz
+        else:
+            end_tz = busy[next_busy[k]]._begin_tz
+        result[block[k]].append(Appt.from_epoch(int(gap_begins[k]), int(gap_ends[k]),
+                                                freeblock.desc, begin_tz, end_tz))
+    return result
+
+
+def _np_overlapping_pairs(mine, theirs):
+    """Vectorized overlapping_pairs.  Uses searchsorted ranges when 
+    either list is free of overlaps (e.g., normalized), and falls
+    back to the sweep otherwise.
+    """
+    if len(mine) == 0 or len(theirs) == 0:
+        return [ ]
+    for flipped, (probes, sorted_side) in enumerate(((mine, theirs), (theirs, mine))):
+        begins, ends = _np_times(sorted_side)
+        order = numpy.argsort(begins, kind="stable")
+        begins = begins[order]
+        ends = ends[order]
+        if numpy.all(begins[1:] >= ends[:-1]):
+            break
+    else:
+        return overlapping_pairs(mine, theirs)
+    probe_begins, probe_ends = _np_times(probes)
+    first = numpy.searchsorted(ends, probe_begins, side="right")
+    last = numpy.searchsorted(begins, probe_ends, side="left")
+    counts = numpy.maximum(last - first, 0)
+    probe = numpy.repeat(numpy.arange(len(probes)), counts)
+    position = numpy.arange(counts.sum()) - numpy.repeat(numpy.cumsum(counts) - counts, counts)
+    other = order[first[probe] + position]
+    if flipped:
+        probe, other = other, probe
+    ordering = numpy.lexsort((other, probe))
+    return list(zip(probe[ordering].tolist(), other[ordering].tolist()))
@@ -0,0 +1,128 @@
+"""
+Free times for many people at once, for batch jobs such as working
+out the free time of a whole department overnight.
+
+The work is split into tasks of one person's agenda over a run of
+days, which are handed to a pool of processes.  Each task gets only
+the appointments overlapping its days, in the binary form of
+Agenda.to_bytes, and sends the free times back the same way, so
+little is pickled and nothing is parsed twice.  The days of one
+person are independent of each other, so a task's results are the
+same as that part of complementTimeSpan over the whole span.
+
+Usage:
+    python batch.py --begin-date 01/04/2016 --end-date 01/29/2016 \\
+        --begin-time 9am --end-time 5pm [--processes 4] agenda files...
+
+The free times of each file are written to standard output in the
+agenda file format, after a "# file name" comment line.  The range and
+the agenda files are read as pipeline.py reads them: times of day in
+the forms the page takes, and wall-clock times in local time unless
+--tz says otherwise.  Lines that can't be read are listed on standard
+error and skipped, and the exit status is then 1.
+"""
+
+import argparse
+import collections
+import concurrent.futures
+import math
+import os
+import sys
+import time
+
+from agenda import Agenda, Appt, day_blocks
+import pipeline
+
+# Tasks per process, when dividing each agenda's days between them;
+# more than one so that a process finishing early can take another.
+TASKS_PER_PROCESS = 4
+
+
+def free_times(agendas, begin_date, end_date, begin_time, end_time,
+               processes=None, days_per_task=None):
+    """
+    The free times of several agendas within a date and time span, as
+    complementTimeSpan gives them for each agenda, worked out in a pool
+    of processes.
+
+    Arguments:
+        agendas: Mapping of name to busy Agenda
+        begin_date, end_date, begin_time, end_time: arrow objects,
+            as for complementTimeSpan
+        processes: Number of processes to use (os.cpu_count() if None).
+            With 1, everything is done in this process.
+        days_per_task: Days of one agenda worked out by each task.  If
+            None, chosen so there are about TASKS_PER_PROCESS tasks for
+            each process.
+    Returns:
+        An OrderedDict of name to free Agenda, in the order of agendas
+    """
+    processes = processes or os.cpu_count() or 1
+    if processes == 1:
+        return collections.OrderedDict(
+            (name, busy.complementTimeSpan(begin_date, end_date, begin_time, end_time))
+            for name, busy in agendas.items())
+    days = (end_date.date() - begin_date.date()).days + 1
+    if days_per_task is None:
+        days_per_task = max(1, math.ceil(days * len(agendas) / (processes * TASKS_PER_PROCESS)))
+    names = [ ]
+    tasks = [ ]
+    for name, busy in agendas.items():
+        for first in range(0, max(days, 0), days_per_task):
+            chunk_begin = begin_date.replace(days=+first)
+            chunk_end = begin_date.replace(days=+min(first + days_per_task, days) - 1)
+            first_block = next(day_blocks(chunk_begin, chunk_begin, begin_time, end_time))
+            last_block = next(day_blocks(chunk_end, chunk_end, begin_time, end_time))
+            window = Appt.from_epoch(first_block._begin, last_block._end, "", None)
+            chunk = Agenda()
+            chunk.appts = busy.overlapping(window)
+            names.append(name)
+            tasks.append((chunk.to_bytes(), chunk_begin, chunk_end, begin_time, end_time))
+
+    results = collections.OrderedDict((name, Agenda()) for name in agendas)
+    if len(tasks) <= 1:
+        done = list(map(_free_task, tasks))
+    else:
+        with concurrent.futures.ProcessPoolExecutor(max_workers=processes) as executor:
+            done = list(executor.map(_free_task, tasks))
+    for name, data in zip(names, done):
+        results[name].appts.extend(Agenda.from_bytes(data).appts)
+    return results
+
+
+def _free_task(task):
+    """Run in a worker: the free times of one chunk of days, as bytes."""
+    data, begin_date, end_date, begin_time, end_time = task
+    busy = Agenda.from_bytes(data)
+    return busy.complementTimeSpan(begin_date, end_date, begin_time, end_time).to_bytes()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Free times of many agenda files")
+    parser.add_argument("files", nargs="+", help="Agenda files of busy times")
+    pipeline.add_range_arguments(parser)
+    parser.add_argument("--processes", type=int, default=None,
+                        help="Processes to use (default: one per CPU)")
+    parser.add_argument("--days-per-task", type=int, default=None)
+    args = parser.parse_args(argv)
+    span, tzinfo = pipeline.range_arguments(parser, args)
+
+    errors = [ ]
+    start = time.perf_counter()
+    agendas = pipeline.read_agendas(args.files, errors, tzinfo)
+    pipeline.report_errors(errors)
+    read = time.perf_counter() - start
+    free = free_times(agendas, *span.arrows(), processes=args.processes,
+                      days_per_task=args.days_per_task)
+    computed = time.perf_counter() - start - read
+    for path, agenda in free.items():
+        print("# {}".format(path))
+        for appt in agenda:
+            print(appt)
+    print("{} agendas read in {:.2f} s, free times in {:.2f} s".format(
+        len(agendas), read, computed), file=sys.stderr)
+    return 1 if errors else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,269 @@
+"""
+Benchmarks for the agenda engine.
+
+Generates calendars of several shapes and sizes from a fixed seed,
+and reports the time and peak memory of each agenda operation on
+each backend:
+    reference  the original algorithms (nested-loop intersect,
+               complement of each day separately)
+    python     the current pure Python agenda.py
+    numpy      the vectorized agenda.py (Agenda(vectorized=True))
+The results of every backend are checked against the first one, so
+a backend that gets faster by getting things wrong is caught too.
+
+The round_trip operation stores an agenda and reads it back: as the
+list of dicts kept in the session (reference) or with to_bytes and
+from_bytes (python, numpy); the size of each form is shown too.
+
+Usage:
+    python bench_agenda.py
+    python bench_agenda.py --sizes 100,1000 --backends python,numpy --ops intersect
+"""
+
+import argparse
+import json
+import random
+import sys
+import time
+import tracemalloc
+
+import arrow
+
+from agenda import *
+
+BACKENDS = ["reference", "python", "numpy"]
+OPS = ["normalize", "complement", "complementTimeSpan", "intersect", "intersect_all",
+       "best_slots", "round_trip"]
+
+START = arrow.get("2016-01-04T00:00:00-08:00")    # A Monday
+
+
+#
+# Calendar generators.  Each takes a random.Random and a number of
+# appointments and returns an Agenda.
+#
+
+def dense_workdays(rng, count):
+    """
+    Back-to-back and overlapping meetings of 15 to 90 minutes, about
+    ten a day, in working hours on weekdays.
+    """
+    agenda = Agenda()
+    for i in range(count):
+        day = i // 10
+        day = day // 5 * 7 + day % 5     # Skip weekends
+        begin = START.replace(days=+day, hours=+8, minutes=+rng.randrange(0, 9 * 60, 15))
+        end = begin.replace(minutes=+rng.randrange(15, 91, 15))
+        agenda.append(Appt(begin, end, "meeting {}".format(i)))
+    return agenda
+
+def recurring_meetings(rng, count):
+    """
+    Weekly series of meetings, each at its own weekday and time, which
+    often overlap one another.
+    """
+    agenda = Agenda()
+    series = max(1, count // 20)
+    slots = [ (rng.randrange(5), rng.randrange(8 * 60, 17 * 60, 30), rng.choice([30, 60, 90]))
+              for s in range(series) ]
+    for i in range(count):
+        weekday, minute, length = slots[i % series]
+        week = i // series
+        begin = START.replace(days=+(week * 7 + weekday), minutes=+minute)
+        agenda.append(Appt(begin, begin.replace(minutes=+length), "series {}".format(i % series)))
+    return agenda
+
+def multi_month(rng, count):
+    """
+    Appointments of any length up to four hours scattered over six
+    months, at any time of day.
+    """
+    agenda = Agenda()
+    for i in range(count):
+        begin = START.replace(minutes=+rng.randrange(0, 182 * 24 * 60, 5))
+        agenda.append(Appt(begin, begin.replace(minutes=+rng.randrange(5, 241, 5)),
+                           "event {}".format(i)))
+    return agenda
+
+def many_attendees(rng, count, attendees=20):
+    """
+    The free times of many attendees over the same month: a list of
+    agendas with count appointments between them.
+    """
+    agendas = [ ]
+    for person in range(attendees):
+        agenda = Agenda()
+        for i in range(max(1, count // attendees)):
+            begin = START.replace(days=+rng.randrange(28), minutes=+rng.randrange(8 * 60, 17 * 60, 30))
+            agenda.append(Appt(begin, begin.replace(minutes=+rng.randrange(30, 181, 30)),
+                               "free {}".format(person)))
+        agendas.append(agenda)
+    return agendas
+
+GENERATORS = { "dense_workdays": dense_workdays,
+               "recurring_meetings": recurring_meetings,
+               "multi_month": multi_month }
+
+
+#
+# The operations, for each backend
+#
+
+def span(agenda):
+    """(begin_date, end_date, begin_time, end_time) covering an agenda, 8am to 6pm."""
+    begin = min(appt.begin for appt in agenda)
+    end = max(appt.end for appt in agenda)
+    day = begin.floor('day')
+    return begin, end, day.replace(hours=+8), day.replace(hours=+18)
+
+def reference_intersect(mine, theirs):
+    result = Agenda()
+    for thisappt in mine.appts:
+        for otherappt in theirs.appts:
+            if thisappt.overlaps(otherappt):
+                result.append(thisappt.intersect(otherappt))
+    return result
+
+def reference_complement_time_span(agenda, begin_date, end_date, begin_time, end_time):
+    total_free = Agenda()
+    for freeblock in day_blocks(begin_date, end_date, begin_time, end_time):
+        for appt in agenda.complement(freeblock):
+            total_free.append(appt)
+    return total_free
+
+def reference_intersect_all(agendas):
+    result = agendas[0].normalized()
+    for agenda in agendas[1:]:
+        result = reference_intersect(result, agenda.normalized())
+    return result
+
+def reference_best_slots(agendas, n):
+    """
+    Best slots by checking every agenda between each pair of
+    consecutive boundaries, then merging neighbours with the same
+    participants free.
+    """
+    agendas = [ agenda.normalized() for agenda in agendas ]
+    times = sorted({ t for agenda in agendas for appt in agenda
+                     for t in (appt._begin, appt._end) })
+    slots = [ ]
+    for begin, end in zip(times, times[1:]):
+        piece = Appt.from_epoch(begin, end, "", None)
+        free = [ which for which, agenda in enumerate(agendas)
+                 if any(piece.overlaps(appt) for appt in agenda) ]
+        if slots and slots[-1][2] == free and slots[-1][1] == begin:
+            slots[-1][1] = end
+        elif free:
+            slots.append([begin, end, free])
+    slots.sort(key=lambda slot: (-len(slot[2]), slot[0] - slot[1], slot[0]))
+    return [ (begin, end, free) for begin, end, free in slots[:n] ]
+
+def copy_agenda(agenda, backend):
+    copy = Agenda(vectorized=(backend == "numpy"))
+    copy.appts = list(agenda.appts)
+    return copy
+
+def operation(op, backend, agenda, other, attendees):
+    """
+    A function of no arguments carrying out op on backend, with its
+    inputs already converted for that backend.
+    """
+    mine = copy_agenda(agenda, backend)
+    theirs = copy_agenda(other, backend)
+    group = [ copy_agenda(person, backend) for person in attendees ]
+    window = span(agenda)
+    freeblock = Appt(window[2], window[3], "Available")
+    if op == "normalize":
+        return lambda: mine.normalized()
+    if op == "complement":
+        return lambda: mine.complement(freeblock)
+    if op == "complementTimeSpan":
+        if backend == "reference":
+            return lambda: reference_complement_time_span(mine, *window)
+        return lambda: mine.complementTimeSpan(*window)
+    if op == "intersect":
+        if backend == "reference":
+            return lambda: reference_intersect(mine, theirs)
+        return lambda: mine.intersect(theirs)
+    if op == "intersect_all":
+        if backend == "reference":
+            return lambda: reference_intersect_all(group)
+        return lambda: Agenda.intersect_all(group)
+    if op == "best_slots":
+        if backend == "reference":
+            return lambda: reference_best_slots(group, 10)
+        return lambda: [ (appt._begin, appt._end, free)
+                         for appt, free in Agenda.best_slots(group, 10) ]
+    if op == "round_trip":
+        if backend == "reference":
+            return lambda: Agenda.from_list(json.loads(json.dumps(mine.to_list())))
+        return lambda: Agenda.from_bytes(mine.to_bytes(), vectorized=(backend == "numpy"))
+    raise ValueError("Unknown operation {}".format(op))
+
+
+def measure(run, repeat):
+    """(best time in seconds, peak memory in bytes, result) of run()."""
+    best = None
+    for i in range(repeat):
+        start = time.perf_counter()
+        result = run()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    tracemalloc.start()
+    run()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return best, peak, result
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark agenda operations")
+    parser.add_argument("--sizes", default="100,1000,10000",
+                        help="Comma-separated numbers of appointments")
+    parser.add_argument("--backends", default=",".join(BACKENDS))
+    parser.add_argument("--ops", default=",".join(OPS))
+    parser.add_argument("--calendars", default=",".join(sorted(GENERATORS)))
+    parser.add_argument("--seed", type=int, default=399)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--max-reference", type=int, default=2000,
+                        help="Skip the (quadratic) reference intersect above this size")
+    args = parser.parse_args(argv)
+
+    backends = args.backends.split(",")
+    if "numpy" in backends and numpy is None:
+        print("numpy is not installed; skipping the numpy backend")
+        backends.remove("numpy")
+    print("{:<20} {:<20} {:>7} {:<10} {:>10} {:>10} {:>8}".format(
+        "calendar", "operation", "size", "backend", "time (ms)", "peak (KB)", "speedup"))
+    regressions = 0
+    for calendar in args.calendars.split(","):
+        for size in [ int(size) for size in args.sizes.split(",") ]:
+            rng = random.Random(args.seed)
+            agenda = GENERATORS[calendar](rng, size)
+            other = GENERATORS[calendar](rng, size)
+            attendees = many_attendees(rng, size)
+            for op in args.ops.split(","):
+                if op == "round_trip":
+                    print("{:<20} {:<20} {:>7} json {} bytes, binary {} bytes".format(
+                        calendar, "encoded size", size, len(json.dumps(agenda.to_list())),
+                        len(agenda.to_bytes())))
+                baseline = None
+                for backend in backends:
+                    if (backend == "reference" and op in ("intersect", "intersect_all", "best_slots") and
+                        size > args.max_reference):
+                        continue
+                    elapsed, peak, result = measure(
+                        operation(op, backend, agenda, other, attendees), args.repeat)
+                    if baseline is None:
+                        baseline = (elapsed, str(result))
+                    elif str(result) != baseline[1]:
+                        regressions += 1
+                        print("*** {} {} differs from {}".format(backend, op, backends[0]))
+                    print("{:<20} {:<20} {:>7} {:<10} {:>10.2f} {:>10.1f} {:>7.1f}x".format(
+                        calendar, op, size, backend, elapsed * 1000, peak / 1024,
+                        baseline[0] / elapsed if elapsed else float("inf")))
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,124 @@
+"""
+Benchmarks for the calendar fetching layer (gcal.py), run against
+the fake calendar service so they need no network or credentials.
+
+    window   Cost per event of picking out busy times: the original
+             overlap() test, which parsed the four session dates for
+             every event, against the window_filter built once.
+    fetch    Fetching several calendars, one after another as before
+             and concurrently with fetch_calendars.
+
+Usage:
+    python bench_gcal.py [--events 5000] [--calendars 8] [--latency 0.1]
+"""
+
+import argparse
+import random
+import sys
+import time
+
+import arrow
+
+import gcal
+from fake_gcal import FakeCalendarService
+
+START = arrow.get("2016-01-04T00:00:00-08:00")
+
+# The session values find_busy works from
+SESSION = { "begin_date": START.isoformat(),
+            "end_date": START.replace(days=+13).isoformat(),
+            "begin_time": START.replace(hours=+9).isoformat(),
+            "end_time": START.replace(hours=+17).isoformat() }
+
+
+def random_events(rng, count, days=28):
+    """count event dicts at random times over a number of days."""
+    events = [ ]
+    for i in range(count):
+        begin = START.replace(minutes=+rng.randrange(0, days * 24 * 60, 15))
+        end = begin.replace(minutes=+rng.randrange(15, 121, 15))
+        events.append({ "id": "event{}".format(i), "summary": "Event {}".format(i),
+                        "start": { "dateTime": begin.isoformat() },
+                        "end": { "dateTime": end.isoformat() } })
+    return events
+
+
+def session_overlap(session, event_sdt, event_edt):
+    """The original overlap() from main.py, reading the range from the session each time."""
+    event_sd = event_sdt.date()
+    event_ed = event_edt.date()
+    event_st = event_sdt.time()
+    event_et = event_edt.time()
+    desired_sd= arrow.get(session['begin_date']).date()
+    desired_ed = arrow.get(session['end_date']).date()
+    desired_st = arrow.get(session['begin_time']).time()
+    desired_et = arrow.get(session['end_time']).time()
+    if not (desired_sd <= event_sd <= desired_ed) or not (desired_sd <= event_ed <= desired_ed):
+        return False
+    elif (event_et <= desired_st):
+        return False
+    elif (event_st >= desired_et):
+        return False
+    else:
+        return True
+
+
+def bench_window(events):
+    start = time.perf_counter()
+    old_busy = gcal.busy_events(events, lambda begin, end: session_overlap(SESSION, begin, end))
+    old = time.perf_counter() - start
+
+    start = time.perf_counter()
+    in_window = gcal.window_filter(SESSION["begin_date"], SESSION["end_date"],
+                                   SESSION["begin_time"], SESSION["end_time"])
+    new_busy = gcal.busy_events(events, in_window)
+    new = time.perf_counter() - start
+
+    assert old_busy == new_busy
+    print("window: {} events, {} busy".format(len(events), len(new_busy)))
+    print("  overlap() per event     {:8.1f} us".format(old / len(events) * 1e6))
+    print("  window_filter per event {:8.1f} us  ({:.1f}x)".format(
+        new / len(events) * 1e6, old / new))
+
+
+def bench_fetch(events, calendars, latency):
+    calendar_events = { "cal{}".format(i): events[i::calendars] for i in range(calendars) }
+    service = FakeCalendarService(calendar_events, latency=latency)
+    ids = sorted(calendar_events)
+
+    start = time.perf_counter()
+    for calendar_id in ids:
+        gcal.list_events(service, calendar_id)
+    sequential = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for calendar_id, fetched, error in gcal.fetch_calendars(service, ids):
+        assert error is None
+    concurrent = time.perf_counter() - start
+
+    print("fetch: {} calendars, {:.0f} ms latency each".format(calendars, latency * 1000))
+    print("  one after another {:8.1f} ms".format(sequential * 1000))
+    print("  fetch_calendars   {:8.1f} ms  ({:.1f}x)".format(
+        concurrent * 1000, sequential / concurrent))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark calendar fetching")
+    parser.add_argument("--events", type=int, default=5000)
+    parser.add_argument("--calendars", type=int, default=8)
+    parser.add_argument("--latency", type=float, default=0.1,
+                        help="Seconds each fake calendar request takes")
+    parser.add_argument("--seed", type=int, default=399)
+    parser.add_argument("--only", choices=["window", "fetch"])
+    args = parser.parse_args(argv)
+
+    events = random_events(random.Random(args.seed), args.events)
+    if args.only in (None, "window"):
+        bench_window(events)
+    if args.only in (None, "fetch"):
+        bench_fetch(events, args.calendars, args.latency)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
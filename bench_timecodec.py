@@ -0,0 +1,60 @@
+"""
+Micro-benchmark of parsing and formatting the date-time strings we
+store, with arrow and with timecodec.
+
+For each form of string, reports the time per call of
+    arrow.get(text)                 against  timecodec.parse_arrow(text)
+    arrow.get(text).timestamp       against  timecodec.parse_epoch(text)
+and of formatting epoch seconds back to ISO strings.
+
+Usage:
+    python bench_timecodec.py [--number 20000]
+"""
+
+import argparse
+import sys
+import timeit
+
+import arrow
+
+import timecodec
+
+# An event from the calendar API, a date and a time from the session,
+# and a busy time from Appt.to_dict
+SAMPLES = { "calendar event": "2016-02-22T12:00:00-08:00",
+            "UTC event": "2016-02-22T20:00:00Z",
+            "session time": "0001-01-01T09:00:00-08:00",
+            "fractional": "2016-02-22T12:00:00.250000-08:00" }
+
+
+def report(name, old, new, number):
+    old_time = min(timeit.repeat(old, number=number, repeat=3)) / number
+    new_time = min(timeit.repeat(new, number=number, repeat=3)) / number
+    print("  {:<28} {:8.2f} us {:8.2f} us  ({:.1f}x)".format(
+        name, old_time * 1e6, new_time * 1e6, old_time / new_time))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark date-time parsing")
+    parser.add_argument("--number", type=int, default=20000,
+                        help="Calls timed for each measurement")
+    args = parser.parse_args(argv)
+
+    print("  {:<28} {:>11} {:>11}".format("", "arrow", "timecodec"))
+    for name, text in SAMPLES.items():
+        assert timecodec.parse_arrow(text) == arrow.get(text)
+        print(name, repr(text))
+        report("parse", lambda: arrow.get(text),
+               lambda: timecodec.parse_arrow(text), args.number)
+        report("parse to epoch seconds", lambda: arrow.get(text).timestamp,
+               lambda: timecodec.parse_epoch(text), args.number)
+    epoch, tzinfo = timecodec.parse_epoch(SAMPLES["calendar event"])
+    print("format")
+    report("epoch seconds to ISO", 
+           lambda: arrow.Arrow.fromtimestamp(epoch, tzinfo).isoformat(),
+           lambda: timecodec.isoformat(epoch, tzinfo), args.number)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,188 @@
+"""
+A stand-in for the Google calendar 'service' object, serving
+events from memory, so that fetching can be tested and benchmarked
+without a network connection or credentials.
+
+Usage mirrors the real service:
+    service = FakeCalendarService({"cal-id": [event, ...]})
+    service.events().list(calendarId="cal-id").execute()
+"""
+
+import arrow
+from dateutil import tz
+import threading
+import time
+
+
+class FakeCalendarService:
+    """
+    Serves a fixed set of calendars.  Each calendar is a list of
+    event dicts in the form the calendar API returns them, e.g.
+       {"summary": "Lunch",
+        "start": {"dateTime": "2016-02-22T12:00:00-08:00"},
+        "end": {"dateTime": "2016-02-22T13:00:00-08:00"}}
+    """
+
+    def __init__(self, calendars, latency=0.0, page_size=250):
+        """
+        Arguments:
+            calendars: dict from calendar id to list of event dicts
+            latency: seconds each request takes, either one number
+                or a dict from calendar id to seconds
+            page_size: Most events returned by one request (the 
+                real API also caps this, whatever maxResults asks for)
+        """
+        self.calendars = calendars
+        self.latency = latency
+        self.page_size = page_size
+        self.requests = [ ]    # (resource, arguments) of each request executed
+        self.https = [ ]       # The http object each was executed with (None for the service's own)
+        self._lock = threading.Lock()
+        # Changes made with change() and cancel(), as (sequence number,
+        # calendar id, event); sync tokens are sequence numbers
+        self.changes = [ ]
+        self.expired_before = 0   # Sync tokens lower than this get 410 Gone
+        self.freebusy_error = None   # Raised by freebusy queries, if set
+
+    def events(self):
+        return _Resource(self, "events")
+
+    def calendarList(self):
+        return _Resource(self, "calendarList")
+
+    def freebusy(self):
+        return _Resource(self, "freebusy")
+
+    def change(self, calendar_id, event):
+        """Add an event, or replace the event with the same id."""
+        events = self.calendars[calendar_id]
+        events[:] = [ old for old in events if old.get("id") != event["id"] ] + [ event ]
+        self.changes.append((len(self.changes) + 1, calendar_id, event))
+
+    def cancel(self, calendar_id, event_id):
+        """Delete an event."""
+        events = self.calendars[calendar_id]
+        events[:] = [ old for old in events if old.get("id") != event_id ]
+        self.changes.append((len(self.changes) + 1, calendar_id,
+                             { "id": event_id, "status": "cancelled" }))
+
+    def delay(self, calendar_id):
+        """Seconds a request for calendar_id takes."""
+        if isinstance(self.latency, dict):
+            return self.latency.get(calendar_id, 0.0)
+        return self.latency
+
+    def record(self, resource, args, http=None):
+        with self._lock:
+            self.requests.append((resource, args))
+            self.https.append(http)
+
+
+class FakeHttpError(Exception):
+    """Like apiclient.errors.HttpError: the status is in resp.status."""
+
+    def __init__(self, status, message):
+        Exception.__init__(self, message)
+        self.resp = _Response(status)
+
+
+class _Response:
+    def __init__(self, status):
+        self.status = status
+
+
+class _Resource:
+    """Collection of methods, like service.events()."""
+
+    def __init__(self, service, name):
+        self.service = service
+        self.name = name
+
+    def list(self, **args):
+        return _Request(self.service, self.name, args)
+
+    def query(self, **args):
+        return _Request(self.service, self.name, args)
+
+
+class _Request:
+    """A request that is only carried out by execute()."""
+
+    def __init__(self, service, resource, args):
+        self.service = service
+        self.resource = resource
+        self.args = args
+
+    def execute(self, http=None, num_retries=0):
+        service = self.service
+        service.record(self.resource, self.args, http)
+        if self.resource == "calendarList":
+            return { "items": [ {"kind": "calendar#calendarListEntry",
+                                 "id": calendar_id, "summary": calendar_id,
+                                 "selected": True}
+                                for calendar_id in service.calendars ] }
+        if self.resource == "freebusy":
+            if service.freebusy_error is not None:
+                raise service.freebusy_error
+            return self._freebusy(self.args["body"])
+        calendar_id = self.args["calendarId"]
+        if calendar_id not in service.calendars:
+            raise KeyError("No calendar {}".format(calendar_id))
+        time.sleep(service.delay(calendar_id))
+        events = service.calendars[calendar_id]
+        if self.args.get("syncToken"):
+            since = int(self.args["syncToken"])
+            if since < service.expired_before:
+                raise FakeHttpError(410, "Sync token is no longer valid")
+            events = [ event for seq, changed_id, event in service.changes 
+                       if seq > since and changed_id == calendar_id ]
+        if self.args.get("timeMin"):
+            time_min = arrow.get(self.args["timeMin"])
+            events = [ event for event in events 
+                       if arrow.get(event["end"]["dateTime"]) > time_min ]
+        if self.args.get("timeMax"):
+            time_max = arrow.get(self.args["timeMax"])
+            events = [ event for event in events 
+                       if arrow.get(event["start"]["dateTime"]) < time_max ]
+        page_size = min(service.page_size, self.args.get("maxResults") or service.page_size)
+        first = int(self.args.get("pageToken") or 0)
+        page = { "items": events[first:first + page_size] }
+        if first + page_size < len(events):
+            page["nextPageToken"] = str(first + page_size)
+        else:
+            page["nextSyncToken"] = str(len(service.changes))
+        return page
+
+    def _freebusy(self, body):
+        """Busy periods (one per opaque event) of each calendar in a query."""
+        service = self.service
+        time.sleep(max([ service.delay(item["id"]) for item in body["items"] ] + [ 0.0 ]))
+        time_min = arrow.get(body["timeMin"])
+        time_max = arrow.get(body["timeMax"])
+        calendars = { }
+        for item in body["items"]:
+            if item["id"] not in service.calendars:
+                calendars[item["id"]] = { "errors": [ {"domain": "global", "reason": "notFound"} ],
+                                          "busy": [ ] }
+                continue
+            busy = [ ]
+            for event in service.calendars[item["id"]]:
+                if event.get("transparency") == "transparent":
+                    continue
+                if (arrow.get(event["end"]["dateTime"]) > time_min and
+                    arrow.get(event["start"]["dateTime"]) < time_max):
+                    busy.append({ "start": _freebusy_time(event["start"]["dateTime"], body),
+                                  "end": _freebusy_time(event["end"]["dateTime"], body) })
+            calendars[item["id"]] = { "busy": busy }
+        return { "kind": "calendar#freeBusy", "calendars": calendars }
+
+
+def _freebusy_time(text, body):
+    """
+    A time as the freebusy query gives it: in the query's timeZone if
+    it has one, otherwise in UTC, written with a Z.
+    """
+    when = arrow.get(text)
+    if body.get("timeZone"):
+        return when.to(tz.gettz(body["timeZone"])).isoformat()
+    return when.to("UTC").format("YYYY-MM-DDTHH:mm:ss") + "Z"
@@ -0,0 +1,449 @@
+"""
+Retrieving busy times from Google calendar 'service' objects.
+
+Nothing here touches the flask session: the functions take the
+service object (or a fake, see fake_gcal.py) and whatever else they
+need as arguments, so they can be used and tested outside a request.
+"""
+
+import calendar
+import collections
+import concurrent.futures
+import datetime
+import threading
+import time
+
+from dateutil import tz
+
+import metrics
+import timecodec
+
+# Only the parts of each event we use, and the largest page the API allows
+EVENT_FIELDS = "nextPageToken,items(summary,transparency,start,end)"
+PAGE_SIZE = 2500
+
+# The freebusy query accepts at most this many calendars at a time
+FREEBUSY_MAX_CALENDARS = 50
+
+# Bounds on fetching several calendars at once
+FETCH_WORKERS = 8     # Calendars fetched in parallel
+FETCH_TIMEOUT = 20    # Seconds allowed for each calendar
+_POLL = 0.05          # Seconds between checks for timed-out calendars
+
+# How long a built service object is reused, at most
+SERVICE_TTL = 15 * 60  # Seconds
+
+# Event cache: how long cached events are used without asking for
+# changes, and the fields needed to apply incremental changes
+EVENT_TTL = 5 * 60     # Seconds
+SYNC_FIELDS = "nextPageToken,nextSyncToken,items(id,status,summary,transparency,start,end)"
+
+# How long the busy times of a day are reused (see DayCache)
+DAY_TTL = EVENT_TTL    # Seconds
+
+
+class ServiceCache:
+    """
+    Reuses calendar service objects, which are slow to build, for 
+    requests made with the same OAuth2 credentials.  A cached service
+    may be used by several threads at once, so its own http object
+    must not be: requests are executed with execute(http=...), each
+    with an http object of its own.
+
+    Entries are keyed by access token, so a refreshed token gets a
+    new service.  An entry is dropped SERVICE_TTL seconds after it is
+    built or when its token expires, whichever comes first, and the
+    least recently used entries go when there are more than max_entries.
+    """
+
+    def __init__(self, ttl=SERVICE_TTL, max_entries=100):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._entries = collections.OrderedDict()  # token -> (service, expires)
+        self._lock = threading.Lock()
+
+    def get(self, credentials, build):
+        """
+        Return the service object for credentials, calling 
+        build(credentials) to make one if there is none cached.
+        """
+        key = credentials.access_token
+        now = time.time()
+        with self._lock:
+            if key in self._entries:
+                service, expires = self._entries[key]
+                if now < expires:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return service
+                del self._entries[key]
+            self.misses += 1
+        service = build(credentials)
+        expires = now + self.ttl
+        if credentials.token_expiry is not None:
+            # oauth2client keeps the expiry as a naive UTC datetime
+            expires = min(expires, calendar.timegm(credentials.token_expiry.utctimetuple()))
+        with self._lock:
+            self._entries[key] = (service, expires)
+            for old_key, (old_service, old_expires) in list(self._entries.items()):
+                if old_expires <= now:
+                    del self._entries[old_key]
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return service
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class DayCache:
+    """
+    Busy times fetched for each day, so that when the date range
+    changes only the days not seen before are fetched.
+
+    Entries are keyed by whatever else the day results depend on (the
+    user, the calendars, the time range of each day), and each holds
+    a dict keyed by ISO date, "busy", for the caller to fill in.  An
+    entry is started afresh ttl seconds after it was started, so
+    changes made to calendars in the meantime are seen, and the least
+    recently used entries go beyond max_entries.
+    """
+
+    def __init__(self, ttl=DAY_TTL, max_entries=1000):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries = collections.OrderedDict()  # key -> (days, started)
+        self._lock = threading.Lock()
+
+    def days(self, key):
+        """The {"busy": {...}} dict of key, empty if new or expired."""
+        now = time.time()
+        with self._lock:
+            if key in self._entries:
+                days, started = self._entries[key]
+                if now < started + self.ttl:
+                    self._entries.move_to_end(key)
+                    return days
+            days = { "busy": { } }
+            self._entries[key] = (days, now)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+            return days
+
+    def __len__(self):
+        return len(self._entries)
+
+
+def iter_events(service, calendar_id, time_min=None, time_max=None, http=None):
+    """
+    Generate the events (as dicts from the calendar API) of one
+    calendar that overlap a time window, fetching further pages
+    only as they are needed.
+
+    Arguments:
+        service: A Google calendar service object
+        calendar_id: Id of the calendar to read
+        time_min, time_max: (optional) ISO format date-times.  Only
+            events ending after time_min and starting before time_max
+            are requested.  The calendar API does this filtering, so
+            events outside the window are never transferred.
+        http: (optional) http object to execute the requests with,
+            in place of the one the service was built with.
+    """
+    page_token = None
+    while True:
+        request = service.events().list(calendarId=calendar_id, pageToken=page_token,
+                                        timeMin=time_min, timeMax=time_max,
+                                        maxResults=PAGE_SIZE, fields=EVENT_FIELDS)
+        page = request.execute(http=http)
+        for event in page.get('items', []):
+            yield event
+        page_token = page.get('nextPageToken')
+        if not page_token:
+            return
+
+
+def list_events(service, calendar_id, time_min=None, time_max=None, http=None):
+    """
+    Return the list of all events of one calendar that overlap a 
+    time window; arguments as for iter_events.
+    """
+    return list(iter_events(service, calendar_id, time_min, time_max, http))
+
+
+class EventCache:
+    """
+    Events of each calendar, kept between requests and brought up to
+    date with the calendar API's sync tokens, so that asking for the
+    same calendars again only transfers the events that changed.
+
+    The first request for a calendar reads all its events (sync tokens
+    can't be combined with a time window) and keeps the parsed begin 
+    and end of each; later requests ask only for changes since the 
+    last one, or nothing at all within ttl seconds.  Windows are 
+    filtered here.  When more than max_events are cached, the least
+    recently used calendars are dropped.
+    """
+
+    def __init__(self, ttl=EVENT_TTL, max_events=200000):
+        self.ttl = ttl
+        self.max_events = max_events
+        self.full_syncs = 0
+        self.incremental_syncs = 0
+        self.hits = 0
+        # (owner, calendar id) -> [ {event id: (begin, end, event)}, sync token, synced at ]
+        self._calendars = collections.OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+
+    def events(self, service, calendar_id, time_min=None, time_max=None, http=None, owner=None):
+        """
+        Return the list of events of one calendar that overlap a time
+        window, like list_events, from the cache where possible.
+
+        Arguments:
+            service, calendar_id, time_min, time_max, http: 
+                as for list_events
+            owner: Whose view of the calendar this is (e.g. a hash of
+                their credentials).  Different users may be allowed 
+                to see different amounts of the same calendar, so 
+                they don't share cached events.
+        """
+        key = (owner, calendar_id)
+        with self._lock:
+            entry = self._calendars.get(key)
+            if entry:
+                self._calendars.move_to_end(key)
+        if entry and time.time() - entry[2] < self.ttl:
+            self.hits += 1
+        else:
+            entry = self._sync(service, calendar_id, entry, http)
+            with self._lock:
+                old = self._calendars.pop(key, None)
+                if old:
+                    self._size -= len(old[0])
+                self._calendars[key] = entry
+                self._size += len(entry[0])
+                while self._size > self.max_events and len(self._calendars) > 1:
+                    old_key, old = self._calendars.popitem(last=False)
+                    self._size -= len(old[0])
+        begin = timecodec.parse_epoch(time_min)[0] if time_min else None
+        end = timecodec.parse_epoch(time_max)[0] if time_max else None
+        return [ event for event_begin, event_end, event in entry[0].values()
+                 if (begin is None or event_end > begin) and
+                    (end is None or event_begin < end) ]
+
+    def _sync(self, service, calendar_id, entry, http):
+        """A new cache entry: entry updated with changes, or read afresh."""
+        if entry and entry[1]:
+            events = dict(entry[0])
+            try:
+                token = self._read(service, calendar_id, events, entry[1], http)
+                self.incremental_syncs += 1
+                return [ events, token, time.time() ]
+            except Exception as err:
+                # 410 Gone: the sync token has expired, so start over
+                if getattr(getattr(err, 'resp', None), 'status', None) != 410:
+                    raise
+        events = { }
+        token = self._read(service, calendar_id, events, None, http)
+        self.full_syncs += 1
+        return [ events, token, time.time() ]
+
+    def _read(self, service, calendar_id, events, sync_token, http):
+        """
+        Apply every page of events (or of changes since sync_token) to 
+        the dict events, and return the next sync token.
+        """
+        page_token = None
+        while True:
+            request = service.events().list(calendarId=calendar_id, pageToken=page_token,
+                                            syncToken=sync_token, maxResults=PAGE_SIZE,
+                                            fields=SYNC_FIELDS)
+            page = request.execute(http=http)
+            for event in page.get('items', []):
+                if event.get('status') == 'cancelled':
+                    events.pop(event['id'], None)
+                    continue
+                start = event['start'].get('dateTime', event['start'].get('date'))
+                end = event['end'].get('dateTime', event['end'].get('date'))
+                events[event['id']] = (timecodec.parse_epoch(start)[0], 
+                                       timecodec.parse_epoch(end)[0], event)
+            page_token = page.get('nextPageToken')
+            if not page_token:
+                return page.get('nextSyncToken')
+
+    def __len__(self):
+        """Number of events cached."""
+        return self._size
+
+
+def fetch_calendars(service, calendar_ids, http_factory=None, time_min=None, time_max=None,
+                    max_workers=FETCH_WORKERS, timeout=FETCH_TIMEOUT, cache=None, owner=None):
+    """
+    Fetch the events of several calendars concurrently.
+
+    The http objects used by the calendar API are not thread safe, so
+    each calendar is fetched with a fresh one from http_factory.
+
+    Arguments:
+        service: A Google calendar service object
+        calendar_ids: Ids of the calendars to read
+        http_factory: (optional) function of no arguments returning an
+            authorized http object.  If None, requests use the service's own.
+        time_min, time_max: (optional) Window of time to fetch events
+            for, as for iter_events
+        max_workers: At most this many calendars are fetched at once
+        timeout: Seconds a calendar may take, counted from when its
+            fetch starts, before we give up on it
+        cache: (optional) An EventCache to get the events from
+        owner: Owner of the credentials, when using a cache
+    Yields:
+        (calendar_id, events, error) for each calendar, in the order
+        they complete.  events is the list of event dicts, or None if the
+        fetch failed, in which case error is the exception (a
+        concurrent.futures.TimeoutError for calendars that took too long).
+    """
+    started = { }
+    timings = metrics.current()    # The fetches run in other threads
+
+    def fetch(calendar_id, position):
+        started[calendar_id] = time.monotonic()
+        with metrics.timed("fetch", timings, metrics.calendar_item(position)):
+            http = http_factory() if http_factory else None
+            if cache is not None:
+                return cache.events(service, calendar_id, time_min, time_max, http, owner)
+            return list_events(service, calendar_id, time_min, time_max, http)
+
+    executor = concurrent.futures.ThreadPoolExecutor(max_workers=max(1, max_workers))
+    try:
+        pending = { executor.submit(fetch, calendar_id, position): calendar_id
+                    for position, calendar_id in enumerate(calendar_ids) }
+        while pending:
+            done, _ = concurrent.futures.wait(
+                pending, timeout=_POLL,
+                return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in done:
+                calendar_id = pending.pop(future)
+                try:
+                    yield calendar_id, future.result(), None
+                except Exception as err:
+                    yield calendar_id, None, err
+            now = time.monotonic()
+            for future, calendar_id in list(pending.items()):
+                if (calendar_id in started and
+                    now - started[calendar_id] > timeout):
+                    del pending[future]
+                    yield calendar_id, None, concurrent.futures.TimeoutError(
+                        "Calendar {} took over {} seconds".format(calendar_id, timeout))
+    finally:
+        # Don't wait for fetches we gave up on
+        executor.shutdown(wait=False)
+
+
+def fetch_freebusy(service, calendar_ids, time_min, time_max, http=None, tzinfo=None):
+    """
+    Get just the busy times of several calendars from the freebusy
+    query, which returns a start and end for each busy period instead of
+    whole events, with one request per FREEBUSY_MAX_CALENDARS calendars.
+
+    Arguments:
+        service: A Google calendar service object
+        calendar_ids: Ids of the calendars to read
+        time_min, time_max: ISO format date-times; the window of 
+            time to get busy periods for
+        http: (optional) http object to execute the requests with
+        tzinfo: Time zone to give the busy periods in (local time if
+            None).  The query answers in UTC, but events are checked
+            against the time range in their own time zone, so the
+            periods are converted to the time zone of the range.
+    Yields:
+        (calendar_id, events, error) for each calendar, like 
+        fetch_calendars.  Each busy period is given as an event dict 
+        with summary "Busy", so it can be treated like any other event.
+        Calendars the query reports errors for have events None and
+        a LookupError; if the query itself fails, each of its calendars
+        has events None and the exception.
+    """
+    calendar_ids = list(calendar_ids)
+    tzinfo = tzinfo or tz.tzlocal()
+    def in_zone(text):
+        return timecodec.parse_datetime(text).astimezone(tzinfo).isoformat()
+    for first in range(0, len(calendar_ids), FREEBUSY_MAX_CALENDARS):
+        batch = calendar_ids[first:first + FREEBUSY_MAX_CALENDARS]
+        body = { "timeMin": time_min, "timeMax": time_max,
+                 "items": [ {"id": calendar_id} for calendar_id in batch ] }
+        try:
+            with metrics.timed("fetch", item="freebusy {}".format(first // FREEBUSY_MAX_CALENDARS)):
+                calendars = service.freebusy().query(body=body).execute(http=http)['calendars']
+        except Exception as err:
+            # As when fetch_calendars can't read a calendar
+            for calendar_id in batch:
+                yield calendar_id, None, err
+            continue
+        for calendar_id in batch:
+            calendar = calendars.get(calendar_id, { "errors": [ {"reason": "notFound"} ] })
+            if calendar.get('errors'):
+                reasons = ", ".join(error.get('reason', '?') for error in calendar['errors'])
+                yield calendar_id, None, LookupError(
+                    "Calendar {}: {}".format(calendar_id, reasons))
+                continue
+            events = [ { "summary": "Busy",
+                         "start": { "dateTime": in_zone(period['start']) },
+                         "end": { "dateTime": in_zone(period['end']) } }
+                       for period in calendar.get('busy', []) ]
+            yield calendar_id, events, None
+
+
+def window_filter(begin_date, end_date, begin_time, end_time):
+    """
+    Build the test for whether an event is in the desired meeting date
+    and time range, parsing the range just once.
+
+    Arguments:
+        begin_date, end_date, begin_time, end_time: ISO format strings,
+            as kept in the session; only the dates of the first two and
+            the times of the last two matter.  If end_date is None there
+            is no last date.
+    Returns:
+        A function in_window(begin, end) of the begin and end datetimes of an
+        event, true IFF the event begins and ends within the date range
+        and overlaps the time range.
+    """
+    desired_sd = timecodec.parse_datetime(begin_date).date()
+    desired_ed = timecodec.parse_datetime(end_date).date() if end_date else datetime.date.max
+    desired_st = timecodec.parse_datetime(begin_time).time()
+    desired_et = timecodec.parse_datetime(end_time).time()
+
+    def in_window(event_sdt, event_edt):
+        if not (desired_sd <= event_sdt.date() <= desired_ed):
+            return False
+        if not (desired_sd <= event_edt.date() <= desired_ed):
+            return False
+        return event_edt.time() > desired_st and event_sdt.time() < desired_et
+
+    return in_window
+
+
+def busy_events(events, in_window):
+    """
+    The busy times among a batch of events: those that block time
+    (are not transparent) and are in_window (see window_filter).
+
+    Returns:
+        A list of busy times in the form kept in the session, 
+        {"desc": summary, "begin": isoformat, "end": isoformat}.
+    """
+    busy = [ ]
+    for event in events:
+        if event.get('transparency') == 'transparent':
+            continue
+        start_datetime = timecodec.parse_datetime(event['start']['dateTime'])
+        end_datetime = timecodec.parse_datetime(event['end']['dateTime'])
+        if in_window(start_datetime, end_datetime):
+            busy.append({ "desc": event['summary'], "begin": start_datetime.isoformat(),
+                          "end": end_datetime.isoformat() })
+    return busy
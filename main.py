@@ -4,13 +4,15 @@ from flask import request
 from flask import url_for
 import uuid
 
+import hashlib
+import itertools
 import json
 import logging
+import os
 
 # Date handling 
 import arrow # Replacement for datetime, based on moment.js
 import datetime # But we still need time
-from dateutil import tz  # For interpreting local times
 
 
 # OAuth2  - Google library implementation for convenience
@@ -21,6 +23,11 @@ import httplib2   # used in oauth2 flow
 from apiclient import discovery
 
 from agenda import *
+import gcal
+import metrics
+import pipeline
+import session_store
+import timecodec
 
 ###
 # Globals
@@ -32,6 +39,67 @@ SCOPES = 'https://www.googleapis.com/auth/calendar.readonly'
 CLIENT_SECRET_FILE = CONFIG.GOOGLE_LICENSE_KEY  ## You'll need this
 APPLICATION_NAME = 'MeetMe class project'
 
+# A copy of the calendar API's discovery document, so building a
+# service object doesn't have to download it.  Built services are
+# reused while their credentials are good (see gcal.ServiceCache).
+DISCOVERY_DOC = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             "discovery", "calendar.v3.json")
+SERVICE_CACHE = gcal.ServiceCache()
+
+# Events of the calendars we've read, kept up to date with sync tokens
+# so that recalculating only fetches what changed (see gcal.EventCache)
+if getattr(CONFIG, "EVENT_CACHE", True):
+  EVENT_CACHE = gcal.EventCache(ttl=getattr(CONFIG, "EVENT_CACHE_TTL", gcal.EVENT_TTL))
+else:
+  EVENT_CACHE = None
+
+# Busy times of each day already fetched, so that changing the date
+# range only fetches the new days (see gcal.DayCache)
+if getattr(CONFIG, "DAY_CACHE", True):
+  DAY_CACHE = gcal.DayCache(ttl=getattr(CONFIG, "EVENT_CACHE_TTL", gcal.DAY_TTL))
+else:
+  DAY_CACHE = None
+
+# Free times of each day's time block already worked out, shared by all
+# users: a day with the same busy times isn't complemented again
+COMPLEMENT_MEMO = ComplementMemo(max_entries=getattr(CONFIG, "COMPLEMENT_MEMO_ENTRIES", 10000))
+
+# Session contents (busy and free lists can be large) are kept on the
+# server, with only a key in the cookie; "cookie" keeps flask's default.
+SESSION_STORE = getattr(CONFIG, "SESSION_STORE", "memory")
+if SESSION_STORE == "memory":
+  app.session_interface = session_store.ServerSideSessionInterface(
+      session_store.MemoryStore())
+elif SESSION_STORE == "sqlite":
+  app.session_interface = session_store.ServerSideSessionInterface(
+      session_store.SqliteStore(getattr(CONFIG, "SESSION_DB", "sessions.db")))
+
+# With METRICS the timings of each stage of every request are shown at
+# /metrics, to requests from this machine only, and with METRICS_LOG each
+# request's breakdown is logged as a line of JSON
+METRICS = getattr(CONFIG, "METRICS", False)
+LOCAL_ADDRESSES = ("127.0.0.1", "::1")
+if getattr(CONFIG, "METRICS_LOG", False):
+  METRICS_LOG = logging.getLogger("meetme.metrics")
+  METRICS_LOG.setLevel(logging.INFO)
+  if not METRICS_LOG.handlers:
+    METRICS_LOG.addHandler(logging.StreamHandler())
+else:
+  METRICS_LOG = None
+
+@app.before_request
+def begin_metrics():
+  if request.endpoint not in ('metrics_page', 'static'):
+    metrics.begin_request(request.path)
+
+@app.teardown_request
+def end_metrics(exc):
+  """
+  Runs once the response has been sent, so a streamed response
+  (see busyFreeTimes) is counted when its last line is out.
+  """
+  metrics.end_request(METRICS_LOG)
+
 #############################
 #
 #  Pages (routed from URLs)
@@ -60,7 +128,9 @@ def choose():
 
     gcal_service = get_gcal_service(credentials)
     app.logger.debug("Returned from get_gcal_service")
-    flask.session['calendars'] = list_calendars(gcal_service)
+    # The cached service's own http object may be in use by another request
+    flask.session['calendars'] = list_calendars(gcal_service,
+                                                credentials.authorize(httplib2.Http()))
     return render_template('index.html')
 
 ####
@@ -102,8 +172,9 @@ def valid_credentials():
     if 'credentials' not in flask.session:
       return None
 
-    credentials = client.OAuth2Credentials.from_json(
-        flask.session['credentials'])
+    with metrics.timed("credentials"):
+        credentials = client.OAuth2Credentials.from_json(
+            flask.session['credentials'])
 
     if (credentials.invalid or
         credentials.access_token_expired):
@@ -120,13 +191,29 @@ def get_gcal_service(credentials):
   control flow will be interrupted by authorization, and we'll
   end up redirected back to /choose *without a service object*.
   Then the second call will succeed without additional authorization.
+  Service objects are cached per access token, so several requests
+  can be using one at once; httplib2 objects aren't thread safe, so
+  requests must be executed with an http object of their own
+  (credentials.authorize(httplib2.Http())), not the service's.
   """
   app.logger.debug("Entering get_gcal_service")
-  http_auth = credentials.authorize(httplib2.Http())
-  service = discovery.build('calendar', 'v3', http=http_auth)
+  with metrics.timed("service"):
+    service = SERVICE_CACHE.get(credentials, build_gcal_service)
   app.logger.debug("Returning service")
   return service
 
+def build_gcal_service(credentials):
+  """
+  Build a new calendar service object, from the bundled discovery
+  document if we have it, otherwise from the one Google serves.
+  """
+  http_auth = credentials.authorize(httplib2.Http())
+  with metrics.timed("discovery_build"):
+    if os.path.exists(DISCOVERY_DOC):
+      with open(DISCOVERY_DOC) as doc:
+        return discovery.build_from_document(doc.read(), http=http_auth)
+    return discovery.build('calendar', 'v3', http=http_auth)
+
 @app.route('/oauth2callback')
 def oauth2callback():
   """
@@ -162,6 +249,10 @@ def oauth2callback():
     auth_code = flask.request.args.get('code')
     credentials = flow.step2_exchange(auth_code)
     flask.session['credentials'] = credentials.to_json()
+    # A server-side session gets a new key now that it holds credentials
+    regenerate = getattr(flask.session, "regenerate", None)
+    if regenerate is not None:
+      regenerate()
     ## Now I can build the service and execute the query,
     ## but for the moment I'll just log it and go back to
     ## the main screen
@@ -225,15 +316,145 @@ def calcBusyFreeTimes():
     selected. Then, this function calls find_busy() which goes through the list of 
     calendar ids and finds the times in the time span in which the user cannot meet. In 
     addition, this function calls find_free which finds the times in the time span in which
-    the user can meet.  
+    the user can meet.  The 'source' argument chooses where busy times come from (see find_busy).
     """
     selected_cal = request.args.getlist("selected[]")
     flask.session['selected_cal'] = selected_cal
     app.logger.debug(flask.session['selected_cal'])
-    find_busy() #a list of dicts. Finds busy_list
+    find_busy(request.args.get("source", "events")) #a list of dicts. Finds busy_list
     find_free() #a list of dicts. Finds free_list
     return "nothing"
 
+@app.route('/busyFreeTimes')
+def busyFreeTimes():
+    """
+    Like calcBusyFreeTimes followed by displayBusyFreeTimes, in a single request:
+    the busy and free times are streamed back as they are computed, one JSON 
+    object per line, for the page to display as they arrive.  The lines are
+      {"type": "calendar", "calendar": id, "busy": count}  as each calendar is read
+      {"type": "error", "calendar": id, "message": text}   for calendars that can't be read
+      {"type": "day", "date": "YYYY-MM-DD", "times": [display strings]}  for each day in order
+      {"type": "done"}
+    Results are not kept in the session.
+    """
+    flask.session['selected_cal'] = request.args.getlist("selected[]")
+    # Don't leave results for other calendars to be shown when the page reloads
+    for key in ['busy_list', 'free_list', 'show_free_busy']:
+        flask.session.pop(key, None)
+    source = request.args.get("source", "events")
+    lines = metrics.stream(stream_busy_free(source), METRICS_LOG)
+    return flask.Response(flask.stream_with_context(lines),
+                          mimetype='application/x-ndjson')
+
+def stream_busy_free(source):
+    """
+    Generate the lines of the /busyFreeTimes response.  The free times of each day
+    are computed only once all busy times are in.
+    """
+    days = {}
+    for id, busy, error in fetch_busy_days(source, days):
+        if error:
+            yield json_line({"type": "error", "calendar": id,
+                             "message": "Could not read calendar {}; its busy times are not shown".format(id)})
+        else:
+            yield json_line({"type": "calendar", "calendar": id, "busy": len(busy)})
+    busy_list = busy_in_range(days)
+    busy_by_day = {}
+    for busy_dict in busy_list:
+        busy_by_day.setdefault(busy_dict['begin'][:10], []).append(busy_dict)
+    for date, free_list in free_by_day(busy_list):
+        free_busy = busy_by_day.get(date, []) + free_list
+        free_busy.sort(key=lambda r: r['begin']) #sort by begin date    
+        with metrics.timed("render"):
+            times = createDisplayAptList(free_busy)
+        yield json_line({"type": "day", "date": date, "times": times})
+    yield json_line({"type": "done"})
+
+@app.route('/groupSlots')
+def groupSlots():
+    """
+    Group scheduling: each selected calendar is taken as one participant
+    (shared calendars of colleagues, say), and the best times for them to
+    meet in the date and time range are returned as JSON, ranked by how
+    many of them are free (see Agenda.best_slots).  Arguments are
+      selected[]: the calendar ids
+      best: how many slots to return (default 5)
+      minutes: the shortest slot worth returning (default 0)
+      source: "events" or "freebusy", as for calcBusyFreeTimes
+    """
+    flask.session['selected_cal'] = request.args.getlist("selected[]")
+    best = request.args.get("best", 5, type=int)
+    minutes = request.args.get("minutes", 0, type=int)
+    if best < 0 or minutes < 0:
+        flask.abort(400)
+    span = session_span()
+    calendar_busy = {}
+    for id, busy, error in fetch_calendar_busy(request.args.get("source", "events")):
+        if not error:  # Nothing is known about when the others are free
+            calendar_busy[id] = busy
+    participants = [ id for id in flask.session['selected_cal'] if id in calendar_busy ]
+    free_agendas = [ Agenda.from_list(calendar_busy[id]).complementTimeSpan(*span, memo=COMPLEMENT_MEMO)
+                     for id in participants ]
+    slots = [ ]
+    for appt, free in Agenda.best_slots(free_agendas, best, minutes):
+        slot = appt.to_dict()
+        slot["free"] = [ participants[which] for which in free ]
+        slots.append(slot)
+    return flask.jsonify(participants=participants, slots=slots)
+
+@app.route('/freeSlots')
+def freeSlots():
+    """
+    Meeting slots of a given length in the free times of the selected
+    calendars, as JSON.  Arguments are
+      selected[]: the calendar ids
+      minutes: the length of a meeting (default 30)
+      step: slots begin on multiples of this many minutes (default 15)
+      limit: the most slots to return (default 20)
+      source: "events" or "freebusy", as for calcBusyFreeTimes
+    Free time is only worked out day by day until there are enough slots.
+    """
+    flask.session['selected_cal'] = request.args.getlist("selected[]")
+    minutes = request.args.get("minutes", 30, type=int)
+    step = request.args.get("step", 15, type=int)
+    limit = request.args.get("limit", 20, type=int)
+    if minutes <= 0 or step <= 0 or limit < 0:
+        flask.abort(400)
+    calendar_busy = {}
+    errors = []
+    for id, busy, error in fetch_calendar_busy(request.args.get("source", "events")):
+        if error:
+            errors.append("Could not read calendar {}; its busy times are not shown".format(id))
+            busy = []
+        calendar_busy[id] = busy
+    busy_list = []
+    for id in flask.session['selected_cal']:
+        busy_list.extend(calendar_busy[id])
+    free_days = Agenda.from_list(busy_list).complement_days(*session_span(), memo=COMPLEMENT_MEMO)
+    free = itertools.chain.from_iterable(free_agenda for date, free_agenda in free_days)
+    slots = itertools.islice(free_slots(free, minutes, step), limit)
+    return flask.jsonify(slots=[ slot.to_dict() for slot in slots ], errors=errors)
+
+@app.route('/metrics')
+def metrics_page():
+  """
+  Timings and counts of each stage of handling requests, totalled since
+  the server started, with the breakdowns of the last few requests, as
+  JSON (see metrics.Registry.snapshot).  Only shown to requests from
+  this machine, since the server may listen on every interface.
+  """
+  if not METRICS or request.remote_addr not in LOCAL_ADDRESSES:
+    flask.abort(404)
+  snapshot = metrics.REGISTRY.snapshot()
+  store_metrics = getattr(app.session_interface, "metrics", None)
+  if store_metrics is not None:
+    snapshot["session_store"] = dict(store_metrics)
+  return flask.jsonify(snapshot)
+
+def json_line(obj):
+    """One line of a JSON-lines response."""
+    return json.dumps(obj) + "\n"
+
 @app.route('/displayBusyFreeTimes')
 def displayBusyFreeTimes():
     """
@@ -242,22 +463,33 @@ def displayBusyFreeTimes():
     the user in sorted order by begin date/time.
     """
     createDisplayFreeBusyTimes()
-    return render_template('index.html')
+    with metrics.timed("render"):
+        return render_template('index.html')
     
 
 def createDisplayFreeBusyTimes():
     """
-    This function puts together a list of strings for displaying the busy and free times in 
-    order by begin date/time. 
+    This function marks the busy and free times in the session as ready to be displayed.
+    The strings for displaying them, in order by begin date/time, are only made while
+    the page is rendered (see free_busy_display), so they aren't stored in the session.
+    Nothing is marked if they haven't been calculated.
     """
-    free_busy = []
-    for busy_dict in flask.session['busy_list']:
-        free_busy.append(busy_dict)
-    for free_dict in flask.session['free_list']:
-        free_busy.append(free_dict)
-    free_busy.sort(key=lambda r: r['begin']) #sort by begin date    
-    
-    flask.session['display_free_busy'] = createDisplayAptList(free_busy)
+    if 'busy_list' in flask.session and 'free_list' in flask.session:
+        flask.session['show_free_busy'] = True
+
+
+@app.context_processor
+def free_busy_display():
+    """
+    Gives the template free_busy: the display strings of the busy and free times in 
+    order by begin date/time, made one by one as the template goes through them, or
+    None if there are none to show.
+    """
+    if (not flask.session.get('show_free_busy') or 'busy_list' not in flask.session
+            or 'free_list' not in flask.session):
+        return {'free_busy': None}
+    free_busy = pipeline.merge_busy_free(flask.session['busy_list'], flask.session['free_list'])
+    return {'free_busy': displayAptList(free_busy)}
 
 
 def createDisplayAptList(apt_list):
@@ -265,14 +497,15 @@ def createDisplayAptList(apt_list):
     This function takes in a list of appointments and returns a list of strings representing
     the appointments, where the strings are suited for displaying the appointments to the user. 
     """
-    display_apt_list = []
-    for apt in apt_list:
-        apt_str = ""
-        apt_str = apt_str + apt['desc'] + ": "
-        apt_str = apt_str + convertDisplayDateTime(apt['begin']) + " - "
-        apt_str = apt_str + convertDisplayDateTime(apt['end']) 
-        display_apt_list.append(apt_str)
-    return display_apt_list
+    return list(displayAptList(apt_list))
+
+
+def displayAptList(apt_list):
+    """
+    Generator form of createDisplayAptList, yielding the string for each appointment in turn
+    (see pipeline.display_list).
+    """
+    return pipeline.display_list(apt_list)
         
             
 
@@ -308,16 +541,15 @@ def interpret_time( text ):
     case it will also flash a message explaining accepted formats.
     """
     app.logger.debug("Decoding time '{}'".format(text))
-    time_formats = ["ha", "h:mma",  "h:mm a", "h:mm A", "H:mm"]
     try: 
-        as_arrow = arrow.get(text, time_formats).replace(tzinfo=tz.tzlocal())
+        as_iso = pipeline.parse_time(text)
         app.logger.debug("Succeeded interpreting time")
     except:
         app.logger.debug("Failed to interpret time")
         flask.flash("Time '{}' didn't match accepted formats 13:30 or 1:30pm"
               .format(text))
         raise
-    return as_arrow.isoformat()
+    return as_iso
 
 def interpret_date( text ):
     """
@@ -325,19 +557,16 @@ def interpret_date( text ):
     with the local time zone.
     """
     try:
-      as_arrow = arrow.get(text, "MM/DD/YYYY").replace(
-          tzinfo=tz.tzlocal())
+      return pipeline.parse_date(text)
     except:
         flask.flash("Date '{}' didn't fit expected format 12/31/2001")
         raise
-    return as_arrow.isoformat()
 
 def next_day(isotext):
     """
     ISO date + 1 day (used in query to Google calendar)
     """
-    as_arrow = arrow.get(isotext)
-    return as_arrow.replace(days=+1).isoformat()
+    return pipeline.next_day(isotext)
 
 ####
 #
@@ -350,86 +579,136 @@ def find_free():
     This function takes flask.session['busy_list'], flask.session['begin_date], flask.session['end_date'], 
     flask.session['begin_time'], and flask.session['end_time'] and computes the free times in which the
     user can meet within the date and time range and stores these free times in flask.session['free_list']
-    as a list of dictionaries.  
+    as a list of dictionaries.  Days whose busy times were seen before aren't complemented
+    again (see free_by_day).
     """
-    busy_agenda = Agenda.from_list(flask.session['busy_list'])
-        
-    span_begin_date = arrow.get(flask.session['begin_date'])
-    span_end_date = arrow.get(flask.session['end_date'])
-    span_begin_time = arrow.get(flask.session['begin_time'])
-    span_end_time = arrow.get(flask.session['end_time'])
-    free_agenda = busy_agenda.complementTimeSpan(span_begin_date, span_end_date, span_begin_time, span_end_time)
-    
-    flask.session['free_list'] = free_agenda.to_list()
+    flask.session['free_list'] = pipeline.find_free(flask.session['busy_list'],
+                                                    session_range(), COMPLEMENT_MEMO)
     app.logger.debug("HERE IS FREE_LIST")
     app.logger.debug(flask.session['free_list'])
 
 
-def find_busy():
+def session_range():
+    """The date and time range in the session, as a pipeline.Span."""
+    return pipeline.Span.from_session(flask.session)
+
+
+def session_span():
+    """
+    The begin date, end date, begin time and end time from the session, as arrow objects.
+    """
+    return session_range().arrows()
+
+
+def find_busy(source="events"):
     """
     This function goes through the list of selected calendar ids, which is stored in the 
-    session object, and collects all the appointments that lie within or partially overlap
+    session object, fetches those calendars in parallel, and collects all the appointments that lie within or partially overlap
     the desired meeting time range and are not transparent. It stores all the busy times
     it collects in flask.session['busy_list'] as a list of dictionaries.  
-    """
-    busy_list = [] #list of dicts
-    credentials = client.OAuth2Credentials.from_json(flask.session['credentials'])
-    service = get_gcal_service(credentials)
-    for id in flask.session['selected_cal']:
-        events = service.events().list(calendarId=id, pageToken=None).execute()
-        for event in events['items']:
-            if ('transparency' in event) and event['transparency']=='transparent':
-                continue 
-            start_datetime = arrow.get(event['start']['dateTime'])
-            end_datetime = arrow.get(event['end']['dateTime'])
-            if overlap(start_datetime, end_datetime): 
-                event_dict = {"desc":event['summary'], "begin":start_datetime.isoformat(), "end":end_datetime.isoformat()}
-                busy_list.append(event_dict)
+    With source "freebusy" only the busy periods are fetched, with one freebusy query for
+    all the calendars; this is much less data, but the busy times have no titles. 
+    Days already fetched for an earlier date range are not fetched again (see fetch_busy_days).
+    """
+    days = {}
+    for id, busy, error in fetch_busy_days(source, days):
+        if error:
+            flask.flash("Could not read calendar {}; its busy times are not shown".format(id))
+    busy_list = busy_in_range(days) #list of dicts
     
     app.logger.debug("HERE is busy list")
     app.logger.debug(busy_list)
     flask.session['busy_list'] = busy_list
 
 
-def overlap(event_sdt, event_edt):
-    """
-    This function returns true IFF the inputed event overlaps the desired meeting 
-    time and date range.
-    """
-#sdt = start date time 
-#edt = end date time 
-    event_sd = event_sdt.date()
-    event_ed = event_edt.date()
-    event_st = event_sdt.time()
-    event_et = event_edt.time()
-    desired_sd= arrow.get(flask.session['begin_date']).date()
-    desired_ed = arrow.get(flask.session['end_date']).date()
-    desired_st = arrow.get(flask.session['begin_time']).time()
-    desired_et = arrow.get(flask.session['end_time']).time()
-    if not (desired_sd <= event_sd <= desired_ed) or not (desired_sd <= event_ed <= desired_ed):
-        return False 
-    elif (event_et <= desired_st):
-        return False 
-    elif (event_st >= desired_et):
-        return False
-    else:
-        return True
+def fetch_busy_days(source, days):
+    """
+    Fill in days, a dict, with the busy times (lists of dicts, as in busy_list) of each
+    day of the date range, keyed by ISO date.  Days already worked out for the same
+    calendars and time range come from DAY_CACHE; each run of consecutive days that
+    aren't is fetched with one call to fetch_calendar_busy.  This is a generator
+    yielding (calendar id, busy list, error) for each calendar fetched, as
+    fetch_calendar_busy does; days for which some calendar can't be read aren't cached
+    (see pipeline.fetch_busy_days).
+    """
+    return pipeline.fetch_busy_days(
+        lambda first_day, last_day: fetch_calendar_busy(source, first_day, last_day),
+        flask.session['selected_cal'], session_range(), days, day_cache(source)['busy'])
+
+
+def busy_in_range(days):
+    """
+    The busy list of the date range, from the days filled in by fetch_busy_days:
+    busy times in order of their days, without those ending after the range.
+    """
+    return pipeline.busy_in_range(days, session_range())
+
+
+def free_by_day(busy_list):
+    """
+    Generate (ISO date, free list) for each day of the date range, in order: the 
+    free times of that day's time block, given the busy times in busy_list.  Days 
+    whose time block and busy times were seen before, for any user, come from
+    COMPLEMENT_MEMO instead of being complemented again.
+    """
+    return pipeline.free_by_day(busy_list, session_range(), COMPLEMENT_MEMO)
+
+
+def day_cache(source):
+    """
+    The DAY_CACHE entry for the session's user, calendars and time range, 
+    or a fresh one for this request if there is no day cache.
+    """
+    if DAY_CACHE is None:
+        return { "busy": { } }
+    credentials = client.OAuth2Credentials.from_json(flask.session['credentials'])
+    key = (credentials_owner(credentials), tuple(flask.session['selected_cal']), source,
+           flask.session['begin_time'], flask.session['end_time'])
+    return DAY_CACHE.days(key)
+
+
+def fetch_calendar_busy(source="events", first_day=None, last_day=None):
+    """
+    Fetch the selected calendars in parallel and pick out their busy times (see find_busy).
+    This is a generator yielding (calendar id, busy list, error) as each calendar
+    is read; if a calendar can't be read its busy list is None and error says why.
+    Busy times are those in the session's date range, or if first_day and last_day
+    (ISO date-times) are given, those beginning on those days however late they end.
+    """
+    with metrics.timed("credentials"):
+        credentials = client.OAuth2Credentials.from_json(flask.session['credentials'])
+    service = get_gcal_service(credentials)
+    # Calendars are fetched in parallel, each with its own http object
+    http_factory = lambda: credentials.authorize(httplib2.Http(timeout=gcal.FETCH_TIMEOUT))
+    fetched = pipeline.fetch_calendar_busy(service, flask.session['selected_cal'], session_range(),
+                                           source, first_day, last_day, http_factory,
+                                           EVENT_CACHE, credentials_owner(credentials))
+    for id, busy, error in fetched:
+        if error:
+            app.logger.warning("Failed to fetch calendar {}: {}".format(id, error))
+        yield id, busy, error
+
+
+def credentials_owner(credentials):
+    """
+    A name for whose credentials these are, that stays the same when the
+    access token is refreshed and doesn't give the token away.  Used to
+    keep different users' cached events apart.
+    """
+    token = credentials.refresh_token or credentials.access_token
+    return hashlib.sha256(token.encode()).hexdigest()
 
 
 def convertDisplayDateTime(date_time):
     """
-    This function takes in an isoformat() string, makes it into an arrow object, converts it to the 
-    local time of the server, and then returns it as a formatted string for displaying in the
-    form MM/DD/YYYY h:mm A. We use this function every time before we want to display a time 
-    to the user.
+    This function takes in an isoformat() string, converts it to the local time of the 
+    server, and then returns it as a formatted string for displaying in the form 
+    MM/DD/YYYY h:mm A.  For many times at once use displayAptList, which shares the work.
     """
-    arrow_date_time = arrow.get(date_time)
-    local_arrow = arrow_date_time.to('local')
-    formatted_str = local_arrow.format('MM/DD/YYYY h:mm A')
-    return formatted_str
+    return timecodec.DisplayFormatter().format(date_time)
 
 
-def list_calendars(service):
+def list_calendars(service, http=None):
     """
     Given a google 'service' object, return a list of
     calendars.  Each calendar is represented by a dict, so that
@@ -437,9 +716,10 @@ def list_calendars(service):
     json for cookies. The returned list is sorted to have
     the primary calendar first, and selected (that is, displayed in
     Google Calendars web app) calendars before unselected calendars.
+    The request is made with http if given (see get_gcal_service).
     """
     app.logger.debug("Entering list_calendars")  
-    calendar_list = service.calendarList().list().execute()["items"]
+    calendar_list = service.calendarList().list().execute(http=http)["items"]
     result = [ ]
     for cal in calendar_list:
         kind = cal["kind"]
@@ -491,7 +771,7 @@ def cal_sort_key( cal ):
 @app.template_filter( 'fmtdate' )
 def format_arrow_date( date ):
     try: 
-        normal = arrow.get( date )
+        normal = timecodec.parse_arrow( date )
         return normal.format("ddd MM/DD/YYYY")
     except:
         return "(bad date)"
@@ -499,7 +779,7 @@ def format_arrow_date( date ):
 @app.template_filter( 'fmttime' )
 def format_arrow_time( time ):
     try:
-        normal = arrow.get( time )
+        normal = timecodec.parse_arrow( time )
         return normal.format("HH:mm")
     except:
         return "(bad time)"
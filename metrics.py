@@ -0,0 +1,256 @@
+"""
+Timings and counts of the stages of working out busy and free times,
+to tell where a slow request spends its time.
+
+Each stage (checking credentials, building the calendar service,
+fetching each calendar, picking out busy times, complementing,
+rendering, saving the session) is timed with
+    with metrics.timed("fetch"):
+        ...
+which adds to the totals for that stage in REGISTRY, kept for the
+life of the process, and to the breakdown of the request being
+handled, if there is one (see begin_request).  Numbers that aren't
+times, like how many events were read or how big the session is,
+are recorded with metrics.count.
+
+Breakdowns are shown to whoever can see /metrics, so the items of a
+stage never name a user's calendars: calendars are given by their
+position in the request (see calendar_item).
+
+The request is kept per thread.  Work handed to other threads (as
+gcal.fetch_calendars does) passes current() along explicitly.
+
+Nothing here depends on flask; main.py begins and ends a request
+around each flask request, shows REGISTRY at /metrics, and can log
+each request's breakdown as one JSON line.
+"""
+
+import collections
+import contextlib
+import json
+import threading
+import time
+
+# Breakdowns of this many recent requests are kept
+RECENT_REQUESTS = 20
+
+
+class Registry:
+    """
+    Totals for each stage over all requests: how many times it ran,
+    the seconds it took altogether and the longest one.  Counts are
+    kept the same way, with amounts in place of seconds.
+    Safe to use from several threads.
+    """
+
+    def __init__(self, recent=RECENT_REQUESTS):
+        self._lock = threading.Lock()
+        self._stages = collections.OrderedDict()   # stage -> [times, total, longest]
+        self._counts = collections.OrderedDict()   # name -> [times, total, largest]
+        self.recent = collections.deque(maxlen=recent)
+
+    def record(self, stage, seconds):
+        """Add one run of stage, taking seconds."""
+        with self._lock:
+            _add(self._stages, stage, seconds)
+
+    def count(self, name, amount):
+        """Add an amount of something (events read, bytes saved)."""
+        with self._lock:
+            _add(self._counts, name, amount)
+
+    def finished(self, timings):
+        """Keep the breakdown of a finished request among the recent ones."""
+        with self._lock:
+            self.recent.append(timings.as_dict())
+            _add(self._stages, "request", timings.elapsed())
+
+    def snapshot(self):
+        """
+        All the totals, as a dict that can be shown as JSON:
+            {"stages": {stage: {"count", "total_ms", "mean_ms", "max_ms"}},
+             "counts": {name: {"count", "total", "mean", "max"}},
+             "recent": [breakdowns of recent requests, oldest first]}
+        """
+        with self._lock:
+            stages = collections.OrderedDict(
+                (stage, { "count": times, "total_ms": round(total * 1000, 3),
+                          "mean_ms": round(total * 1000 / times, 3),
+                          "max_ms": round(longest * 1000, 3) })
+                for stage, (times, total, longest) in self._stages.items())
+            counts = collections.OrderedDict(
+                (name, { "count": times, "total": total,
+                         "mean": round(total / times, 3), "max": largest })
+                for name, (times, total, largest) in self._counts.items())
+            return { "stages": stages, "counts": counts, "recent": list(self.recent) }
+
+    def reset(self):
+        """Forget everything recorded so far."""
+        with self._lock:
+            self._stages.clear()
+            self._counts.clear()
+            self.recent.clear()
+
+
+def _add(totals, name, amount):
+    entry = totals.get(name)
+    if entry is None:
+        totals[name] = [1, amount, amount]
+    else:
+        entry[0] += 1
+        entry[1] += amount
+        entry[2] = max(entry[2], amount)
+
+
+class RequestTimings:
+    """
+    The breakdown of one request: seconds spent in each stage, with
+    the seconds for each item of a stage done for several items (each
+    calendar fetched, say), and counts.
+    """
+
+    def __init__(self, name=""):
+        self.name = name
+        self.start = time.perf_counter()
+        self.stages = collections.OrderedDict()   # stage -> seconds
+        self.items = collections.OrderedDict()    # stage -> {item: seconds}
+        self.counts = collections.OrderedDict()   # name -> amount
+        self.streaming = False    # Finished when its stream is, not by end_request
+        self._lock = threading.Lock()
+
+    def record(self, stage, seconds, item=None):
+        with self._lock:
+            self.stages[stage] = self.stages.get(stage, 0) + seconds
+            if item is not None:
+                self.items.setdefault(stage, collections.OrderedDict())[item] = seconds
+
+    def count(self, name, amount):
+        with self._lock:
+            self.counts[name] = self.counts.get(name, 0) + amount
+
+    def elapsed(self):
+        """Seconds since the request began."""
+        return time.perf_counter() - self.start
+
+    def as_dict(self):
+        """The breakdown, in milliseconds, as a dict that can be shown as JSON."""
+        with self._lock:
+            return { "request": self.name,
+                     "total_ms": round(self.elapsed() * 1000, 3),
+                     "stages_ms": { stage: round(seconds * 1000, 3)
+                                    for stage, seconds in self.stages.items() },
+                     "items_ms": { stage: { item: round(seconds * 1000, 3)
+                                            for item, seconds in items.items() }
+                                   for stage, items in self.items.items() },
+                     "counts": dict(self.counts) }
+
+
+REGISTRY = Registry()
+_local = threading.local()
+
+
+def begin_request(name=""):
+    """Start the breakdown of a request handled in this thread, and return it."""
+    _local.timings = RequestTimings(name)
+    return _local.timings
+
+
+def end_request(log=None):
+    """
+    Finish the request begun in this thread: keep its breakdown in
+    REGISTRY and, if log is a logger, log it as a line of JSON.
+    Returns the breakdown, or None if no request was begun or its
+    response is still being streamed (see stream).
+    """
+    timings = getattr(_local, "timings", None)
+    _local.timings = None
+    if timings is None or timings.streaming:
+        return None
+    REGISTRY.finished(timings)
+    if log is not None:
+        log.info(json.dumps(dict(timings.as_dict(), event="request_metrics"), sort_keys=True))
+    return timings
+
+
+def stream(iterable, log=None):
+    """
+    The items of iterable, the parts of a streamed response, as a
+    generator that counts as part of the current request: the request
+    is finished, as by end_request(log), when the last one is out
+    rather than when the handler returns.
+    """
+    timings = current()
+    if timings is None:
+        return iter(iterable)
+    timings.streaming = True
+
+    def generate():
+        _local.timings = timings
+        try:
+            yield from iterable
+        finally:
+            timings.streaming = False
+            _local.timings = timings
+            end_request(log)
+    return generate()
+
+
+def current():
+    """The RequestTimings of the request in this thread, or None."""
+    return getattr(_local, "timings", None)
+
+
+@contextlib.contextmanager
+def timed(stage, timings=None, item=None):
+    """
+    Time the enclosed block as a run of stage, in REGISTRY and in
+    timings (the current request's if not given).  item names what the
+    stage was done for, in the request's breakdown.
+    """
+    timings = timings or current()
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        seconds = time.perf_counter() - start
+        REGISTRY.record(stage, seconds)
+        if timings is not None:
+            timings.record(stage, seconds, item)
+
+
+def timed_iter(stage, iterable, timings=None):
+    """
+    Generate the items of iterable, timing the work of producing them
+    (but not what is done with them in between) as one run of stage,
+    recorded when the iteration is done or abandoned.
+    """
+    timings = timings or current()
+    seconds = 0
+    items = iter(iterable)
+    try:
+        while True:
+            start = time.perf_counter()
+            try:
+                item = next(items)
+            except StopIteration:
+                return
+            finally:
+                seconds += time.perf_counter() - start
+            yield item
+    finally:
+        REGISTRY.record(stage, seconds)
+        if timings is not None:
+            timings.record(stage, seconds)
+
+
+def calendar_item(position):
+    """The item naming the calendar at position (from 0) among those of a request."""
+    return "calendar {}".format(position)
+
+
+def count(name, amount, timings=None):
+    """Record an amount of something, in REGISTRY and the current request."""
+    timings = timings or current()
+    REGISTRY.count(name, amount)
+    if timings is not None:
+        timings.count(name, amount)
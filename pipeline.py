@@ -0,0 +1,462 @@
+"""
+The busy and free time calculation of main.py, without flask.
+
+main.py keeps the date and time range, the selected calendars and
+the results in the flask session; the functions here take them as
+arguments instead, so the same steps can be run from the command line
+for batch jobs and profiling, with no web server or Google account:
+
+    fetching     busy times of calendars from the calendar service, only
+                 for days not already known (fetch_busy_days)
+    busy times   events of each calendar within the range (find_busy)
+    free times   the complement of the busy times, day by day (find_free)
+    display      both, in order, as the page shows them (display_list)
+
+Usage:
+    python pipeline.py --begin-date 01/04/2016 --end-date 01/08/2016 \\
+        --begin-time 9am --end-time 5pm (--events dump.json | agenda files...)
+
+The events dump is JSON: a list of events, a calendar API response
+({"items": [...]}), or an object of calendar id to either of those.
+The times in agenda files are wall-clock times, taken to be in the
+same time zone as the dates and times of the range, which is local
+time unless --tz says otherwise.  Lines of agenda files that can't be
+read are listed on standard error and skipped, and the exit status is
+then 1.  batch.py reads its command line the same way.
+"""
+
+import argparse
+import collections
+import cProfile
+import datetime
+import json
+import pstats
+import sys
+
+import arrow
+from dateutil import tz
+
+from agenda import Agenda, Appt
+import gcal
+import metrics
+import timecodec
+
+# Accepted forms of the times in a range, as on the page
+TIME_FORMATS = ["ha", "h:mma", "h:mm a", "h:mm A", "H:mm"]
+
+# Events are picked out by their dates in their own time zones, which can
+# be up to two days from their dates in the time zone of the range (UTC-12
+# to UTC+14), so calendars are queried this many days past each end.
+ZONE_SLACK_DAYS = 2
+
+
+class Span(collections.namedtuple("Span", "begin_date end_date begin_time end_time")):
+    """
+    A date and time range as kept in the session: ISO strings, of
+    which only the dates of the first two and the times of the last
+    two matter.
+    """
+    __slots__ = ()
+
+    @classmethod
+    def from_session(cls, session):
+        """The span stored under the same names in a session (or any mapping)."""
+        return cls(*(session[key] for key in cls._fields))
+
+    def arrows(self):
+        """The four values as arrow objects, for complementTimeSpan and the like."""
+        return tuple(timecodec.parse_arrow(text) for text in self)
+
+    def in_window(self):
+        """The test for events in the range (see gcal.window_filter)."""
+        return gcal.window_filter(*self)
+
+
+def parse_date(text, tzinfo=None):
+    """
+    ISO string of a date given as MM/DD/YYYY, at midnight in tzinfo
+    (local time if None).
+
+    Raises:
+        arrow.parser.ParserError if text isn't a date in that form
+    """
+    return arrow.get(text, "MM/DD/YYYY").replace(tzinfo=tzinfo or tz.tzlocal()).isoformat()
+
+
+def parse_time(text, tzinfo=None, day=None):
+    """
+    ISO string of a time of day given in one of TIME_FORMATS, in
+    tzinfo (local time if None), on day (a datetime.date) if given.
+    Only the time matters, but a time zone with historical offsets
+    needs a real day to give the usual one.
+
+    Raises:
+        arrow.parser.ParserError if text isn't a time in those forms
+    """
+    when = arrow.get(text, TIME_FORMATS)
+    if day is not None:
+        when = when.replace(year=day.year, month=day.month, day=day.day)
+    return when.replace(tzinfo=tzinfo or tz.tzlocal()).isoformat()
+
+
+def parse_span(begin_date, end_date, begin_time, end_time, tzinfo=None):
+    """
+    The Span of a range given on the command line: dates as MM/DD/YYYY
+    and times of day in TIME_FORMATS, in tzinfo (local time if None).
+
+    Raises:
+        arrow.parser.ParserError if a date or time can't be read
+        ValueError if the range is empty (ends before it begins)
+    """
+    begin_date = parse_date(begin_date, tzinfo)
+    end_date = parse_date(end_date, tzinfo)
+    day = timecodec.parse_datetime(begin_date).date()
+    span = Span(begin_date, end_date, parse_time(begin_time, tzinfo, day),
+                parse_time(end_time, tzinfo, day))
+    begin_date, end_date, begin_time, end_time = span.arrows()
+    if end_date < begin_date:
+        raise ValueError("end date is before begin date")
+    if end_time <= begin_time:
+        raise ValueError("end time is not after begin time")
+    return span
+
+
+def find_busy(calendar_events, span):
+    """
+    The busy times of calendars within a span: their events that block
+    time and lie within or partially overlap the range, as a list of
+    dicts in the form kept in the session.
+
+    Arguments:
+        calendar_events: Mapping of calendar id to list of event dicts,
+            as the calendar API gives them; the busy times are in the
+            order of the calendars, then of their events
+        span: A Span
+    """
+    in_window = span.in_window()
+    busy_list = [ ]
+    for position, (calendar_id, events) in enumerate(calendar_events.items()):
+        with metrics.timed("busy_filter", item=metrics.calendar_item(position)):
+            busy_list.extend(gcal.busy_events(events, in_window))
+        metrics.count("events", len(events))
+    return busy_list
+
+
+def fetch_calendar_busy(service, calendar_ids, span, source="events", first_day=None,
+                        last_day=None, http_factory=None, cache=None, owner=None):
+    """
+    Fetch calendars in parallel and pick out their busy times (see find_busy).
+
+    Arguments:
+        service: A Google calendar service object (or a fake)
+        calendar_ids: The calendars to fetch
+        span: A Span
+        source: "events" to read whole events (through cache, a
+            gcal.EventCache, if given, for the credentials' owner), or
+            "freebusy" for just the busy periods
+        first_day, last_day: (optional) ISO date-times; if given, the busy
+            times are those beginning on those days however late they
+            end, instead of those in the span's date range
+        http_factory: (optional) function of no arguments returning a new
+            authorized http object for each request
+    Yields:
+        (calendar id, busy list, error) as each calendar is read; if a
+        calendar can't be read its busy list is None and error says why.
+    """
+    calendar_ids = list(calendar_ids)
+    # Only ask for events from (about) the first to the last day of the date range
+    if first_day is None:
+        first_day = span.begin_date
+        last_day = window_end = span.end_date
+    else:
+        window_end = None
+    time_min = days_after(first_day, -ZONE_SLACK_DAYS)
+    time_max = days_after(last_day, ZONE_SLACK_DAYS + 1)
+    last_date = timecodec.parse_datetime(last_day).date().isoformat()
+    if source == "freebusy":
+        http = http_factory() if http_factory else None
+        fetched = gcal.fetch_freebusy(service, calendar_ids, time_min, time_max, http=http)
+    else:
+        fetched = gcal.fetch_calendars(service, calendar_ids, http_factory, time_min, time_max,
+                                       cache=cache, owner=owner)
+    # The date and time range is parsed once, not once per event
+    in_window = gcal.window_filter(first_day, window_end, span.begin_time, span.end_time)
+    positions = { calendar_id: position for position, calendar_id in enumerate(calendar_ids) }
+    for calendar_id, events, error in fetched:
+        if error:
+            yield calendar_id, None, error
+        else:
+            with metrics.timed("busy_filter", item=metrics.calendar_item(positions[calendar_id])):
+                busy = [ busy_dict for busy_dict in gcal.busy_events(events, in_window)
+                         if busy_dict['begin'][:10] <= last_date ]
+            metrics.count("events", len(events))
+            yield calendar_id, busy, None
+
+
+def fetch_busy_days(fetch_busy, calendar_ids, span, days, cached=None):
+    """
+    Fill in days, a dict, with the busy times (lists of dicts, as in
+    busy lists) of each day of a span, keyed by ISO date.  Days found
+    in cached (a dict like days, such as the "busy" dict of a
+    gcal.DayCache entry) are taken from there; each run of consecutive
+    days that aren't is fetched with one call to fetch_busy, and added
+    to cached unless some calendar couldn't be read.
+
+    Arguments:
+        fetch_busy: function(first_day, last_day) of two ISO date-times,
+            generating (calendar id, busy list, error) for each calendar
+            with the busy times beginning on those days, as
+            fetch_calendar_busy does when given first_day and last_day
+        calendar_ids: The calendars, in the order their busy times go
+            into each day
+        span: A Span
+        days: The dict to fill in
+        cached: (optional) Days already known
+    Yields:
+        (calendar id, busy list, error) for each calendar fetched
+    """
+    if cached is None:
+        cached = { }
+    new_days = [ ]
+    day = timecodec.parse_arrow(span.begin_date).floor('day')
+    last = timecodec.parse_datetime(span.end_date).date()
+    while day.date() <= last:
+        date = day.date().isoformat()
+        if date in cached:
+            days[date] = cached[date]
+        else:
+            days[date] = [ ]
+            new_days.append(day)
+        day = day.replace(days=+1)
+    runs = [ ]
+    for day in new_days:
+        if runs and day.date() - runs[-1][-1].date() == datetime.timedelta(days=1):
+            runs[-1].append(day)
+        else:
+            runs.append([day])
+    for run in runs:
+        run_dates = { day.date().isoformat() for day in run }
+        calendar_busy = { }
+        complete = True
+        for calendar_id, busy, error in fetch_busy(run[0].isoformat(), run[-1].isoformat()):
+            yield calendar_id, busy, error
+            if error:
+                complete = False
+                busy = [ ]
+            calendar_busy[calendar_id] = busy
+        for calendar_id in calendar_ids:
+            for busy_dict in calendar_busy.get(calendar_id, [ ]):
+                date = busy_dict['begin'][:10]
+                if date in run_dates:
+                    days[date].append(busy_dict)
+        if complete:
+            for date in run_dates:
+                cached[date] = days[date]
+
+
+def next_day(isotext):
+    """ISO date-time + 1 day (used in queries to Google calendar)."""
+    return days_after(isotext, 1)
+
+
+def days_after(isotext, days):
+    """ISO date-time + days (which may be negative)."""
+    return timecodec.parse_arrow(isotext).replace(days=days).isoformat()
+
+
+def busy_in_range(days, span):
+    """
+    The busy list of a span from busy lists by ISO date (as
+    fetch_busy_days fills them in): busy times in order of their days,
+    without those ending after the span.
+    """
+    last = timecodec.parse_datetime(span.end_date).date().isoformat()
+    busy_list = [ ]
+    for date in sorted(days):
+        busy_list.extend(busy_dict for busy_dict in days[date] if busy_dict['end'][:10] <= last)
+    return busy_list
+
+
+def free_by_day(busy_list, span, memo=None):
+    """
+    Generate (ISO date, free list) for each day of a span, in order: the
+    free times of that day's time block, given the busy times in
+    busy_list.  With a ComplementMemo as memo, days seen before aren't
+    complemented again.
+    """
+    with metrics.timed("parse"):
+        busy_agenda = Agenda.from_list(busy_list)
+    free_days = busy_agenda.complement_days(*span.arrows(), memo=memo)
+    for date, free_agenda in metrics.timed_iter("complement", free_days):
+        yield date.isoformat(), free_agenda.to_list()
+
+
+def find_free(busy_list, span, memo=None):
+    """The free times of a span, given its busy times, as a list of dicts."""
+    free_list = [ ]
+    for date, free_day in free_by_day(busy_list, span, memo):
+        free_list.extend(free_day)
+    return free_list
+
+
+def merge_busy_free(busy_list, free_list):
+    """Busy and free times together, in order by begin date/time."""
+    free_busy = busy_list + free_list
+    free_busy.sort(key=lambda r: r['begin'])
+    return free_busy
+
+
+def display_list(apt_list, tzinfo=None):
+    """
+    Generate the display string of each appointment dict in turn, with
+    its times in tzinfo (local time if None).  All the times are
+    converted with one timecodec.DisplayFormatter, so the time zone is
+    looked up once and each day's date is only formatted once.
+    """
+    formatter = timecodec.DisplayFormatter(tzinfo)
+    for apt in apt_list:
+        yield apt['desc'] + ": " + formatter.format(apt['begin']) + " - " + formatter.format(apt['end'])
+
+
+def read_events(f):
+    """
+    Mapping of calendar id to events from a JSON dump (see the module
+    docstring).  A single calendar is given the id "events".
+    """
+    dump = json.load(f)
+    if isinstance(dump, list) or "items" in dump:
+        dump = { "events": dump }
+    return collections.OrderedDict(
+        (calendar_id, events["items"] if isinstance(events, dict) else events)
+        for calendar_id, events in dump.items())
+
+
+def in_time_zone(agenda, tzinfo=None):
+    """
+    An agenda read from a file, with its times in tzinfo (local time if
+    None), as a new Agenda.  Agenda files have no time zones
+    (Agenda.from_file reads them as UTC), so their times are taken as
+    the same wall-clock times in tzinfo, the time zone of the range
+    they are checked against.
+    """
+    tzinfo = tzinfo or tz.tzlocal()
+    def wall_clock(epoch):
+        return int(datetime.datetime.fromtimestamp(epoch, datetime.timezone.utc).replace(
+            tzinfo=tzinfo).timestamp())
+    result = Agenda(agenda.vectorized)
+    result.appts = [ Appt.from_epoch(wall_clock(appt._begin), wall_clock(appt._end),
+                                     appt.desc, tzinfo)
+                     for appt in agenda ]
+    return result
+
+
+def read_agendas(paths, errors, tzinfo=None):
+    """
+    An OrderedDict of path to the Agenda read from each file, with its
+    times in tzinfo (see in_time_zone).  Lines that can't be read are
+    appended to errors as (path, AgendaError).
+    """
+    agendas = collections.OrderedDict()
+    for path in paths:
+        file_errors = [ ]
+        with open(path, encoding="utf-8") as f:
+            agendas[path] = in_time_zone(Agenda.from_file(f, errors=file_errors), tzinfo)
+        errors.extend((path, error) for error in file_errors)
+    return agendas
+
+
+def report_errors(errors):
+    """Print the lines read_agendas couldn't read to standard error."""
+    for path, error in errors:
+        print("{}:{}: {} ({})".format(path, error.line_number, error.line, error.message),
+              file=sys.stderr)
+
+
+def agenda_events(agenda):
+    """
+    The appointments of an agenda as event dicts, to be picked out like
+    calendar events.
+    """
+    return [ { "summary": appt.desc,
+               "start": { "dateTime": appt.begin.isoformat() },
+               "end": { "dateTime": appt.end.isoformat() } }
+             for appt in agenda ]
+
+
+def run(calendar_events, span, tzinfo=None):
+    """
+    The whole calculation: (busy list, free list, display strings).
+    """
+    busy_list = find_busy(calendar_events, span)
+    free_list = find_free(busy_list, span)
+    return busy_list, free_list, list(display_list(merge_busy_free(busy_list, free_list), tzinfo))
+
+
+def add_range_arguments(parser):
+    """Add the date and time range arguments, as this and batch.py take them."""
+    parser.add_argument("--begin-date", required=True, help="MM/DD/YYYY")
+    parser.add_argument("--end-date", required=True, help="MM/DD/YYYY")
+    parser.add_argument("--begin-time", default="9am")
+    parser.add_argument("--end-time", default="5pm")
+    parser.add_argument("--tz", default=None,
+                        help="Time zone of the range and the output (default: local)")
+
+
+def range_arguments(parser, args):
+    """
+    (Span, tzinfo) of the arguments of add_range_arguments; tzinfo is
+    None for local time.  Exits through parser.error if they are wrong.
+    """
+    tzinfo = tz.gettz(args.tz) if args.tz else None
+    if args.tz and tzinfo is None:
+        parser.error("unknown time zone {}".format(args.tz))
+    try:
+        span = parse_span(args.begin_date, args.end_date, args.begin_time, args.end_time, tzinfo)
+    except (ValueError, arrow.parser.ParserError) as err:
+        parser.error(str(err))
+    return span, tzinfo
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Busy and free times, without the web server")
+    parser.add_argument("files", nargs="*", help="Agenda files of busy times")
+    parser.add_argument("--events", help="JSON dump of calendar events")
+    add_range_arguments(parser)
+    parser.add_argument("--json", action="store_true",
+                        help="Print the busy and free lists as JSON")
+    parser.add_argument("--profile", action="store_true",
+                        help="Print the busiest functions to standard error")
+    args = parser.parse_args(argv)
+    if bool(args.files) == bool(args.events):
+        parser.error("give either agenda files or --events")
+    span, tzinfo = range_arguments(parser, args)
+
+    errors = [ ]
+    if args.events:
+        with open(args.events, encoding="utf-8") as f:
+            calendar_events = read_events(f)
+    else:
+        calendar_events = collections.OrderedDict(
+            (path, agenda_events(agenda))
+            for path, agenda in read_agendas(args.files, errors, tzinfo).items())
+        report_errors(errors)
+
+    profiler = cProfile.Profile() if args.profile else None
+    if profiler:
+        profiler.enable()
+    busy_list, free_list, shown = run(calendar_events, span, tzinfo)
+    if profiler:
+        profiler.disable()
+        pstats.Stats(profiler, stream=sys.stderr).sort_stats("cumulative").print_stats(20)
+
+    if args.json:
+        json.dump({ "busy": busy_list, "free": free_list }, sys.stdout, indent=1)
+        print()
+    else:
+        for line in shown:
+            print(line)
+    return 1 if errors else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,214 @@
+"""
+Server-side session storage for the flask app.
+
+Flask's default session is a signed cookie, so the whole busy and free
+lists travel to the browser and back on every request, and large
+calendars overflow the cookie size limit.  With
+    app.session_interface = ServerSideSessionInterface(MemoryStore())
+the session contents stay on the server, in memory or in an SQLite
+file, and the cookie only carries a random session key.
+"""
+
+import collections
+import logging
+import sqlite3
+import threading
+import time
+import uuid
+
+from flask.sessions import SessionInterface, SessionMixin
+from flask.sessions import session_json_serializer
+from werkzeug.datastructures import CallbackDict
+
+import metrics
+
+log = logging.getLogger(__name__)
+
+
+class MemoryStore:
+    """
+    Serialized sessions in a dict in this process, evicting the least
+    recently used sessions when there are too many or they take too
+    much space.  Sessions are lost when the server restarts.
+    """
+
+    def __init__(self, max_entries=1000, max_bytes=64 * 1024 * 1024):
+        """
+        Arguments:
+            max_entries: Most sessions kept
+            max_bytes: Most bytes of session data kept, in total
+        """
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.size = 0      # Bytes of session data currently kept
+        self._data = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """Serialized session with this key, or None."""
+        with self._lock:
+            if key not in self._data:
+                return None
+            self._data.move_to_end(key)
+            return self._data[key]
+
+    def put(self, key, data):
+        """Keep serialized session data (a string) under key."""
+        with self._lock:
+            if key in self._data:
+                self.size -= len(self._data.pop(key))
+            self._data[key] = data
+            self.size += len(data)
+            while self._data and (len(self._data) > self.max_entries or
+                                  self.size > self.max_bytes):
+                evicted_key, evicted = self._data.popitem(last=False)
+                self.size -= len(evicted)
+                log.debug("Evicted session {}".format(evicted_key))
+
+    def delete(self, key):
+        with self._lock:
+            if key in self._data:
+                self.size -= len(self._data.pop(key))
+
+    def __len__(self):
+        return len(self._data)
+
+
+class SqliteStore:
+    """
+    Serialized sessions in an SQLite database file, so they survive
+    restarts and can be shared by several server processes.  The least
+    recently used sessions are deleted when there are more than
+    max_entries or they take more than max_bytes, as in MemoryStore.
+    """
+
+    def __init__(self, path, max_entries=10000, max_bytes=256 * 1024 * 1024):
+        """
+        Arguments:
+            path: File name of the database; created if needed
+            max_entries: Most sessions kept
+            max_bytes: Most bytes of session data kept, in total
+        """
+        self.path = path
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        with self._connect() as db:
+            db.execute("CREATE TABLE IF NOT EXISTS sessions "
+                       "(key TEXT PRIMARY KEY, data TEXT, used REAL)")
+            db.execute("CREATE INDEX IF NOT EXISTS sessions_used ON sessions (used)")
+
+    def _connect(self):
+        # A connection per operation: sqlite connections can't be shared between threads
+        return sqlite3.connect(self.path, timeout=10)
+
+    def get(self, key):
+        with self._connect() as db:
+            row = db.execute("SELECT data FROM sessions WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            db.execute("UPDATE sessions SET used = ? WHERE key = ?", (time.time(), key))
+            return row[0]
+
+    def put(self, key, data):
+        with self._connect() as db:
+            db.execute("INSERT OR REPLACE INTO sessions VALUES (?, ?, ?)",
+                       (key, data, time.time()))
+            # Keep the most recently used sessions, as many as fit both limits
+            db.execute("DELETE FROM sessions WHERE key IN "
+                       "(SELECT key FROM (SELECT key, "
+                       "  ROW_NUMBER() OVER newest AS number, "
+                       "  SUM(LENGTH(data)) OVER newest AS size "
+                       "  FROM sessions WINDOW newest AS (ORDER BY used DESC, rowid DESC)) "
+                       " WHERE number > ? OR size > ?)",
+                       (self.max_entries, self.max_bytes))
+
+    def delete(self, key):
+        with self._connect() as db:
+            db.execute("DELETE FROM sessions WHERE key = ?", (key,))
+
+    def __len__(self):
+        with self._connect() as db:
+            return db.execute("SELECT COUNT(*) FROM sessions").fetchone()[0]
+
+
+class ServerSideSession(CallbackDict, SessionMixin):
+    """A session dict that remembers its key and whether it was changed."""
+
+    def __init__(self, initial=None, key=None, new=False):
+        def on_update(self):
+            self.modified = True
+        CallbackDict.__init__(self, initial, on_update)
+        self.key = key
+        self.new = new
+        self.modified = False
+        self.old_key = None    # Key to drop from the store, after regenerate()
+
+    def regenerate(self):
+        """
+        Move the session to a fresh key, as when the user logs in, so
+        that a key known to someone else beforehand (session fixation)
+        doesn't lead to the logged-in session.  The old key is dropped
+        from the store when the session is saved.
+        """
+        if self.old_key is None and not self.new:
+            self.old_key = self.key
+        self.key = uuid.uuid4().hex
+        self.modified = True
+
+
+class ServerSideSessionInterface(SessionInterface):
+    """
+    Keeps session contents in a store (MemoryStore or SqliteStore)
+    and only a session key in the cookie.
+
+    The metrics attribute counts requests that saved a session, the
+    bytes of session data they stored, the bytes of cookie they sent
+    instead, and the difference (bytes saved).
+    """
+
+    def __init__(self, store):
+        self.store = store
+        self.metrics = { "saves": 0, "session_bytes": 0,
+                         "cookie_bytes": 0, "bytes_saved": 0 }
+        self._lock = threading.Lock()
+
+    def open_session(self, app, request):
+        key = request.cookies.get(app.config['SESSION_COOKIE_NAME'])
+        if key:
+            data = self.store.get(key)
+            if data is not None:
+                return ServerSideSession(session_json_serializer.loads(data), key)
+        return ServerSideSession(key=uuid.uuid4().hex, new=True)
+
+    def save_session(self, app, session, response):
+        name = app.config['SESSION_COOKIE_NAME']
+        domain = self.get_cookie_domain(app)
+        path = self.get_cookie_path(app)
+        if session.old_key is not None:
+            self.store.delete(session.old_key)
+            session.old_key = None
+        if not session:
+            if session.modified:
+                self.store.delete(session.key)
+                response.delete_cookie(name, domain=domain, path=path,
+                                       secure=self.get_cookie_secure(app),
+                                       samesite=self.get_cookie_samesite(app))
+            return
+        if not (session.modified or session.new):
+            return
+        with metrics.timed("session_save"):
+            data = session_json_serializer.dumps(dict(session))
+            self.store.put(session.key, data)
+        metrics.count("session_bytes", len(data))
+        response.set_cookie(name, session.key,
+                            expires=self.get_expiration_time(app, session),
+                            httponly=self.get_cookie_httponly(app),
+                            domain=domain, path=path,
+                            secure=self.get_cookie_secure(app),
+                            samesite=self.get_cookie_samesite(app))
+        with self._lock:
+            self.metrics["saves"] += 1
+            self.metrics["session_bytes"] += len(data)
+            self.metrics["cookie_bytes"] += len(session.key)
+            self.metrics["bytes_saved"] += len(data) - len(session.key)
+        log.debug("Stored {} bytes of session server-side".format(len(data)))
@@ -4,7 +4,12 @@ Nose tests for agenda.py
 
 from agenda import *
 import arrow
+import datetime
 import io
+import mmap
+import random
+import tempfile
+import unittest
 
 def test_appt():
     """
@@ -231,3 +236,356 @@ def test_agenda2():
     
 
 
+
+def random_agenda(rng, count, desc):
+    """
+    An agenda of count appointments at random (possibly overlapping)
+    times over a few days, in random order.
+    """
+    start = arrow.get("12/01/2013 12:00 AM", "MM/DD/YYYY h:mm A")
+    agenda = Agenda()
+    for i in range(count):
+        begin = start.replace(minutes=+rng.randrange(0, 3 * 24 * 60, 15))
+        end = begin.replace(minutes=+rng.randrange(15, 6 * 60, 15))
+        agenda.append(Appt(begin, end, "{} {}".format(desc, i)))
+    return agenda
+
+def nested_intersect(mine, theirs, desc=""):
+    """
+    The original nested-loop intersection, for checking the sweep.
+    """
+    result = Agenda()
+    for thisappt in mine.appts:
+        for otherappt in theirs.appts:
+            if thisappt.overlaps(otherappt):
+                result.append(thisappt.intersect(otherappt, desc))
+    return result
+
+def test_intersect_randomized():
+    """
+    The sweep-line intersect gives exactly the same appointments,
+    in the same order, as comparing every pair.
+    """
+    rng = random.Random(399)
+    for trial in range(25):
+        mine = random_agenda(rng, rng.randrange(0, 40), "mine")
+        theirs = random_agenda(rng, rng.randrange(0, 40), "theirs")
+        assert str(mine.intersect(theirs)) == str(nested_intersect(mine, theirs))
+        assert (str(mine.intersect(theirs, "meet")) ==
+                str(nested_intersect(mine, theirs, "meet")))
+
+def test_intersect_all():
+    """
+    Intersecting many agendas at once is the same as chaining
+    intersect over the normalized agendas.
+    """
+    rng = random.Random(8)
+    for trial in range(25):
+        agendas = [ random_agenda(rng, rng.randrange(1, 30), "person {}".format(p))
+                    for p in range(rng.randrange(1, 5)) ]
+        chained = agendas[0].normalized()
+        for agenda in agendas[1:]:
+            chained = chained.intersect(agenda.normalized())
+        assert str(Agenda.intersect_all(agendas)) == str(chained)
+    assert len(Agenda.intersect_all([])) == 0
+
+def test_availability():
+    """
+    Each slot from availability lists exactly the participants free
+    at every moment of it, and every moment some participants are free
+    is in some slot.  With minimum set to everyone, the slots cover the
+    same times as intersect_all.
+    """
+    rng = random.Random(22)
+    for trial in range(20):
+        agendas = [ random_agenda(rng, rng.randrange(1, 12), "person {}".format(p))
+                    for p in range(rng.randrange(1, 6)) ]
+        slots = list(Agenda.availability(agendas))
+        for appt, free in slots:
+            assert appt.desc == "{}/{} available".format(len(free), len(agendas))
+            for t in range(appt._begin, appt._end, 15 * 60):
+                moment = Appt.from_epoch(t, t + 1, "", None)
+                assert free == [ which for which, agenda in enumerate(agendas)
+                                 if any(moment.overlaps(a) for a in agenda) ]
+        covered = sum(appt._end - appt._begin for appt, free in slots)
+        union = Agenda()
+        for agenda in agendas:
+            union.appts.extend(agenda.appts)
+        assert covered == sum(appt._end - appt._begin for appt in union.normalized())
+        common = Agenda.availability(agendas, minimum=len(agendas))
+        assert (sum(appt._end - appt._begin for appt, free in common) ==
+                sum(appt._end - appt._begin for appt in Agenda.intersect_all(agendas)))
+
+def test_best_slots():
+    """
+    Best slots rank by number free, then length, then time.
+    """
+    alice = Agenda.from_file(io.StringIO("""
+        12/01/2013 9:00 AM-12/01/2013 12:00 PM|Alice
+        12/01/2013 2:00 PM-12/01/2013 4:00 PM|Alice"""))
+    bob = Agenda.from_file(io.StringIO("""
+        12/01/2013 10:00 AM-12/01/2013 11:00 AM|Bob
+        12/01/2013 3:00 PM-12/01/2013 5:00 PM|Bob"""))
+    carol = Agenda.from_file(io.StringIO("12/01/2013 9:30 AM-12/01/2013 3:30 PM|Carol"))
+    best = Agenda.best_slots([alice, bob, carol], 3)
+    assert [ str(appt) for appt, free in best ] == [
+        "12/01/2013 10:00 AM-12/01/2013 11:00 AM|3/3 available",
+        "12/01/2013 3:00 PM-12/01/2013 3:30 PM|3/3 available",
+        "12/01/2013 11:00 AM-12/01/2013 12:00 PM|2/3 available" ]
+    assert [ free for appt, free in best ] == [ [0, 1, 2], [0, 1, 2], [0, 2] ]
+    longer = Agenda.best_slots([alice, bob, carol], 5, minutes=45, minimum=2)
+    assert [ str(appt) for appt, free in longer ] == [
+        "12/01/2013 10:00 AM-12/01/2013 11:00 AM|3/3 available",
+        "12/01/2013 11:00 AM-12/01/2013 12:00 PM|2/3 available",
+        "12/01/2013 2:00 PM-12/01/2013 3:00 PM|2/3 available" ]
+    assert Agenda.best_slots([], 3) == [ ]
+
+def test_slots():
+    """
+    Slots of a given length on step boundaries, within the free times.
+    """
+    free = Agenda.from_file(io.StringIO("""
+        12/01/2013 9:10 AM-12/01/2013 10:30 AM|Morning
+        12/01/2013 1:00 PM-12/01/2013 1:30 PM|Too short
+        12/02/2013 2:00 PM-12/02/2013 3:00 PM|Afternoon"""))
+    slots = [ str(slot) for slot in free.slots(45) ]
+    assert slots == [
+        "12/01/2013 9:15 AM-12/01/2013 10:00 AM|Morning",
+        "12/01/2013 9:30 AM-12/01/2013 10:15 AM|Morning",
+        "12/01/2013 9:45 AM-12/01/2013 10:30 AM|Morning",
+        "12/02/2013 2:00 PM-12/02/2013 2:45 PM|Afternoon",
+        "12/02/2013 2:15 PM-12/02/2013 3:00 PM|Afternoon" ]
+    assert [ str(slot) for slot in free.slots(45, step=30, desc="Meet") ] == [
+        "12/01/2013 9:30 AM-12/01/2013 10:15 AM|Meet",
+        "12/02/2013 2:00 PM-12/02/2013 2:45 PM|Meet" ]
+    assert [ str(slot) for slot in free.slots(45, limit=2) ] == slots[:2]
+    assert list(free.slots(120)) == [ ]
+
+def test_free_slots_lazy():
+    """
+    Taking the first slot only looks at as much free time as it needs.
+    """
+    def forever():
+        begin = arrow.get("2013-12-01T09:00:00+00:00")
+        while True:
+            yield Appt(begin, begin.replace(hours=+1), "free")
+            begin = begin.replace(days=+1)
+    first = next(free_slots(forever(), 30))
+    assert str(first) == "12/01/2013 9:00 AM-12/01/2013 9:30 AM|free"
+
+def test_interval_index():
+    """
+    Point and range queries through the index find the same
+    appointments as checking every one, while appointments are
+    appended and after normalizing.
+    """
+    rng = random.Random(16)
+    agenda = random_agenda(rng, 30, "busy")
+    start = agenda.appts[0]._begin
+    def check(agenda):
+        for trial in range(50):
+            t = start + rng.randrange(-24 * 3600, 4 * 24 * 3600, 300)
+            probe = Appt.from_epoch(t, t + rng.randrange(1, 4 * 3600), "", None)
+            expect = sorted([ appt for appt in agenda.appts if probe.overlaps(appt) ],
+                            key=lambda appt: appt._begin)
+            assert [ id(appt) for appt in agenda.overlapping(probe) ] == [ id(appt) for appt in expect ]
+            at = [ appt for appt in agenda.appts if appt._begin <= t < appt._end ]
+            assert sorted(map(id, agenda.at(t))) == sorted(map(id, at))
+    check(agenda)
+    for more in random_agenda(rng, 10, "more"):
+        agenda.append(more)
+    assert agenda._index is not None and len(agenda._index) == 40
+    check(agenda)
+    agenda.normalize()
+    check(agenda)
+    assert agenda.index()._ends_sorted
+    moment = agenda.appts[0].begin
+    assert agenda.at(moment) == [ agenda.appts[0] ]
+    assert Agenda().at(moment) == [ ]
+    # One long appointment doesn't make every query look at the others
+    agenda = Agenda()
+    agenda.append(Appt.from_epoch(start, start + 365 * 24 * 3600, "long", None))
+    for i in range(1000):
+        agenda.append(Appt.from_epoch(start + i * 600, start + i * 600 + 300, "short", None))
+    assert not agenda.index()._ends_sorted
+    check(agenda)
+    assert [ appt.desc for appt in agenda.at(start + 500 * 600 + 100) ] == [ "long", "short" ]
+
+def test_complement_time_span_randomized():
+    """
+    The single-pass complementTimeSpan agrees with calling
+    complement on each day's time block.
+    """
+    rng = random.Random(22)
+    begin_date = arrow.get("11/30/2013 12:00 PM", "MM/DD/YYYY h:mm A")
+    end_date = arrow.get("12/04/2013 12:00 PM", "MM/DD/YYYY h:mm A")
+    begin_time = arrow.get("11/30/2013 8:00 AM", "MM/DD/YYYY h:mm A")
+    end_time = arrow.get("11/30/2013 6:00 PM", "MM/DD/YYYY h:mm A")
+    for trial in range(20):
+        busy = random_agenda(rng, rng.randrange(0, 30), "busy")
+        expected = Agenda()
+        for freeblock in day_blocks(begin_date, end_date, begin_time, end_time):
+            for appt in busy.complement(freeblock):
+                expected.append(appt)
+        free = busy.complementTimeSpan(begin_date, end_date, begin_time, end_time)
+        assert str(free) == str(expected)
+        days = [ date for date, day_free in 
+                 busy.complement_days(begin_date, end_date, begin_time, end_time) ]
+        assert len(days) == 5
+        assert days[0] == datetime.date(2013, 11, 30)
+        assert days[-1] == datetime.date(2013, 12, 4)
+
+def test_complement_memo():
+    """
+    complementTimeSpan gives the same free times, with the same time
+    zones, through a memo; days with unchanged busy times are found
+    in the memo, even for another agenda.
+    """
+    rng = random.Random(18)
+    begin_date = arrow.get("2013-11-30T00:00:00-08:00")
+    end_date = arrow.get("2013-12-04T00:00:00-08:00")
+    begin_time = arrow.get("2013-11-30T08:00:00-08:00")
+    end_time = arrow.get("2013-11-30T18:00:00-08:00")
+    span = (begin_date, end_date, begin_time, end_time)
+    memo = ComplementMemo(max_entries=1000)
+    for trial in range(20):
+        busy = random_agenda(rng, rng.randrange(0, 30), "busy")
+        busy.append(Appt(arrow.get("2013-12-02T10:00:00+01:00"),
+                         arrow.get("2013-12-02T11:00:00+01:00"), "abroad"))
+        expected = busy.complementTimeSpan(*span).to_list()
+        assert busy.complementTimeSpan(*span, memo=memo).to_list() == expected
+        hits = memo.hits
+        again = Agenda()
+        again.appts = list(reversed(busy.appts))
+        assert again.complementTimeSpan(*span, memo=memo).to_list() == expected
+        assert memo.hits == hits + 5
+    small = ComplementMemo(max_entries=3)
+    busy.complementTimeSpan(*span, memo=small)
+    assert len(small) == 3
+
+def test_read_appts():
+    """
+    Reading agenda lines directly gives the same appointments as 
+    Appt.from_string, and the same lines fail, with their line numbers.
+    """
+    rng = random.Random(21)
+    lines = [ "# A comment", "",
+              "12/01/2013 12:00 AM-12/01/2013 12:30 AM|Midnight",
+              "12/01/2013 12:00 PM-12/01/2013 0:30 PM|Noon",
+              "12/01/2013 11:00 am-12/01/2013 1:00 pm|Lower case",
+              "12/1/2013 9:00 AM-12/01/2013 10:00 AM|Short month",
+              "02/30/2013 9:00 AM-02/30/2013 10:00 AM|No such day",
+              "12/01/2013 9:60 AM-12/01/2013 10:00 AM|No such minute",
+              "12/01/2013 10:00 AM-12/01/2013 9:00 AM|Backwards",
+              "12/01/2013 9:00 AM-12/01/2013 10:00 AM|Two|bars",
+              "12/01/2013 9:00 AM 12/01/2013 10:00 AM|No dash",
+              "  12/01/2013 9:00 AM  -  12/01/2013 10:00 AM  |  Spaces  " ]
+    for i in range(200):
+        minute = rng.randrange(0, 24 * 60)
+        text = "{:02d}/{:02d}/{} {}:{:02d} {}".format(
+            rng.randrange(1, 13), rng.randrange(1, 29), rng.randrange(1990, 2030),
+            rng.randrange(0, 14), minute % 60, rng.choice(["AM", "PM", "am"]))
+        lines.append("{}-{}|random {}".format(text, text.replace(" AM", " PM").replace(" am", " pm"), i))
+    errors = [ ]
+    read = list(read_appts(lines, errors))
+    expected = [ ]
+    failed = [ ]
+    for number, line in enumerate(lines, 1):
+        if line.strip() == "" or line.startswith("#"):
+            continue
+        try:
+            expected.append(Appt.from_string(line.strip()))
+        except (ValueError, arrow.parser.ParserError):
+            failed.append(number)
+    assert [ str(appt) for appt in read ] == [ str(appt) for appt in expected ]
+    assert [ (appt._begin, appt._end) for appt in read ] == [ (appt._begin, appt._end) for appt in expected ]
+    assert [ error.line_number for error in errors ] == failed
+    assert errors[0] == AgendaError(6, lines[5], errors[0].message)
+    minute_error = [ error for error in errors if error.line_number == 8 ]
+    assert "minute" in minute_error[0].message
+
+def test_read_chunks():
+    """
+    Reading in chunks gives the whole agenda, a chunk at a time.
+    """
+    text = "\n".join("12/{:02d}/2013 9:00 AM-12/{:02d}/2013 10:00 AM|day {}".format(day, day, day)
+                     for day in range(1, 11))
+    chunks = list(Agenda.read_chunks(io.StringIO(text), 4))
+    assert [ len(chunk) for chunk in chunks ] == [ 4, 4, 2 ]
+    whole = Agenda.from_file(io.StringIO(text))
+    assert [ str(appt) for chunk in chunks for appt in chunk ] == [ str(appt) for appt in whole ]
+
+def test_to_bytes():
+    """
+    An agenda comes back from its binary form with the same times,
+    descriptions and UTC offsets, from bytes or from a mapped file.
+    """
+    rng = random.Random(22)
+    agenda = random_agenda(rng, 40, "busy")
+    agenda.append(Appt(arrow.get("2016-02-22T09:00:00-08:00"),
+                       arrow.get("2016-02-22T20:00:00+01:00"), "caf\u00e9 \u2615"))
+    agenda.append(Appt.from_epoch(100, 200, "", None))
+    back = Agenda.from_bytes(agenda.to_bytes())
+    assert [ str(appt) for appt in back ] == [ str(appt) for appt in agenda ]
+    assert back.to_list() == agenda.to_list()
+    assert len(Agenda.from_bytes(Agenda().to_bytes())) == 0
+    with tempfile.TemporaryFile() as f:
+        f.write(agenda.to_bytes())
+        f.flush()
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            mapped_agenda = Agenda.from_bytes(mapped)
+            assert mapped_agenda.to_list() == agenda.to_list()
+    for bad in [ b"", b"XXXX" + agenda.to_bytes()[4:], agenda.to_bytes()[:100] ]:
+        try:
+            Agenda.from_bytes(bad)
+            assert False, "bad binary form accepted"
+        except ValueError:
+            pass
+
+def test_appt_epoch():
+    """
+    Appointments keep their time zones through the epoch representation.
+    """
+    appt = Appt.from_dict({"desc": "standup", "begin": "2016-02-22T10:00:00-08:00",
+                           "end": "2016-02-22T10:15:00-08:00"})
+    assert appt.to_dict() == {"desc": "standup", "begin": "2016-02-22T10:00:00-08:00",
+                              "end": "2016-02-22T10:15:00-08:00"}
+    assert appt.begin == arrow.get("2016-02-22T18:00:00+00:00")
+    assert not hasattr(appt, "__dict__")
+    same = Appt.from_epoch(appt.begin.timestamp, appt.end.timestamp, "copy",
+                           appt.begin.tzinfo)
+    assert str(same) == "02/22/2016 10:00 AM-02/22/2016 10:15 AM|copy"
+    try:
+        Appt.from_epoch(10, 10, "empty", appt.begin.tzinfo)
+        assert False, "zero-length appointment accepted"
+    except ValueError:
+        pass
+
+def test_vectorized():
+    """
+    The numpy backend computes the same agendas as the pure Python one.
+    """
+    if numpy is None:
+        raise unittest.SkipTest("numpy is not installed")
+    rng = random.Random(4)
+    begin_date = arrow.get("11/30/2013 12:00 PM", "MM/DD/YYYY h:mm A")
+    end_date = arrow.get("12/04/2013 12:00 PM", "MM/DD/YYYY h:mm A")
+    begin_time = arrow.get("11/30/2013 8:00 AM", "MM/DD/YYYY h:mm A")
+    end_time = arrow.get("11/30/2013 6:00 PM", "MM/DD/YYYY h:mm A")
+    for trial in range(20):
+        mine = random_agenda(rng, rng.randrange(0, 40), "mine")
+        theirs = random_agenda(rng, rng.randrange(0, 40), "theirs")
+        fast_mine = Agenda.from_list(mine.to_list(), vectorized=True)
+        fast_theirs = Agenda.from_list(theirs.to_list(), vectorized=True)
+        assert fast_mine.vectorized
+
+        assert str(fast_mine.normalized()) == str(mine.normalized())
+        assert str(fast_mine.intersect(theirs)) == str(mine.intersect(theirs))
+        assert (str(fast_mine.intersect(theirs.normalized())) == 
+                str(mine.intersect(theirs.normalized())))
+        assert (str(fast_mine.normalized().intersect(theirs)) == 
+                str(mine.normalized().intersect(theirs)))
+        assert (str(fast_mine.complementTimeSpan(begin_date, end_date, begin_time, end_time)) ==
+                str(mine.complementTimeSpan(begin_date, end_date, begin_time, end_time)))
+        freeblock = Appt(begin_time, end_time, "block")
+        assert str(fast_theirs.complement(freeblock)) == str(theirs.complement(freeblock))
@@ -0,0 +1,57 @@
+"""
+Nose tests for batch.py
+"""
+
+from agenda import *
+from batch import *
+import arrow
+import contextlib
+import io
+import os
+import random
+import tempfile
+from test_agenda import random_agenda
+
+BEGIN_DATE = arrow.get("11/30/2013", "MM/DD/YYYY")
+END_DATE = arrow.get("12/06/2013", "MM/DD/YYYY")
+BEGIN_TIME = arrow.get("11/30/2013 8:00 AM", "MM/DD/YYYY h:mm A")
+END_TIME = arrow.get("11/30/2013 6:00 PM", "MM/DD/YYYY h:mm A")
+
+def test_free_times():
+    """
+    Free times worked out in a pool of processes, in chunks of days,
+    are the same as complementTimeSpan of each agenda.
+    """
+    rng = random.Random(23)
+    agendas = { "person {}".format(p): random_agenda(rng, rng.randrange(0, 40), "busy")
+                for p in range(5) }
+    expected = { name: [ str(appt) for appt in
+                         busy.complementTimeSpan(BEGIN_DATE, END_DATE, BEGIN_TIME, END_TIME) ]
+                 for name, busy in agendas.items() }
+    for processes, days_per_task in [ (1, None), (2, 3), (3, None) ]:
+        free = free_times(agendas, BEGIN_DATE, END_DATE, BEGIN_TIME, END_TIME,
+                          processes, days_per_task)
+        assert list(free) == list(agendas)
+        assert { name: [ str(appt) for appt in agenda ]
+                 for name, agenda in free.items() } == expected
+
+def test_main():
+    """
+    The command line reads agenda files and prints their free times.
+    """
+    with tempfile.TemporaryDirectory() as folder:
+        path = os.path.join(folder, "busy.txt")
+        with open(path, "w") as f:
+            f.write("12/01/2013 9:00 AM-12/01/2013 10:00 AM|Meeting\n")
+            f.write("Not an appointment\n")
+        # Times are wall-clock times in any time zone, as pipeline.py reads them
+        for zone, processes in [ ("UTC", "1"), ("Asia/Tokyo", "2") ]:
+            out = io.StringIO()
+            with contextlib.redirect_stdout(out), contextlib.redirect_stderr(io.StringIO()):
+                status = main([ path, "--begin-date", "12/01/2013", "--end-date", "12/01/2013",
+                                "--begin-time", "8:00 AM", "--end-time", "5pm",
+                                "--tz", zone, "--processes", processes ])
+            assert status == 1    # For the line that couldn't be read
+            assert out.getvalue().splitlines()[1:] == [
+                "12/01/2013 8:00 AM-12/01/2013 9:00 AM|Available",
+                "12/01/2013 10:00 AM-12/01/2013 5:00 PM|Available" ]
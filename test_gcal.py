@@ -0,0 +1,246 @@
+"""
+Nose tests for gcal.py, run against the fake calendar service
+"""
+
+from gcal import *
+from fake_gcal import FakeCalendarService, FakeHttpError
+import concurrent.futures
+from dateutil import tz
+import datetime
+import time
+
+def event(summary, begin, end):
+    return {"summary": summary, "start": {"dateTime": begin}, "end": {"dateTime": end}}
+
+LUNCH = event("Lunch", "2016-02-22T12:00:00-08:00", "2016-02-22T13:00:00-08:00")
+MEETING = event("Meeting", "2016-02-22T15:00:00-08:00", "2016-02-22T16:00:00-08:00")
+
+def test_list_events():
+    service = FakeCalendarService({"work": [LUNCH, MEETING]})
+    assert list_events(service, "work") == [LUNCH, MEETING]
+
+def test_fetch_calendars_parallel():
+    """
+    Calendars are fetched at the same time, not one after another.
+    """
+    calendars = { "cal{}".format(i): [LUNCH] for i in range(6) }
+    service = FakeCalendarService(calendars, latency=0.2)
+    start = time.monotonic()
+    fetched = list(fetch_calendars(service, sorted(calendars), max_workers=6))
+    assert time.monotonic() - start < 0.2 * 3
+    assert sorted(cal for cal, events, error in fetched) == sorted(calendars)
+    assert all(events == [LUNCH] and error is None for cal, events, error in fetched)
+
+def test_fetch_calendars_errors():
+    """
+    A missing calendar or a calendar that takes too long is reported,
+    and doesn't hold up the others.
+    """
+    service = FakeCalendarService({"fast": [LUNCH], "slow": [MEETING]},
+                                  latency={"slow": 1.0})
+    start = time.monotonic()
+    fetched = { cal: (events, error) for cal, events, error in
+                fetch_calendars(service, ["fast", "slow", "missing"], timeout=0.3) }
+    assert time.monotonic() - start < 1.0
+    assert fetched["fast"] == ([LUNCH], None)
+    assert fetched["slow"][0] is None
+    assert isinstance(fetched["slow"][1], concurrent.futures.TimeoutError)
+    assert fetched["missing"][0] is None
+    assert isinstance(fetched["missing"][1], KeyError)
+
+def test_iter_events_pages():
+    """
+    Pages are fetched lazily, and the time window is passed to the server.
+    """
+    service = FakeCalendarService({"work": [LUNCH, MEETING] * 3}, page_size=2)
+    events = iter_events(service, "work")
+    assert next(events) == LUNCH
+    assert len(service.requests) == 1
+    assert list(events) == [MEETING] + [LUNCH, MEETING] * 2
+    assert len(service.requests) == 3
+
+    service = FakeCalendarService({"work": [LUNCH, MEETING]})
+    afternoon = list_events(service, "work", time_min="2016-02-22T14:00:00-08:00",
+                            time_max="2016-02-23T00:00:00-08:00")
+    assert afternoon == [MEETING]
+    resource, args = service.requests[0]
+    assert args["timeMin"] == "2016-02-22T14:00:00-08:00"
+    assert args["fields"] == EVENT_FIELDS
+
+def test_fetch_freebusy():
+    """
+    The freebusy query gives busy periods as events, one request for
+    all the calendars, and reports calendars it can't read.
+    """
+    service = FakeCalendarService({"work": [LUNCH, MEETING], "home": [LUNCH]})
+    fetched = { cal: (events, error) for cal, events, error in
+                fetch_freebusy(service, ["work", "home", "missing"],
+                               "2016-02-22T14:00:00-08:00", "2016-02-23T00:00:00-08:00",
+                               tzinfo=tz.gettz("America/Los_Angeles")) }
+    assert len(service.requests) == 1
+    assert fetched["work"] == ([ event("Busy", MEETING["start"]["dateTime"],
+                                      MEETING["end"]["dateTime"]) ], None)
+    assert fetched["home"] == ([ ], None)
+    assert fetched["missing"][0] is None
+    assert isinstance(fetched["missing"][1], LookupError)
+
+def test_fetch_freebusy_failed():
+    """
+    If the query itself fails, each of its calendars is reported as
+    not read, as fetch_calendars does.
+    """
+    service = FakeCalendarService({"work": [LUNCH], "home": [LUNCH]})
+    service.freebusy_error = FakeHttpError(403, "Rate limit exceeded")
+    fetched = list(fetch_freebusy(service, ["work", "home"],
+                                  "2016-02-22T00:00:00-08:00", "2016-02-23T00:00:00-08:00"))
+    assert fetched == [ ("work", None, service.freebusy_error),
+                        ("home", None, service.freebusy_error) ]
+
+def test_fetch_freebusy_time_zone():
+    """
+    Busy periods come back from the query in UTC, and are checked
+    against a range in another time zone in that time zone.
+    """
+    service = FakeCalendarService({"work": [LUNCH, MEETING]})
+    pacific = tz.gettz("America/Los_Angeles")
+    [(cal, events, error)] = fetch_freebusy(service, ["work"], "2016-02-22T00:00:00-08:00",
+                                            "2016-02-23T00:00:00-08:00", tzinfo=pacific)
+    raw = service.freebusy().query(body={ "timeMin": "2016-02-22T00:00:00-08:00",
+                                          "timeMax": "2016-02-23T00:00:00-08:00",
+                                          "items": [ {"id": "work"} ] }).execute()
+    assert raw["calendars"]["work"]["busy"][0]["start"] == "2016-02-22T20:00:00Z"
+    in_window = window_filter("2016-02-22T00:00:00-08:00", "2016-02-22T00:00:00-08:00",
+                              "2016-02-22T09:00:00-08:00", "2016-02-22T17:00:00-08:00")
+    busy = busy_events(events, in_window)
+    assert [ (busy_dict["begin"], busy_dict["end"]) for busy_dict in busy ] == [
+        (LUNCH["start"]["dateTime"], LUNCH["end"]["dateTime"]),
+        (MEETING["start"]["dateTime"], MEETING["end"]["dateTime"]) ]
+
+class Credentials:
+    """Just the parts of OAuth2 credentials the service cache looks at."""
+    def __init__(self, token, expiry=None):
+        self.access_token = token
+        self.token_expiry = expiry
+
+def test_service_cache():
+    """
+    Services are built once per access token, and rebuilt when the
+    token or the cache entry expires.
+    """
+    built = []
+    def build(credentials):
+        built.append(credentials.access_token)
+        return FakeCalendarService({})
+    cache = ServiceCache(ttl=60, max_entries=2)
+    first = cache.get(Credentials("a"), build)
+    assert cache.get(Credentials("a"), build) is first
+    assert cache.get(Credentials("b"), build) is not first
+    assert built == ["a", "b"]
+    assert (cache.hits, cache.misses) == (1, 2)
+
+    cache.get(Credentials("c"), build)
+    assert len(cache) == 2
+    cache.get(Credentials("a"), build)
+    assert built == ["a", "b", "c", "a"]
+
+    expired = datetime.datetime.utcnow() - datetime.timedelta(minutes=1)
+    cache.get(Credentials("old", expired), build)
+    cache.get(Credentials("old", expired), build)
+    assert built[-2:] == ["old", "old"]
+
+    cache = ServiceCache(ttl=0)
+    cache.get(Credentials("a"), build)
+    cache.get(Credentials("a"), build)
+    assert built[-2:] == ["a", "a"]
+
+def test_event_cache():
+    """
+    The cache reads a calendar once, then only asks for changes,
+    and starts over when the sync token expires.
+    """
+    lunch = dict(LUNCH, id="lunch")
+    meeting = dict(MEETING, id="meeting")
+    service = FakeCalendarService({"work": [lunch, meeting]}, page_size=1)
+    cache = EventCache(ttl=0)
+    assert cache.events(service, "work") == [lunch, meeting]
+    assert cache.events(service, "work", time_min="2016-02-22T14:00:00-08:00") == [meeting]
+    assert (cache.full_syncs, cache.incremental_syncs) == (1, 1)
+
+    coffee = event("Coffee", "2016-02-22T10:00:00-08:00", "2016-02-22T10:30:00-08:00")
+    coffee["id"] = "coffee"
+    service.change("work", coffee)
+    service.cancel("work", "lunch")
+    requests = len(service.requests)
+    assert cache.events(service, "work") == [meeting, coffee]
+    assert len(service.requests) == requests + 2    # One page per change
+    assert service.requests[-1][1]["syncToken"]
+
+    service.expired_before = len(service.changes) + 1
+    assert cache.events(service, "work") == [meeting, coffee]
+    assert cache.full_syncs == 2
+
+    # Within the ttl there are no requests at all
+    cache = EventCache(ttl=60)
+    cache.events(service, "work")
+    requests = len(service.requests)
+    assert cache.events(service, "work") == [meeting, coffee]
+    assert len(service.requests) == requests
+    assert cache.hits == 1
+
+def test_event_cache_bounds():
+    """
+    The least recently used calendars are dropped to stay within max_events.
+    """
+    calendars = { name: [ dict(LUNCH, id=name + "1"), dict(MEETING, id=name + "2") ]
+                  for name in ["a", "b", "c"] }
+    service = FakeCalendarService(calendars)
+    cache = EventCache(max_events=4)
+    for name in ["a", "b", "a", "c"]:
+        cache.events(service, name)
+    assert len(cache) == 4
+    assert cache.full_syncs == 3
+    cache.events(service, "a")
+    assert cache.full_syncs == 3
+    cache.events(service, "b")
+    assert cache.full_syncs == 4
+
+def test_busy_events():
+    """
+    Only opaque events within the date range and overlapping the time
+    range are busy.
+    """
+    in_window = window_filter("2016-02-22T00:00:00-08:00", "2016-02-23T00:00:00-08:00",
+                              "2016-02-22T13:00:00-08:00", "2016-02-22T17:00:00-08:00")
+    free = dict(MEETING, transparency="transparent")
+    early = event("Early", "2016-02-23T08:00:00-08:00", "2016-02-23T13:00:00-08:00")
+    late = event("Late", "2016-02-23T13:30:00-08:00", "2016-02-23T14:00:00-08:00")
+    next_week = event("Later", "2016-02-29T13:30:00-08:00", "2016-02-29T14:00:00-08:00")
+    busy = busy_events([LUNCH, MEETING, free, early, late, next_week], in_window)
+    assert busy == [ {"desc": "Meeting", "begin": "2016-02-22T15:00:00-08:00",
+                      "end": "2016-02-22T16:00:00-08:00"},
+                     {"desc": "Late", "begin": "2016-02-23T13:30:00-08:00",
+                      "end": "2016-02-23T14:00:00-08:00"} ]
+    open_ended = window_filter("2016-02-22T00:00:00-08:00", None,
+                               "2016-02-22T13:00:00-08:00", "2016-02-22T17:00:00-08:00")
+    assert len(busy_events([LUNCH, MEETING, free, early, late, next_week], open_ended)) == 3
+
+def test_day_cache():
+    """
+    Day results are kept per key until the entry expires or is
+    among the least recently used.
+    """
+    cache = DayCache(ttl=60, max_entries=2)
+    days = cache.days("a")
+    assert days == { "busy": { } }
+    days["busy"]["2016-02-22"] = [ "lunch" ]
+    assert cache.days("a")["busy"] == { "2016-02-22": [ "lunch" ] }
+    cache.days("b")
+    cache.days("a")
+    cache.days("c")
+    assert len(cache) == 2
+    assert cache.days("a")["busy"] == { "2016-02-22": [ "lunch" ] }
+    assert cache.days("b") == { "busy": { } }
+
+    cache = DayCache(ttl=0)
+    cache.days("a")["busy"]["2016-02-22"] = [ ]
+    assert cache.days("a")["busy"] == { }
@@ -0,0 +1,191 @@
+"""
+Nose tests for the routes of main.py, run against the fake calendar
+service with made-up credentials.
+"""
+
+import importlib.util
+import os
+import sys
+
+try:
+    import CONFIG
+except ImportError:
+    # A fresh checkout has no CONFIG.py yet; the defaults will do
+    _spec = importlib.util.spec_from_file_location(
+        "CONFIG", os.path.join(os.path.dirname(os.path.abspath(__file__)), "CONFIG.base.py"))
+    CONFIG = importlib.util.module_from_spec(_spec)
+    _spec.loader.exec_module(CONFIG)
+    sys.modules["CONFIG"] = CONFIG
+
+import main
+from fake_gcal import FakeCalendarService
+from test_gcal import event, LUNCH, MEETING
+import httplib2
+import json
+import unittest.mock
+
+DENTIST = event("Dentist", "2016-02-23T09:30:00-08:00", "2016-02-23T10:30:00-08:00")
+
+SESSION = { "credentials": "{}",
+            "begin_date": "2016-02-22T00:00:00-08:00", "end_date": "2016-02-23T00:00:00-08:00",
+            "begin_time": "2016-02-22T09:00:00-08:00", "end_time": "2016-02-22T17:00:00-08:00",
+            "daterange": "02/22/2016 - 02/23/2016" }
+
+class Credentials:
+    """Just the parts of OAuth2 credentials main.py uses."""
+    invalid = False
+    access_token_expired = False
+    access_token = "token"
+    refresh_token = None
+    token_expiry = None
+    def authorize(self, http):
+        return http
+
+def make_client(calendars, session=SESSION):
+    """
+    A test client of the app, logged in, with the calendars (id to
+    events) served by a fake service.  Returns (client, service).
+    What this changes in main.py is put back by teardown_function.
+    """
+    # Events from the API always have ids, which the event cache uses
+    calendars = { calendar_id: [ dict(event, id="{}{}".format(calendar_id, i))
+                                 for i, event in enumerate(events) ]
+                  for calendar_id, events in calendars.items() }
+    service = FakeCalendarService(calendars)
+    patch(main, "get_gcal_service", lambda credentials: service)
+    patch(main.client.OAuth2Credentials, "from_json", staticmethod(lambda text: Credentials()))
+    if main.DAY_CACHE is not None:
+        patch(main, "DAY_CACHE", main.gcal.DayCache(ttl=main.DAY_CACHE.ttl))
+    if main.EVENT_CACHE is not None:
+        patch(main, "EVENT_CACHE", main.gcal.EventCache(ttl=main.EVENT_CACHE.ttl))
+    unittest.mock.patch.dict(main.app.config, SECRET_KEY="test").start()
+    client = main.app.test_client()
+    with client.session_transaction() as s:
+        s.update(session)
+    return client, service
+
+def patch(target, name, value):
+    """Set target.name to value until the test is over."""
+    unittest.mock.patch.object(target, name, value).start()
+
+def teardown_function(function):
+    unittest.mock.patch.stopall()
+
+def test_own_http():
+    """
+    Requests made with a (possibly shared) cached service each use an
+    http object of their own, never the service's.
+    """
+    client, service = make_client({ "work": [LUNCH, MEETING] })
+    assert client.get("/choose").status_code == 200
+    client.get("/calcBusyFreeTimes?selected[]=work&source=freebusy")
+    client.get("/calcBusyFreeTimes?selected[]=work&source=events")
+    assert len(service.requests) == 3
+    assert all(isinstance(http, httplib2.Http) for http in service.https)
+
+def test_busy_free_times():
+    """
+    /busyFreeTimes streams a line for each calendar read or not, then
+    each day's busy and free times in order, then "done", and leaves
+    no results in the session.
+    """
+    client, service = make_client({ "work": [LUNCH, MEETING], "home": [DENTIST] })
+    with client.session_transaction() as s:
+        s["busy_list"] = [ ]
+        s["free_list"] = [ ]
+    response = client.get("/busyFreeTimes?selected[]=work&selected[]=home&selected[]=missing")
+    assert response.mimetype == "application/x-ndjson"
+    lines = [ json.loads(line) for line in response.data.decode().splitlines() ]
+    assert sorted((line["calendar"], line.get("busy")) for line in lines[:3]) == [
+        ("home", 1), ("missing", None), ("work", 2) ]
+    assert [ line["type"] for line in lines[:3] ].count("error") == 1
+    assert [ (line["type"], line.get("date")) for line in lines[3:] ] == [
+        ("day", "2016-02-22"), ("day", "2016-02-23"), ("done", None) ]
+    day = lines[3]["times"]
+    assert len(day) == 5
+    assert [ text.split(":")[0] for text in day ] == [
+        "Available", "Lunch", "Available", "Meeting", "Available" ]
+    assert [ text.split(":")[0] for text in lines[4]["times"] ] == [
+        "Available", "Dentist", "Available" ]
+    with client.session_transaction() as s:
+        assert "busy_list" not in s and "free_list" not in s
+
+def test_group_slots():
+    """
+    /groupSlots ranks times by how many of the calendars are free, and
+    leaves out calendars that can't be read.
+    """
+    client, service = make_client({ "work": [LUNCH, MEETING], "home": [DENTIST] })
+    result = client.get("/groupSlots?selected[]=work&selected[]=home&selected[]=missing"
+                        "&best=3&minutes=60").get_json()
+    assert result["participants"] == [ "work", "home" ]
+    assert [ (slot["begin"], slot["end"], slot["free"]) for slot in result["slots"] ] == [
+        ("2016-02-23T10:30:00-08:00", "2016-02-23T17:00:00-08:00", [ "work", "home" ]),
+        ("2016-02-22T09:00:00-08:00", "2016-02-22T12:00:00-08:00", [ "work", "home" ]),
+        ("2016-02-22T13:00:00-08:00", "2016-02-22T15:00:00-08:00", [ "work", "home" ]) ]
+    assert result["slots"][0]["desc"] == "2/2 available"
+    assert client.get("/groupSlots?selected[]=work&best=-1").status_code == 400
+    assert client.get("/groupSlots?selected[]=work&minutes=-30").status_code == 400
+
+def test_free_slots():
+    """
+    /freeSlots gives meeting slots of the given length in the free
+    times of all the calendars, up to the limit, and reports calendars
+    it can't read.
+    """
+    client, service = make_client({ "work": [LUNCH, MEETING], "home": [DENTIST] })
+    result = client.get("/freeSlots?selected[]=work&selected[]=home&selected[]=missing"
+                        "&minutes=60&step=30&limit=4").get_json()
+    assert [ (slot["begin"], slot["end"]) for slot in result["slots"] ] == [
+        ("2016-02-22T09:00:00-08:00", "2016-02-22T10:00:00-08:00"),
+        ("2016-02-22T09:30:00-08:00", "2016-02-22T10:30:00-08:00"),
+        ("2016-02-22T10:00:00-08:00", "2016-02-22T11:00:00-08:00"),
+        ("2016-02-22T10:30:00-08:00", "2016-02-22T11:30:00-08:00") ]
+    assert len(result["errors"]) == 1 and "missing" in result["errors"][0]
+    result = client.get("/freeSlots?selected[]=home&minutes=60&step=60&limit=20").get_json()
+    assert [ slot["begin"][:16] for slot in result["slots"] if slot["begin"] > "2016-02-23" ] == [
+        "2016-02-23T11:00", "2016-02-23T12:00", "2016-02-23T13:00", "2016-02-23T14:00",
+        "2016-02-23T15:00", "2016-02-23T16:00" ]    # On the hour, after the dentist
+    assert client.get("/freeSlots?selected[]=work&minutes=0").status_code == 400
+    assert client.get("/freeSlots?selected[]=work&limit=-1").status_code == 400
+    assert client.get("/freeSlots?selected[]=work&limit=0").get_json()["slots"] == [ ]
+
+def test_metrics_page():
+    """
+    /metrics is only shown to requests from this machine, and names
+    calendars by position, not by id.
+    """
+    client, service = make_client({ "alice@example.com": [LUNCH] })
+    with unittest.mock.patch.object(main, "METRICS", True):
+        client.get("/calcBusyFreeTimes?selected[]=alice@example.com")
+        assert client.get("/metrics", environ_base={ "REMOTE_ADDR": "10.0.0.1" }).status_code == 404
+        response = client.get("/metrics")
+    assert response.status_code == 200
+    assert "alice" not in response.data.decode()
+    assert "calendar 0" in response.get_json()["recent"][-1]["items_ms"]["fetch"]
+
+def test_display_before_calculating():
+    """
+    Asking to see the busy and free times before they are calculated
+    shows the page without them, and doesn't break later pages.
+    """
+    client, service = make_client({ "work": [LUNCH] })
+    assert client.get("/displayBusyFreeTimes").status_code == 200
+    with client.session_transaction() as s:
+        assert "show_free_busy" not in s
+        s["show_free_busy"] = True    # As left by an earlier version
+    assert client.get("/choose").status_code == 200
+    client.get("/calcBusyFreeTimes?selected[]=work")
+    response = client.get("/displayBusyFreeTimes")
+    assert response.status_code == 200 and b"Lunch" in response.data
+
+def test_freebusy_failed():
+    """
+    A failed freebusy query is reported per calendar, as a failed
+    events fetch is, instead of failing the request.
+    """
+    client, service = make_client({ "work": [LUNCH] })
+    service.freebusy_error = TimeoutError("timed out")
+    assert client.get("/calcBusyFreeTimes?selected[]=work&source=freebusy").status_code == 200
+    lines = client.get("/busyFreeTimes?selected[]=work&source=freebusy").data.decode().splitlines()
+    assert json.loads(lines[0])["type"] == "error" and json.loads(lines[-1])["type"] == "done"
@@ -0,0 +1,85 @@
+"""
+Nose tests for metrics.py
+"""
+
+import metrics
+import gcal
+from fake_gcal import FakeCalendarService
+import json
+import logging
+import time
+
+LUNCH = {"summary": "Lunch", "start": {"dateTime": "2016-02-22T12:00:00-08:00"},
+         "end": {"dateTime": "2016-02-22T13:00:00-08:00"}}
+
+class ListHandler(logging.Handler):
+    def __init__(self):
+        logging.Handler.__init__(self)
+        self.lines = [ ]
+    def emit(self, record):
+        self.lines.append(record.getMessage())
+
+def test_timed():
+    """
+    Stages are totalled in the registry and in the current request.
+    """
+    metrics.REGISTRY.reset()
+    with metrics.timed("outside"):
+        pass
+    timings = metrics.begin_request("/test")
+    for i in range(3):
+        with metrics.timed("work", item="item {}".format(i)):
+            time.sleep(0.01)
+    metrics.count("events", 5)
+    metrics.count("events", 7)
+    assert list(metrics.timed_iter("produce", [1, 2, 3])) == [1, 2, 3]
+    assert metrics.end_request() is timings
+    assert metrics.current() is None
+    snapshot = metrics.REGISTRY.snapshot()
+    assert snapshot["stages"]["work"]["count"] == 3
+    assert snapshot["stages"]["work"]["total_ms"] >= 30
+    assert snapshot["stages"]["outside"]["count"] == 1
+    assert snapshot["stages"]["produce"]["count"] == 1
+    assert snapshot["stages"]["request"]["count"] == 1
+    assert snapshot["counts"]["events"] == {"count": 2, "total": 12, "mean": 6.0, "max": 7}
+    recent = snapshot["recent"][-1]
+    assert recent["request"] == "/test"
+    assert sorted(recent["stages_ms"]) == ["produce", "work"]
+    assert sorted(recent["items_ms"]["work"]) == ["item 0", "item 1", "item 2"]
+    assert recent["counts"] == {"events": 12}
+    json.dumps(snapshot)
+
+def test_fetch_timed():
+    """
+    Calendars fetched in other threads are timed as part of the request.
+    """
+    service = FakeCalendarService({ "cal{}".format(i): [LUNCH] for i in range(4) })
+    metrics.begin_request("/fetch")
+    list(gcal.fetch_calendars(service, ["cal0", "cal1", "cal2", "cal3"]))
+    timings = metrics.end_request()
+    assert sorted(timings.items["fetch"]) == ["calendar 0", "calendar 1", "calendar 2", "calendar 3"]
+
+def test_stream():
+    """
+    A streamed request is finished, and logged, after its last part.
+    """
+    log = logging.getLogger("test_metrics")
+    handler = ListHandler()
+    log.addHandler(handler)
+    log.setLevel(logging.INFO)
+    def parts():
+        for part in ["a", "b"]:
+            with metrics.timed("render"):
+                yield part
+    metrics.begin_request("/stream")
+    lines = metrics.stream(parts(), log)
+    assert metrics.end_request(log) is None     # The handler is done; the stream isn't
+    assert handler.lines == [ ]
+    assert list(lines) == ["a", "b"]
+    assert len(handler.lines) == 1
+    logged = json.loads(handler.lines[0])
+    assert logged["request"] == "/stream"
+    assert logged["event"] == "request_metrics"
+    assert "render" in logged["stages_ms"]
+    assert metrics.current() is None
+    log.removeHandler(handler)
@@ -0,0 +1,160 @@
+"""
+Nose tests for pipeline.py
+"""
+
+from pipeline import *
+from agenda import ComplementMemo
+from fake_gcal import FakeCalendarService
+import contextlib
+import io
+import json
+import os
+import tempfile
+
+def event(summary, begin, end, transparency=None):
+    event = {"summary": summary, "start": {"dateTime": begin}, "end": {"dateTime": end}}
+    if transparency:
+        event["transparency"] = transparency
+    return event
+
+CALENDARS = {
+    "work": [ event("Lunch", "2016-02-22T12:00:00-08:00", "2016-02-22T13:00:00-08:00"),
+              event("Meeting", "2016-02-22T15:00:00-08:00", "2016-02-22T16:00:00-08:00"),
+              event("Late", "2016-02-22T18:00:00-08:00", "2016-02-22T19:00:00-08:00"),
+              event("Reminder", "2016-02-23T11:00:00-08:00", "2016-02-23T11:30:00-08:00",
+                    "transparent") ],
+    "home": [ event("Dentist", "2016-02-23T09:30:00-08:00", "2016-02-23T10:30:00-08:00"),
+              event("Next week", "2016-03-01T09:30:00-08:00", "2016-03-01T10:30:00-08:00") ] }
+
+SPAN = Span("2016-02-22T00:00:00-08:00", "2016-02-23T00:00:00-08:00",
+            "2016-02-22T09:00:00-08:00", "2016-02-22T17:00:00-08:00")
+
+def test_find_busy_free():
+    """
+    Busy times are the events that block time within the range, and
+    free times are the rest of each day's time block.
+    """
+    busy = find_busy(CALENDARS, SPAN)
+    assert [ busy_dict["desc"] for busy_dict in busy ] == [ "Lunch", "Meeting", "Dentist" ]
+    free = find_free(busy, SPAN)
+    assert [ (free_dict["begin"], free_dict["end"]) for free_dict in free ] == [
+        ("2016-02-22T09:00:00-08:00", "2016-02-22T12:00:00-08:00"),
+        ("2016-02-22T13:00:00-08:00", "2016-02-22T15:00:00-08:00"),
+        ("2016-02-22T16:00:00-08:00", "2016-02-22T17:00:00-08:00"),
+        ("2016-02-23T09:00:00-08:00", "2016-02-23T09:30:00-08:00"),
+        ("2016-02-23T10:30:00-08:00", "2016-02-23T17:00:00-08:00") ]
+    assert find_free(busy, SPAN, ComplementMemo()) == free
+    assert Span.from_session(dict(SPAN._asdict(), other="ignored")) == SPAN
+    shown = list(display_list(merge_busy_free(busy, free), tz.tzoffset(None, -8 * 3600)))
+    assert shown[:2] == [ "Available: 02/22/2016 9:00 AM - 02/22/2016 12:00 PM",
+                          "Lunch: 02/22/2016 12:00 PM - 02/22/2016 1:00 PM" ]
+    assert len(shown) == 8
+
+def day_span(first, last):
+    """The span from 9 to 5 Pacific time on days first to last of February 2016."""
+    return Span("2016-02-{:02d}T00:00:00-08:00".format(first),
+                "2016-02-{:02d}T00:00:00-08:00".format(last),
+                "2016-02-22T09:00:00-08:00", "2016-02-22T17:00:00-08:00")
+
+def fetched_busy(service, calendar_ids, span, cached, fetches):
+    """
+    The busy list of span from fetch_busy_days, with the (first, last)
+    days of each fetch added to fetches, and the calendars that failed.
+    """
+    def fetch_busy(first_day, last_day):
+        fetches.append((first_day[:10], last_day[:10]))
+        return fetch_calendar_busy(service, calendar_ids, span, "events", first_day, last_day)
+    days = { }
+    failed = [ calendar_id for calendar_id, busy, error in
+               fetch_busy_days(fetch_busy, calendar_ids, span, days, cached) if error ]
+    return busy_in_range(days, span), failed
+
+def test_fetch_busy_days():
+    """
+    Changing the range only fetches the days not seen before, one fetch
+    for each run of them, and gives the same busy times as fetching
+    the whole range afresh.
+    """
+    overnight = event("Overnight", "2016-02-23T16:00:00-08:00", "2016-02-24T10:00:00-08:00")
+    calendars = { "work": CALENDARS["work"] + [ overnight,
+                      event("Friday", "2016-02-26T10:00:00-08:00", "2016-02-26T11:00:00-08:00") ],
+                  "home": CALENDARS["home"] }
+    service = FakeCalendarService(calendars)
+    ids = [ "work", "home" ]
+    cached = { }
+    fetches = [ ]
+    busy, failed = fetched_busy(service, ids, day_span(23, 24), cached, fetches)
+    assert fetches == [ ("2016-02-23", "2016-02-24") ] and failed == [ ]
+    assert [ busy_dict["desc"] for busy_dict in busy ] == [ "Overnight", "Dentist" ]
+    # Days 22 and 25-26 are new, in two runs; 23 and 24 come from the cache
+    fetches = [ ]
+    busy, failed = fetched_busy(service, ids, day_span(22, 26), cached, fetches)
+    assert fetches == [ ("2016-02-22", "2016-02-22"), ("2016-02-25", "2016-02-26") ]
+    expected = busy_in_range({ "all": find_busy(calendars, day_span(22, 26)) }, day_span(22, 26))
+    assert sorted(busy, key=lambda r: r["begin"]) == sorted(expected, key=lambda r: r["begin"])
+    # The overnight event began on a cached day and is kept, past that day
+    assert "Overnight" in [ busy_dict["desc"] for busy_dict in busy ]
+    assert sorted(cached) == [ "2016-02-{}".format(day) for day in range(22, 27) ]
+    fetches = [ ]
+    fetched_busy(service, ids, day_span(22, 26), cached, fetches)
+    assert fetches == [ ]
+    # 10 AM on the 24th in Tokyo is 5 PM on the 23rd in the range's time zone
+    tokyo = event("Tokyo", "2016-02-24T10:00:00+09:00", "2016-02-24T11:00:00+09:00")
+    service = FakeCalendarService({ "work": [ tokyo ] })
+    cold, failed = fetched_busy(service, [ "work" ], day_span(23, 24), { }, [ ])
+    assert [ busy_dict["desc"] for busy_dict in cold ] == [ "Tokyo" ]
+    cached = { }
+    fetched_busy(service, [ "work" ], day_span(24, 24), cached, [ ])
+    busy, failed = fetched_busy(service, [ "work" ], day_span(23, 24), cached, [ ])
+    assert busy == cold
+    cached = { }
+    fetched_busy(service, [ "work" ], day_span(23, 23), cached, [ ])
+    busy, failed = fetched_busy(service, [ "work" ], day_span(23, 24), cached, [ ])
+    assert busy == cold
+
+def test_fetch_busy_days_failed():
+    """
+    Days for which a calendar can't be read aren't cached.
+    """
+    service = FakeCalendarService(CALENDARS)
+    cached = { }
+    busy, failed = fetched_busy(service, [ "work", "missing" ], day_span(22, 23), cached, [ ])
+    assert failed == [ "missing" ]
+    assert [ busy_dict["desc"] for busy_dict in busy ] == [ "Lunch", "Meeting" ]
+    assert cached == { }
+
+def test_main():
+    """
+    The command line reads an events dump or agenda files.
+    """
+    with tempfile.TemporaryDirectory() as folder:
+        dump = os.path.join(folder, "events.json")
+        with open(dump, "w") as f:
+            json.dump(CALENDARS, f)
+        agenda = os.path.join(folder, "busy.txt")
+        with open(agenda, "w") as f:
+            f.write("02/22/2016 12:00 PM-02/22/2016 1:00 PM|Lunch\n")
+        for source in [ [ "--events", dump ], [ agenda ] ]:
+            out = io.StringIO()
+            with contextlib.redirect_stdout(out):
+                assert main(source + [ "--begin-date", "02/22/2016", "--end-date", "02/22/2016",
+                                       "--begin-time", "9am", "--end-time", "5pm",
+                                       "--tz", "America/Los_Angeles" ]) == 0
+            assert out.getvalue().splitlines()[:3] == [
+                "Available: 02/22/2016 9:00 AM - 02/22/2016 12:00 PM",
+                "Lunch: 02/22/2016 12:00 PM - 02/22/2016 1:00 PM",
+                "Available: 02/22/2016 1:00 PM - 02/22/2016 3:00 PM"
+                if source[0] == "--events" else "Available: 02/22/2016 1:00 PM - 02/22/2016 5:00 PM" ]
+        # Unreadable lines are reported, as batch.py does, and a reversed range is an error
+        with open(agenda, "a") as f:
+            f.write("Not an appointment\n")
+        with contextlib.redirect_stdout(io.StringIO()), contextlib.redirect_stderr(io.StringIO()) as err:
+            assert main([ agenda, "--begin-date", "02/22/2016", "--end-date", "02/22/2016" ]) == 1
+            assert "busy.txt:2: Not an appointment" in err.getvalue()
+            try:
+                main([ agenda, "--begin-date", "02/22/2016", "--end-date", "02/22/2016",
+                       "--begin-time", "5pm", "--end-time", "9am" ])
+                assert False, "Reversed times accepted"
+            except SystemExit as exit:
+                assert exit.code == 2
+            assert "end time is not after begin time" in err.getvalue()
@@ -0,0 +1,120 @@
+"""
+Nose tests for session_store.py
+"""
+
+from session_store import *
+import flask
+import os
+import tempfile
+
+def make_app(store):
+    """
+    A tiny app that keeps a list in its session.
+    """
+    app = flask.Flask(__name__)
+    app.secret_key = "test"
+    app.session_interface = ServerSideSessionInterface(store)
+
+    @app.route("/add/<item>")
+    def add(item):
+        flask.session['items'] = flask.session.get('items', []) + [item]
+        return "ok"
+
+    @app.route("/items")
+    def items():
+        return ",".join(flask.session.get('items', []))
+
+    @app.route("/login")
+    def login():
+        flask.session['credentials'] = "secret"
+        flask.session.regenerate()
+        return "ok"
+
+    @app.route("/clear")
+    def clear():
+        flask.session.clear()
+        return "ok"
+
+    return app
+
+def check_store(store):
+    app = make_app(store)
+    client = app.test_client()
+    big = "x" * 10000
+    response = client.get("/add/" + big)
+    cookie = response.headers["Set-Cookie"]
+    assert len(cookie) < 200
+    client.get("/add/y")
+    assert client.get("/items").data.decode() == big + ",y"
+    assert len(store) == 1
+    # A different browser has its own session
+    assert app.test_client().get("/items").data.decode() == ""
+    metrics = app.session_interface.metrics
+    assert metrics["saves"] == 2
+    assert metrics["bytes_saved"] > 10000
+    client.get("/clear")
+    assert len(store) == 0
+    assert client.get("/items").data.decode() == ""
+
+def test_memory_store():
+    check_store(MemoryStore())
+
+def session_key(response):
+    return response.headers["Set-Cookie"].split(";")[0].split("=", 1)[1]
+
+def test_regenerate():
+    """
+    Logging in moves the session to a new key, so a key planted
+    beforehand doesn't lead to the logged-in session; the cookie keeps
+    the SameSite setting.
+    """
+    store = MemoryStore()
+    app = make_app(store)
+    app.config["SESSION_COOKIE_SAMESITE"] = "Lax"
+    client = app.test_client()
+    response = client.get("/add/x")
+    assert "SameSite=Lax" in response.headers["Set-Cookie"]
+    old_key = session_key(response)
+    new_key = session_key(client.get("/login"))
+    assert new_key != old_key
+    assert store.get(old_key) is None
+    assert "secret" in store.get(new_key)
+    assert client.get("/items").data.decode() == "x"
+    assert len(store) == 1
+
+def test_sqlite_store():
+    with tempfile.TemporaryDirectory() as tmp:
+        check_store(SqliteStore(os.path.join(tmp, "sessions.db")))
+
+def test_memory_store_eviction():
+    store = MemoryStore(max_entries=3, max_bytes=100)
+    for key in "abcd":
+        store.put(key, "1234567890")
+    assert store.get("a") is None
+    assert store.get("b") == "1234567890"
+    store.put("e", "x" * 90)
+    # b was used most recently before e, so c and d go first
+    assert store.get("c") is None and store.get("d") is None
+    assert store.get("b") == "1234567890"
+    assert store.size == 100
+
+def test_sqlite_store_eviction():
+    with tempfile.TemporaryDirectory() as tmp:
+        store = SqliteStore(os.path.join(tmp, "sessions.db"), max_entries=2)
+        for key in "abc":
+            store.put(key, key * 3)
+        assert len(store) == 2
+        assert store.get("a") is None
+        assert store.get("c") == "ccc"
+
+def test_sqlite_store_size_limit():
+    with tempfile.TemporaryDirectory() as tmp:
+        store = SqliteStore(os.path.join(tmp, "sessions.db"), max_bytes=100)
+        for key in "abcd":
+            store.put(key, key * 30)
+        # Only the three most recent fit in 100 bytes
+        assert len(store) == 3
+        assert store.get("a") is None
+        store.put("e", "e" * 90)
+        assert len(store) == 1
+        assert store.get("e") == "e" * 90
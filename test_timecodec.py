@@ -0,0 +1,74 @@
+"""
+Nose tests for timecodec.py
+"""
+
+from timecodec import *
+import arrow
+import random
+
+# The forms of date-time strings we store: from the calendar API, from
+# the session (interpret_date and interpret_time), and from Appt.to_dict
+FORMATS = [ "2016-02-22T12:00:00-08:00",
+            "2016-02-22T12:00:00+00:00",
+            "2016-02-22T12:00:00Z",
+            "2016-02-22T12:00:00",
+            "2016-02-22T23:30:00+05:30",
+            "2016-02-22T12:00:00.250000-08:00",
+            "0001-01-01T09:00:00-08:00" ]
+
+def test_parse_like_arrow():
+    """
+    Each stored form parses to the same time, time zone and ISO string
+    as with arrow.get.
+    """
+    for text in FORMATS:
+        expected = arrow.get(text)
+        when = parse_datetime(text)
+        assert when == expected.datetime
+        assert when.utcoffset() == expected.utcoffset()
+        assert when.isoformat() == expected.isoformat()
+        assert parse_arrow(text) == expected
+        assert parse_arrow(text).isoformat() == expected.isoformat()
+        if text[:4] != "0001":
+            assert parse_epoch(text) == (expected.timestamp, when.tzinfo)
+
+def test_isoformat_round_trip():
+    """
+    Formatting epoch seconds in a time zone gives what arrow gives,
+    and parses back to the same seconds.
+    """
+    rng = random.Random(19)
+    for trial in range(100):
+        epoch = rng.randrange(0, 2 ** 31)
+        tzinfo = tzoffset(rng.randrange(-12 * 4, 14 * 4) * 15 * 60)
+        text = isoformat(epoch, tzinfo)
+        assert text == arrow.Arrow.fromtimestamp(epoch, tzinfo).isoformat()
+        assert parse_epoch(text) == (epoch, tzinfo)
+    assert tzoffset(3600) is tzoffset(3600)
+
+def test_parse_errors():
+    """
+    Strings that aren't ISO date-times raise ValueError.
+    """
+    for text in [ "", "02/22/2016", "2016-02-22T25:00:00-08:00", "noon" ]:
+        try:
+            parse_datetime(text)
+            assert False, text
+        except ValueError:
+            pass
+
+def test_display_formatter():
+    """
+    Display strings are the same as arrow's, in local time or a
+    given time zone.
+    """
+    rng = random.Random(20)
+    local = DisplayFormatter()
+    pacific = DisplayFormatter(tzoffset(-8 * 3600))
+    for trial in range(200):
+        epoch = rng.randrange(0, 2 ** 31, 60)
+        text = isoformat(epoch, tzoffset(rng.randrange(-12, 14) * 3600))
+        assert local.format(text) == arrow.get(text).to('local').format('MM/DD/YYYY h:mm A')
+        assert pacific.format(text) == arrow.get(text).to('-08:00').format('MM/DD/YYYY h:mm A')
+    assert pacific.format("2016-02-22T00:05:00-08:00") == "02/22/2016 12:05 AM"
+    assert pacific.format("2016-02-22T12:00:00-08:00") == "02/22/2016 12:00 PM"
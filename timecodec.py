@@ -0,0 +1,106 @@
+"""
+Fast conversion of the ISO 8601 date-time strings we store (in the
+session, and from the calendar API) to and from what the agenda and
+the app work with: epoch seconds, datetimes and arrow objects.
+
+arrow.get() on an ISO string tries arrow's general parser, which is
+slow enough to dominate request time when a calendar has thousands of
+events.  Our strings all look like "2016-02-22T12:00:00-08:00", which
+datetime.fromisoformat reads directly; the fixed-offset time zones
+are cached so each offset is only built once.  The results are the
+same as arrow's, down to the type of time zone, so values from here
+and from arrow can be mixed freely.
+"""
+
+import datetime
+
+import arrow
+from dateutil import tz
+
+_EPOCH = datetime.datetime(1970, 1, 1, tzinfo=datetime.timezone.utc)
+_SECOND = datetime.timedelta(seconds=1)
+
+_tz_cache = { }   # UTC offset in seconds -> tzinfo
+
+
+def tzoffset(seconds):
+    """
+    The time zone seconds ahead of UTC, as arrow would give it for an
+    ISO string with that offset; the same object every time.
+    """
+    tzinfo = _tz_cache.get(seconds)
+    if tzinfo is None:
+        tzinfo = _tz_cache[seconds] = tz.tzoffset(None, seconds)
+    return tzinfo
+
+
+def parse_datetime(text):
+    """
+    An aware datetime from an ISO 8601 date-time string.  Strings
+    without an offset, or ending in Z, are in UTC, as for arrow.get.
+
+    Raises:
+        ValueError if text isn't an ISO 8601 date-time
+    """
+    if text.endswith("Z"):
+        return datetime.datetime.fromisoformat(text[:-1]).replace(tzinfo=tz.tzutc())
+    when = datetime.datetime.fromisoformat(text)
+    offset = when.utcoffset()
+    if offset is None:
+        return when.replace(tzinfo=tz.tzutc())
+    return when.replace(tzinfo=tzoffset(offset // _SECOND))
+
+
+def parse_epoch(text):
+    """
+    (epoch seconds, tzinfo) of an ISO 8601 date-time string; the
+    seconds are whole, as arrow's timestamp is.
+    """
+    when = parse_datetime(text)
+    return (when - _EPOCH) // _SECOND, when.tzinfo
+
+
+def parse_arrow(text):
+    """An arrow object from an ISO 8601 date-time string, like arrow.get(text)."""
+    when = parse_datetime(text)
+    return arrow.Arrow.fromdatetime(when, when.tzinfo)
+
+
+def isoformat(epoch, tzinfo=None):
+    """
+    The ISO 8601 string of epoch seconds in time zone tzinfo (local
+    time if None), as arrow.Arrow.fromtimestamp(epoch, tzinfo).isoformat()
+    would give it.
+    """
+    return datetime.datetime.fromtimestamp(epoch, tzinfo or tz.tzlocal()).isoformat()
+
+
+class DisplayFormatter:
+    """
+    Shows ISO date-time strings in a time zone (local time unless
+    given) as "MM/DD/YYYY h:mm A", the same as
+        arrow.get(text).to('local').format('MM/DD/YYYY h:mm A')
+    but for many strings at a time: the time zone is looked up once,
+    the date part is built once for each day, and a string seen
+    before (the end of one appointment is often the beginning of the
+    next) isn't converted again.
+    """
+
+    def __init__(self, tzinfo=None):
+        self.tzinfo = tzinfo or tz.tzlocal()
+        self._days = { }     # date -> "MM/DD/YYYY "
+        self._shown = { }    # ISO string -> display string
+
+    def format(self, text):
+        """The display string of an ISO date-time string."""
+        shown = self._shown.get(text)
+        if shown is None:
+            when = parse_datetime(text).astimezone(self.tzinfo)
+            day = when.date()
+            prefix = self._days.get(day)
+            if prefix is None:
+                prefix = self._days[day] = "{:02d}/{:02d}/{:04d} ".format(
+                    when.month, when.day, when.year)
+            shown = self._shown[text] = "{}{}:{:02d} {}".format(
+                prefix, when.hour % 12 or 12, when.minute, "AM" if when.hour < 12 else "PM")
+        return shown